@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from stellar_sdk import FeeBumpTransactionEnvelope, Keypair, Network, TransactionEnvelope
+
+# A local stand-in for Horizon, a stellar.toml host and a federation server. Accounts exist on first use, every
+# submitted transaction is applied after a sequence check, and --latency adds a fixed delay to every answer, so runs
+# are repeatable without touching the network.
+
+ASSET_CODE = "BENCH"
+ASSET_ISSUER = Keypair.from_raw_ed25519_seed(hashlib.sha256(b"mock-horizon-issuer").digest()).public_key
+FEDERATION_ACCOUNT = Keypair.from_raw_ed25519_seed(hashlib.sha256(b"mock-horizon-federation").digest()).public_key
+START_SEQUENCE = 1000 << 32
+BASE_FEE = 100
+BASE_RESERVE = 5000000
+
+
+class MockLedger:
+
+    def __init__(self, network_passphrase):
+        self.network_passphrase = network_passphrase
+        self.ledger = 1000
+        self.sequences = {}
+        self.transactions = {}
+        self.account_transactions = {}
+        self.missing_accounts = set()
+        self.base_reserve = BASE_RESERVE
+        self.lock = threading.Lock()
+
+    def account(self, account_id):
+        # None for the accounts a test marked as missing
+        if account_id in self.missing_accounts:
+            return None
+        with self.lock:
+            sequence = self.sequences.setdefault(account_id, START_SEQUENCE)
+        return {
+            "id": account_id,
+            "account_id": account_id,
+            "sequence": str(sequence),
+            "paging_token": account_id,
+            "subentry_count": 0,
+            "thresholds": {"low_threshold": 0, "med_threshold": 0, "high_threshold": 0},
+            "flags": {"auth_required": False, "auth_revocable": False, "auth_immutable": False},
+            "balances": [
+                {"balance": "1000.0000000", "asset_type": "credit_alphanum4", "asset_code": ASSET_CODE,
+                 "asset_issuer": ASSET_ISSUER, "limit": "922337203685.4775807"},
+                {"balance": "10000.0000000", "asset_type": "native"}
+            ],
+            "signers": [{"key": account_id, "weight": 1, "type": "ed25519_public_key"}],
+            "data": {}
+        }
+
+    def submit(self, envelope_xdr):
+        # returns (status, body) like Horizon's POST /transactions
+        try:
+            envelope = TransactionEnvelope.from_xdr(envelope_xdr, network_passphrase=self.network_passphrase)
+            inner = envelope
+        except Exception:
+            envelope = FeeBumpTransactionEnvelope.from_xdr(envelope_xdr, network_passphrase=self.network_passphrase)
+            inner = envelope.transaction.inner_transaction_envelope
+        transaction = inner.transaction
+        source = getattr(transaction.source, "account_id", None) or transaction.source.public_key
+        transaction_hash = envelope.hash_hex()
+        with self.lock:
+            # like stellar-core, an envelope that was already applied fails the sequence check
+            current = self.sequences.setdefault(source, START_SEQUENCE)
+            if transaction.sequence != current + 1:
+                return 400, {"type": "https://stellar.org/horizon-errors/transaction_failed",
+                             "title": "Transaction Failed", "status": 400,
+                             "extras": {"envelope_xdr": envelope_xdr,
+                                        "result_codes": {"transaction": "tx_bad_seq"}}}
+            self.sequences[source] = transaction.sequence
+            self.ledger += 1
+            record = {
+                "id": transaction_hash,
+                "hash": transaction_hash,
+                "paging_token": str(self.ledger << 32),
+                "ledger": self.ledger,
+                "successful": True,
+                "source_account": source,
+                "source_account_sequence": str(transaction.sequence),
+                "fee_charged": str(BASE_FEE * max(1, len(transaction.operations))),
+                "operation_count": len(transaction.operations),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "envelope_xdr": envelope_xdr,
+                "result_xdr": "",
+                "memo_type": "none"
+            }
+            self.transactions[transaction_hash] = record
+            self.account_transactions.setdefault(source, []).append(record)
+        return 200, record
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    ledger = None
+    latency = 0.0
+    # fault injection for tests: submissions applied but answered with 504, and transaction lookups answered with 404
+    dropped_submissions = 0
+    hidden_lookups = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, content_type="application/json"):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def not_found(self):
+        self.send_json(404, {"type": "https://stellar.org/horizon-errors/not_found", "title": "Resource Missing",
+                             "status": 404})
+
+    def base_url(self):
+        return "http://{}".format(self.headers.get("Host"))
+
+    def page(self, records):
+        return {"_links": {}, "_embedded": {"records": records}}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        if len(parts) == 0:
+            self.send_json(200, {"history_latest_ledger": self.ledger.ledger, "core_latest_ledger": self.ledger.ledger,
+                                 "network_passphrase": self.ledger.network_passphrase})
+        elif parts == [".well-known", "stellar.toml"]:
+            self.send_json(200, 'FEDERATION_SERVER="{}/federation"\n\n[[CURRENCIES]]\ncode="{}"\nissuer="{}"\n'.format(
+                self.base_url(), ASSET_CODE, ASSET_ISSUER), content_type="text/plain")
+        elif parts == ["federation"]:
+            self.send_json(200, {"stellar_address": query.get("q", [""])[0], "account_id": FEDERATION_ACCOUNT})
+        elif parts == ["fee_stats"]:
+            percentiles = {"p{}".format(p): str(BASE_FEE) for p in (10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99)}
+            percentiles.update({"max": str(BASE_FEE), "min": str(BASE_FEE), "mode": str(BASE_FEE)})
+            self.send_json(200, {"last_ledger": str(self.ledger.ledger), "last_ledger_base_fee": str(BASE_FEE),
+                                 "ledger_capacity_usage": "0.1", "fee_charged": percentiles,
+                                 "max_fee": percentiles})
+        elif parts == ["ledgers"]:
+            self.send_json(200, self.page([{"sequence": self.ledger.ledger, "base_fee_in_stroops": BASE_FEE,
+                                            "base_reserve_in_stroops": self.ledger.base_reserve}]))
+        elif len(parts) == 2 and parts[0] == "accounts":
+            account = self.ledger.account(parts[1])
+            if account is None:
+                self.not_found()
+            else:
+                self.send_json(200, account)
+        elif len(parts) == 3 and parts[0] == "accounts" and parts[2] == "transactions":
+            self.send_json(200, self.page(list(self.ledger.account_transactions.get(parts[1], []))))
+        elif len(parts) == 3 and parts[0] == "accounts":
+            self.send_json(200, self.page([]))
+        elif len(parts) == 2 and parts[0] == "transactions":
+            record = self.ledger.transactions.get(parts[1])
+            if self.hidden_lookups > 0:
+                type(self).hidden_lookups -= 1
+                record = None
+            if record is None:
+                self.not_found()
+            else:
+                self.send_json(200, record)
+        elif len(parts) == 2 and parts[0] == "paths":
+            # one direct 1:1 path for whatever pair is asked
+            amount = (query.get("source_amount") or query.get("destination_amount") or ["1"])[0]
+            self.send_json(200, self.page([{"source_asset_type": "native", "source_amount": amount,
+                                            "destination_asset_type": "native", "destination_amount": amount,
+                                            "path": []}]))
+        elif parts == ["order_book"]:
+            self.send_json(200, {"bids": [{"price": "1.0000000", "amount": "1000.0000000"}],
+                                 "asks": [{"price": "1.0000000", "amount": "1000.0000000"}]})
+        else:
+            self.not_found()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/transactions":
+            self.not_found()
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        status, body = self.ledger.submit(form.get("tx", [""])[0])
+        if status == 200 and self.dropped_submissions > 0:
+            type(self).dropped_submissions -= 1
+            status, body = 504, {"type": "https://stellar.org/horizon-errors/timeout", "title": "Timeout",
+                                 "status": 504}
+        self.send_json(status, body)
+
+
+def start_mock_horizon(host="127.0.0.1", port=0, latency=0.0, network_passphrase=Network.TESTNET_NETWORK_PASSPHRASE):
+    # serves in a daemon thread; returns (server, base_url) and server.shutdown() stops it
+    handler = type("Handler", (MockRequestHandler,), {"ledger": MockLedger(network_passphrase), "latency": latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}".format(host, server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Horizon/stellar.toml/federation stand-in")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every answer")
+    args = parser.parse_args()
+    server, base_url = start_mock_horizon(host=args.host, port=args.port, latency=args.latency)
+    print("Mock Horizon on {} (use --horizon {} and STELLAR_CLI_TOML_URL=http://{{}}/.well-known/stellar.toml)".format(
+        base_url, base_url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
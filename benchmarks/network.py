@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from mock_horizon import ASSET_CODE, ASSET_ISSUER, START_SEQUENCE, start_mock_horizon
+
+# Latency percentiles and transaction throughput of the network commands, run end to end (one CLI process per run)
+# against the local stand-in from mock_horizon.py, so results only change when the code does.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, "stellar-cli.py")
+WALLET = os.path.join(ROOT, "test_wallet.json")
+WALLET_ACCOUNT = "GCREGQJ46EELU5LAR2SSSR7CWIVJFB56YM73HXQUNR455KFPI6QAGSRY"
+DESTINATION = "GATU7FV3IOUI4M6QWQXWSDUVTJJKD7ONJSBOJ4IJEETE5SPBW6JHAI22"
+WORK_DIR = tempfile.mkdtemp(prefix="stellar-cli-bench-")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def write_payments_file(name, rows, domain=None):
+    # with a domain every fourth row pays the TOML asset and every fifth one a federation address
+    payment_file = os.path.join(WORK_DIR, "{}.csv".format(name))
+    with open(payment_file, "w") as f:
+        f.write("destination,amount,asset,issuer\n")
+        for i in range(rows):
+            destination = "bench{}*{}".format(i, domain) if domain and i % 5 == 0 else DESTINATION
+            asset = "{}@{}".format(ASSET_CODE, domain) if domain and i % 4 == 0 else ""
+            f.write("{},1,{},\n".format(destination, asset))
+    return payment_file
+
+
+def reset_sequences(server, sequence_file):
+    # offline builds start from the mock's initial sequence, so their envelopes can be submitted afterwards
+    server.RequestHandlerClass.ledger.sequences.pop(WALLET_ACCOUNT, None)
+    with open(sequence_file, "w") as f:
+        f.write(json.dumps({WALLET_ACCOUNT: str(START_SEQUENCE)}))
+
+
+def extract_xdr(report_file, xdr_file):
+    # send_batch --justsign writes NDJSON report lines; submit_tx -f wants one envelope per line
+    with open(report_file) as f:
+        envelopes = [json.loads(line).get("xdr") for line in f if line.strip()]
+    with open(xdr_file, "w") as f:
+        f.write("\n".join([e for e in envelopes if e]) + "\n")
+
+
+def get_scenarios(server, horizon_url, rows, batch_size, env, timeout):
+    # name -> (argv, transactions per run, untimed preparation before every run)
+    domain = horizon_url.split("://", 1)[1]
+    base = ["-t", "-w", WALLET, "--horizon", horizon_url]
+    payment_file = write_payments_file("payments", rows, domain=domain)
+    plain_payment_file = write_payments_file("plain-payments", rows)
+    sequence_file = os.path.join(WORK_DIR, "sequences.json")
+    signed_file = os.path.join(WORK_DIR, "signed.ndjson")
+    xdr_file = os.path.join(WORK_DIR, "signed.xdr")
+    offline_argv = base + ["--sequence-file", sequence_file, "send_batch", "-f", plain_payment_file,
+                           "--batch-size", "1", "--report", signed_file]
+
+    def prepare_submit():
+        reset_sequences(server, sequence_file)
+        run_command(offline_argv, env, timeout)
+        extract_xdr(signed_file, xdr_file)
+
+    return {
+        "send_payment": (base + ["send_payment", "-p", "1", "-d", DESTINATION], 1, None),
+        "send_payment_toml": (base + ["--no-cache", "send_payment", "-p", "1", "-d", DESTINATION,
+                                      "-a", "{}@{}".format(ASSET_CODE, domain)], 1, None),
+        "send_payment_federation": (base + ["--no-cache", "send_payment", "-p", "1",
+                                            "-d", "bench*{}".format(domain)], 1, None),
+        "add_trust": (base + ["add_trust", "-a", ASSET_CODE, "-i", ASSET_ISSUER], 1, None),
+        "list_balances": (base + ["list_balances"], 0, None),
+        "send_batch": (base + ["send_batch", "-f", payment_file, "--batch-size", str(batch_size),
+                               "--report", os.devnull], (rows + batch_size - 1) // batch_size, None),
+        "offline_build": (offline_argv, rows, lambda: reset_sequences(server, sequence_file)),
+        "submit_tx_batch": (base + ["submit_tx", "-f", xdr_file, "--report", os.devnull], rows, prepare_submit),
+    }
+
+
+def run_command(argv, env, timeout):
+    start = time.perf_counter()
+    # submit_tx -f asks for a confirmation on stdin
+    process = subprocess.run([sys.executable, CLI] + argv, input=b"SUBMIT\n", stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, timeout=timeout, env=env, cwd=ROOT)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise Exception("{} failed: {}".format(" ".join(argv), process.stderr.decode(errors="replace")[-500:]))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Network command latency and throughput against a mock Horizon")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="runs per scenario")
+    parser.add_argument("--rows", type=int, default=200, help="payments per batch scenario")
+    parser.add_argument("--batch-size", type=int, default=100, help="operations per transaction in send_batch")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the mock adds to every answer")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds before a run is considered hung")
+    parser.add_argument("-o", "--output", type=str, help="save the results as JSON")
+    parser.add_argument("--baseline", type=str, help="compare against results saved with -o")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative p50 latency increase over the baseline")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default: all)")
+    args = parser.parse_args()
+    server, horizon_url = start_mock_horizon(latency=args.latency)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", XDG_CACHE_HOME=WORK_DIR,
+               STELLAR_CLI_TOML_URL="http://{}/.well-known/stellar.toml")
+    scenarios = get_scenarios(server, horizon_url, args.rows, args.batch_size, env, args.timeout)
+    results = {}
+    try:
+        for name in args.scenarios or scenarios.keys():
+            argv, transactions, prepare = scenarios[name]
+            timings = []
+            for i in range(args.repeat):
+                if prepare is not None:
+                    prepare()
+                timings.append(run_command(argv, env, args.timeout))
+            total = sum(timings)
+            results[name] = {
+                "runs": len(timings),
+                "p50_ms": round(percentile(timings, 50) * 1000, 2),
+                "p90_ms": round(percentile(timings, 90) * 1000, 2),
+                "p99_ms": round(percentile(timings, 99) * 1000, 2),
+                "tx_per_s": round(transactions * len(timings) / total, 2) if transactions > 0 else None
+            }
+            print("{:<26} p50 {:>9.2f} ms   p90 {:>9.2f} ms   p99 {:>9.2f} ms   {}".format(
+                name, results[name]["p50_ms"], results[name]["p90_ms"], results[name]["p99_ms"],
+                "" if results[name]["tx_per_s"] is None else "{} tx/s".format(results[name]["tx_per_s"])))
+    finally:
+        server.shutdown()
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=4))
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.loads(f.read())
+        regressions = []
+        for name, result in results.items():
+            if name in baseline and result["p50_ms"] > baseline[name]["p50_ms"] * (1 + args.tolerance):
+                regressions.append(name)
+                print("REGRESSION {}: {} ms -> {} ms".format(name, baseline[name]["p50_ms"], result["p50_ms"]))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measures how much of each command's startup is spent importing modules (python -X importtime).
+# Commands that go on to talk to Horizon are stopped after --timeout seconds; only their import phase is measured.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, "stellar-cli.py")
+WALLET = os.path.join(ROOT, "test_wallet.json")
+CACHE_DIR = tempfile.mkdtemp(prefix="stellar-cli-bench-")
+DESTINATION = "GATU7FV3IOUI4M6QWQXWSDUVTJJKD7ONJSBOJ4IJEETE5SPBW6JHAI22"
+
+COMMANDS = {
+    "help": ["--help"],
+    "show_wallet_address": ["show_wallet_address", "-w", WALLET],
+    "cache_purge": ["cache_purge"],
+    "list_balances": ["-t", "-w", WALLET, "list_balances"],
+    "list_transactions": ["-t", "-w", WALLET, "list_transactions"],
+    "send_payment": ["-t", "-w", WALLET, "send_payment", "--justsign", "-p", "1", "-d", DESTINATION],
+}
+
+
+def parse_importtime(stderr):
+    # lines look like "import time:  self [us] | cumulative | imported package"; top level packages have no indent
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:"):].split("|", 2)
+        if name.startswith(" ") and not name.startswith("  "):
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(argv, timeout):
+    # a throwaway cache directory keeps cache_purge (and cached lookups) away from the real cache
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", XDG_CACHE_HOME=CACHE_DIR)
+    start = time.perf_counter()
+    try:
+        process = subprocess.run([sys.executable, "-X", "importtime", CLI] + argv, stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout, env=env,
+                                 cwd=ROOT)
+        stderr = process.stderr
+    except subprocess.TimeoutExpired as e:
+        stderr = e.stderr or b""
+    wall_time = time.perf_counter() - start
+    modules = parse_importtime(stderr.decode(errors="replace"))
+    return sum(modules.values()) / 1000.0, wall_time * 1000.0, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time per stellar-cli command")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="runs per command, the fastest one is kept")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a command is stopped")
+    parser.add_argument("-o", "--output", type=str, help="save the results as JSON")
+    parser.add_argument("--baseline", type=str, help="compare against results saved with -o")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative import time increase over the baseline")
+    parser.add_argument("commands", nargs="*", help="commands to measure (default: all)")
+    args = parser.parse_args()
+    results = {}
+    for name in args.commands or COMMANDS.keys():
+        runs = [measure(COMMANDS[name], args.timeout) for i in range(args.repeat)]
+        import_ms, wall_ms, modules = min(runs, key=lambda r: r[0])
+        slowest = sorted(modules.items(), key=lambda m: m[1], reverse=True)[:5]
+        results[name] = {
+            "import_ms": round(import_ms, 2),
+            "wall_ms": round(wall_ms, 2),
+            "slowest_imports_ms": {module: round(us / 1000.0, 2) for module, us in slowest}
+        }
+        print("{:<22} import {:>9.2f} ms   wall {:>9.2f} ms".format(name, import_ms, wall_ms))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=4))
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.loads(f.read())
+        regressions = []
+        for name, result in results.items():
+            if name in baseline and result["import_ms"] > baseline[name]["import_ms"] * (1 + args.tolerance):
+                regressions.append(name)
+                print("REGRESSION {}: {} ms -> {} ms".format(name, baseline[name]["import_ms"], result["import_ms"]))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import argparse
+import os
 import sys
-import stellarops.operations as operations
+import stellarops.cache as cache
+import stellarops.trace as trace
 
 COMMAND_CREATE_WALLET = "create_wallet"
 COMMAND_SHOW_WALLET_ADDRESS = "show_wallet_address"
@@ -11,6 +13,24 @@ COMMAND_LIST_TRANSACTIONS = "list_transactions"
 COMMAND_LIST_ASSET_BALANCE = "list_asset_balance"
 COMMAND_SIGN_TX = "sign_tx"
 COMMAND_SUBMIT_TX = "submit_tx"
+COMMAND_SEND_BATCH = "send_batch"
+COMMAND_CREATE_CHANNELS = "create_channels"
+COMMAND_CACHE_PURGE = "cache_purge"
+COMMAND_SYNC = "sync"
+COMMAND_QUERY = "query"
+COMMAND_WATCH = "watch"
+COMMAND_BALANCE_REPORT = "balance_report"
+COMMAND_SERVE = "serve"
+COMMAND_AGENT = "agent"
+COMMAND_UNLOCK = "unlock"
+COMMAND_LOCK = "lock"
+COMMAND_MIGRATE_WALLET = "migrate_wallet"
+COMMAND_PATH_SEND = "path_send"
+COMMAND_PATH_RECEIVE = "path_receive"
+COMMAND_ORDER_BOOK = "order_book"
+COMMAND_DERIVE = "derive"
+COMMAND_TRUST_BATCH = "trust_batch"
+COMMAND_SWEEP = "sweep"
 
 SUPPORTED_COMMANDS = {
     COMMAND_CREATE_WALLET: "",
@@ -22,9 +42,31 @@ SUPPORTED_COMMANDS = {
     COMMAND_LIST_TRANSACTIONS: "",
     COMMAND_SIGN_TX: "",
     COMMAND_SUBMIT_TX: "",
+    COMMAND_SEND_BATCH: "",
+    COMMAND_CREATE_CHANNELS: "",
+    COMMAND_CACHE_PURGE: "",
+    COMMAND_SYNC: "",
+    COMMAND_QUERY: "",
+    COMMAND_WATCH: "",
+    COMMAND_BALANCE_REPORT: "",
+    COMMAND_SERVE: "",
+    COMMAND_AGENT: "",
+    COMMAND_UNLOCK: "",
+    COMMAND_LOCK: "",
+    COMMAND_MIGRATE_WALLET: "",
+    COMMAND_PATH_SEND: "",
+    COMMAND_PATH_RECEIVE: "",
+    COMMAND_ORDER_BOOK: "",
+    COMMAND_DERIVE: "",
+    COMMAND_TRUST_BATCH: "",
+    COMMAND_SWEEP: "",
 
 }
 
+# commands that build and sign their own envelopes, and so can take sequence numbers from --sequence-file
+OFFLINE_BUILD_COMMANDS = (COMMAND_SEND_PAYMENT, COMMAND_SEND_BATCH, COMMAND_PATH_SEND, COMMAND_PATH_RECEIVE,
+                          COMMAND_TRUST_BATCH)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("command", type=str, choices=SUPPORTED_COMMANDS.keys(),
@@ -39,11 +81,90 @@ if __name__ == "__main__":
     parser.add_argument("--qrlink", action="store_true", help="generate qr code link")
     parser.add_argument("--justsign", action="store_true", help="just sign the transaction, don't submit it")
     parser.add_argument("--mnemonic", action="store_true", help="generate address from mnemonic")
+    parser.add_argument("--watch-only", action="store_true",
+                        help="create_wallet: save only the public key given with -d (no private key)")
     parser.add_argument("--vzero", action="store_true", help="use version zero of stellar TX")
     parser.add_argument("--timeout", type=int, help="Transaction validity in seconds")
+    parser.add_argument("-f", "--file", type=str, help="input file (CSV or JSONL payments file for send_batch)")
+    parser.add_argument("--report", type=str, help="write per-row NDJSON report to this file instead of stdout")
+    parser.add_argument("--reject-file", type=str,
+                        help="write rows rejected before signing (bad rows, missing accounts/trustlines) as JSONL")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="don't check that destinations exist and trust the asset before building payments")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="maximum number of operations per transaction (max 100)")
+    parser.add_argument("--channels", action="store_true",
+                        help="use the channel accounts stored next to the wallet as transaction sources")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="maximum number of concurrent Horizon/TOML/federation requests")
+    parser.add_argument("--stream", action="store_true",
+                        help="list_transactions: walk all pages and write one NDJSON record per transaction")
+    parser.add_argument("-o", "--output", type=str,
+                        help="write streamed/queried records to this file instead of stdout")
+    parser.add_argument("--since", type=str, help="only transactions created at/after this ISO 8601 date")
+    parser.add_argument("--until", type=str, help="only transactions created at/before this ISO 8601 date")
+    parser.add_argument("--limit", type=int, help="maximum number of records to write")
+    parser.add_argument("--cursor", type=str, help="start after this Horizon paging token")
+    parser.add_argument("--cursor-file", type=str,
+                        help="read the start cursor from and save the last written cursor to this file")
+    parser.add_argument("--db", type=str, help="path of the local history database used by sync/query")
+    parser.add_argument("--counterparty", type=str, help="query: only operations with this counterparty account")
+    parser.add_argument("--memo", type=str, help="query: only operations of transactions with this memo")
+    parser.add_argument("--effects", action="store_true", help="watch: follow effects instead of payments")
+    parser.add_argument("--hook", type=str, help="watch: shell command run per event, with the event JSON on stdin")
+    parser.add_argument("--accounts", type=str,
+                        help="comma separated wallet files/public keys, or a file listing one per line")
+    parser.add_argument("--assets", type=str,
+                        help="trust_batch/sweep: comma separated assets (CODE:ISSUER or CODE@domain) or a file, one per line")
+    parser.add_argument("--trust-limit", type=str, help="trust_batch: trustline limit (default: maximum)")
+    parser.add_argument("--remove", action="store_true", help="trust_batch: remove the trustlines instead")
+    parser.add_argument("--merge", action="store_true",
+                        help="sweep: also remove the trustlines and merge the accounts into the destination")
+    parser.add_argument("--table", action="store_true", help="balance_report: print a text table instead of JSON")
+    parser.add_argument("--host", type=str, help="serve: listen on this address instead of a unix socket")
+    parser.add_argument("--port", type=int, help="serve: listen on this TCP port instead of a unix socket")
+    parser.add_argument("--socket", type=str, help="serve: path of the unix socket to listen on")
+    parser.add_argument("--token-file", type=str, help="serve: file holding the API bearer token (created if missing)")
+    parser.add_argument("--max-fee", type=int,
+                        help="maximum fee per operation in stroops (signing policy and fee-bump limit)")
+    parser.add_argument("--fee-percentile", type=int,
+                        help="pick the per-operation fee from this percentile of Horizon fee_stats (default 70)")
+    parser.add_argument("--send-asset", type=str, default="XLM",
+                        help="asset spent by path payments / sold in order_book: XLM, CODE:ISSUER or CODE@domain")
+    parser.add_argument("--slippage", type=float, default=1.0,
+                        help="path payments: allowed price movement from the quoted path in percent (default 1)")
+    parser.add_argument("--base-fee", type=int,
+                        help="fee per operation in stroops, instead of choosing one from Horizon fee_stats")
+    parser.add_argument("--sequence-file", type=str,
+                        help="offline build: JSON {account: sequence} used and advanced instead of Horizon "
+                             "(implies --justsign)")
+    parser.add_argument("--kdf", type=str, default="scrypt", choices=["scrypt", "pbkdf2-sha256"],
+                        help="key derivation function for new/migrated wallet files")
+    parser.add_argument("--agent-timeout", type=int, default=900,
+                        help="seconds the agent keeps an unlocked wallet key")
+    parser.add_argument("--horizon", type=str, action="append",
+                        help="Horizon endpoint to use; repeat for failover (default: $STELLAR_CLI_HORIZON_URLS or SDF)")
+    parser.add_argument("--http-timeout", type=int,
+                        help="timeout in seconds for Horizon, stellar.toml and federation requests (default 20)")
+    parser.add_argument("--trace", type=str, nargs="?", const="-",
+                        help="write one JSON line per timed span (wallet, Horizon, TOML, signing...) to this file "
+                             "or stderr")
+    parser.add_argument("--metrics", type=str,
+                        help="write counters and span timings to this file (\"-\" for stderr) when the command ends")
+    parser.add_argument("--metrics-format", type=str, default="prometheus", choices=["prometheus", "statsd"],
+                        help="format of --metrics")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't use the local stellar.toml/asset/federation cache")
+    parser.add_argument("-n", "--count", type=int, help="number of channel accounts to create / accounts to derive")
+    parser.add_argument("--start-index", type=int,
+                        help="derive: first account index (default: after the last derived one)")
+    parser.add_argument("--starting-balance", type=str, default="5",
+                        help="XLM balance used to fund each new channel account")
     group_wallet = parser.add_mutually_exclusive_group(required=False)
     group_wallet.add_argument("-w", "--wallet", type=str, help="path to wallet file")
     group_wallet.add_argument("--trezor", action="store_true", help="use an attached Trezor")
+    parser.add_argument("--account-index", type=int, default=0,
+                        help="account index to use (SEP-0005 path m/44'/148'/index' of --mnemonic wallets or Trezor)")
     group_memo = parser.add_mutually_exclusive_group(required=False)
     group_memo.add_argument("--memo-id", type=int, help="ID memo for Stellar transaction")
     group_memo.add_argument("--memo-text", type=str, help="Text memo for Stellar transaction")
@@ -57,19 +178,76 @@ if __name__ == "__main__":
     timeout = args.timeout
     generate_qr_code_link = args.qrlink
     use_mnemonic = args.mnemonic
+    if args.no_cache:
+        cache.set_enabled(False)
+    if args.account_index != 0 and not trezor_mode:
+        import stellarops.fileops as fileops
+        fileops.set_account_index(args.account_index)
+        if wallet_file is not None and os.path.isfile(wallet_file):
+            try:
+                fileops.check_wallet_seed(fileops.read_wallet_data(wallet_file), wallet_file)
+            except ValueError as e:
+                print("Error: {}".format(str(e)))
+                sys.exit(1)
+    if args.trace is not None or args.metrics is not None:
+        trace.enable(trace_file=args.trace, metrics_file=args.metrics, metrics_format=args.metrics_format,
+                     command=command)
+    # commands that need neither stellar_sdk nor trezorlib return before stellarops.operations is imported
+    if command == COMMAND_SHOW_WALLET_ADDRESS and not trezor_mode:
+        import stellarops.wallet as wallet
+        wallet.retrieve_stellar_wallet_public_key(wallet_file=wallet_file, generate_qr_code_link=generate_qr_code_link)
+        sys.exit(0)
+    if command == COMMAND_CACHE_PURGE:
+        print("Removed cache file {}".format(cache.purge()))
+        sys.exit(0)
+    if command in (COMMAND_AGENT, COMMAND_UNLOCK, COMMAND_LOCK, COMMAND_MIGRATE_WALLET):
+        import stellarops.agent as agent
+        import stellarops.fileops as fileops
+        if command == COMMAND_AGENT:
+            agent.run_agent(timeout=args.agent_timeout)
+        elif command == COMMAND_LOCK:
+            print("Agent locked." if agent.lock() else "No agent is running.")
+        elif wallet_file is None:
+            print("Missing wallet file.")
+            sys.exit(1)
+        elif command == COMMAND_UNLOCK:
+            if fileops.unlock_wallet(wallet_file=wallet_file, timeout=args.agent_timeout):
+                print("Wallet unlocked for {} seconds.".format(args.agent_timeout))
+            else:
+                print("Nothing unlocked: the wallet is not encrypted or no agent is running.")
+        else:
+            backup_file = fileops.migrate_wallet(wallet_file=wallet_file, kdf_name=args.kdf)
+            print("Wallet migrated to {}. The previous version was saved in {}.".format(args.kdf, backup_file))
+        sys.exit(0)
+    import stellarops.operations as operations
+    import stellarops.transport as transport
+    transport.set_horizon_urls(args.horizon)
+    transport.set_request_timeout(args.http_timeout)
+    import stellarops.fees as fees
+    if args.sequence_file is not None:
+        if command not in OFFLINE_BUILD_COMMANDS:
+            print("Error: --sequence-file only works with {}.".format(", ".join(OFFLINE_BUILD_COMMANDS)))
+            sys.exit(1)
+        operations.set_sequence_file(args.sequence_file)
+        args.justsign = True
+        if args.base_fee is None:
+            args.base_fee = args.max_fee or fees.FALLBACK_FEE
+    fees.set_fixed_fee(args.base_fee)
+    if trezor_mode:
+        import stellarops.trezor as trezor
+        trezor.set_default_account_index(args.account_index)
     if command == COMMAND_CREATE_WALLET:
-        if not trezor_mode:
+        if args.watch_only:
+            operations.create_watch_only_wallet(wallet_file=wallet_file, public_key=args.destination,
+                                                generate_qr_code_link=generate_qr_code_link)
+        elif not trezor_mode:
             operations.create_stellar_wallet(wallet_file=wallet_file, generate_qr_code_link=generate_qr_code_link,
-                                             use_mnemonic=use_mnemonic)
+                                             use_mnemonic=use_mnemonic, kdf_name=args.kdf)
         else:
             print("Trezor wallet must be already initialized. Will retrieve public key wallet now")
             operations.retrieve_trezor_public_key(generate_qr_code_link=generate_qr_code_link)
     elif command == COMMAND_SHOW_WALLET_ADDRESS:
-        if not trezor_mode:
-            operations.retrieve_stellar_wallet_public_key(wallet_file=wallet_file,
-                                                          generate_qr_code_link=generate_qr_code_link)
-        else:
-            operations.retrieve_trezor_public_key(generate_qr_code_link=generate_qr_code_link)
+        operations.retrieve_trezor_public_key(generate_qr_code_link=generate_qr_code_link)
     elif command == COMMAND_ADD_TRUST:
         asset = args.asset
         issuer = args.issuer
@@ -83,7 +261,8 @@ if __name__ == "__main__":
                 print("Missing issuer address.")
                 sys.exit(1)
         operations.add_trust(wallet_file=wallet_file, asset=asset, issuer=issuer, test_mode=test_mode,
-                             trezor_mode=trezor_mode, vzero=vzero, timeout=timeout)
+                             trezor_mode=trezor_mode, vzero=vzero, timeout=timeout, max_fee=args.max_fee,
+                             fee_percentile=args.fee_percentile)
     elif command == COMMAND_LIST_BALANCES:
         operations.list_balances(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode)
     elif command == COMMAND_LIST_ASSET_BALANCE:
@@ -129,7 +308,118 @@ if __name__ == "__main__":
                                 memo_text=memo_text, memo_id=memo_id, memo_hash=memo_hash,
                                 test_mode=test_mode,
                                 trezor_mode=trezor_mode,
-                                just_sign=just_sign, vzero=vzero, timeout=timeout)
+                                just_sign=just_sign, vzero=vzero, timeout=timeout,
+                                use_channels=args.channels, max_fee=args.max_fee,
+                                fee_percentile=args.fee_percentile, check_destination=not args.no_preflight)
+    elif command == COMMAND_SEND_BATCH:
+        if args.file is None:
+            print("Missing payments file.")
+            sys.exit(1)
+        operations.send_batch(wallet_file=wallet_file, payment_file=args.file, report_file=args.report,
+                              asset=args.asset, issuer=args.issuer,
+                              memo_text=args.memo_text, memo_id=args.memo_id, memo_hash=args.memo_hash,
+                              test_mode=test_mode, trezor_mode=trezor_mode, just_sign=args.justsign,
+                              vzero=vzero, timeout=timeout, batch_size=args.batch_size,
+                              use_channels=args.channels, concurrency=args.concurrency, max_fee=args.max_fee,
+                              fee_percentile=args.fee_percentile, reject_file=args.reject_file,
+                              check_destinations=not args.no_preflight)
+    elif command in (COMMAND_PATH_SEND, COMMAND_PATH_RECEIVE):
+        path_kind = "strict_send" if command == COMMAND_PATH_SEND else "strict_receive"
+        if args.file is not None:
+            operations.send_batch(wallet_file=wallet_file, payment_file=args.file, report_file=args.report,
+                                  asset=args.asset, issuer=args.issuer,
+                                  memo_text=args.memo_text, memo_id=args.memo_id, memo_hash=args.memo_hash,
+                                  test_mode=test_mode, trezor_mode=trezor_mode, just_sign=args.justsign,
+                                  vzero=vzero, timeout=timeout, batch_size=args.batch_size,
+                                  use_channels=args.channels, concurrency=args.concurrency, max_fee=args.max_fee,
+                                  fee_percentile=args.fee_percentile, path_kind=path_kind,
+                                  send_asset=args.send_asset, slippage=args.slippage,
+                                  reject_file=args.reject_file, check_destinations=not args.no_preflight)
+            sys.exit(0)
+        destination = operations.process_destination_address(address=args.destination)
+        if destination is None:
+            print("Missing/invalid destination address.")
+            sys.exit(1)
+        if args.amount is None:
+            print("Missing amount.")
+            sys.exit(1)
+        operations.path_payment(wallet_file=wallet_file, path_kind=path_kind, send_asset=args.send_asset,
+                                asset=args.asset, issuer=args.issuer, amount=args.amount, destination=destination,
+                                slippage=args.slippage,
+                                memo_text=args.memo_text, memo_id=args.memo_id, memo_hash=args.memo_hash,
+                                test_mode=test_mode, trezor_mode=trezor_mode, just_sign=args.justsign,
+                                vzero=vzero, timeout=timeout, use_channels=args.channels, max_fee=args.max_fee,
+                                fee_percentile=args.fee_percentile, check_destination=not args.no_preflight)
+    elif command == COMMAND_ORDER_BOOK:
+        buying = args.asset if args.issuer is None else "{}:{}".format(args.asset, args.issuer)
+        operations.show_order_book(selling=args.send_asset, buying=buying, test_mode=test_mode,
+                                   limit=args.limit or 20)
+    elif command == COMMAND_DERIVE:
+        if args.count is None or args.count < 1:
+            print("Missing number of accounts to derive (-n).")
+            sys.exit(1)
+        operations.derive_accounts(wallet_file=wallet_file, count=args.count, start=args.start_index,
+                                   trezor_mode=trezor_mode, output_file=args.output)
+    elif command == COMMAND_TRUST_BATCH:
+        assets = args.assets
+        if assets is None and args.asset is not None:
+            assets = args.asset if args.issuer is None else "{}:{}".format(args.asset, args.issuer)
+        if assets is None:
+            print("Missing assets list.")
+            sys.exit(1)
+        operations.trust_batch(wallet_file=wallet_file, assets=assets, accounts=args.accounts, limit=args.trust_limit,
+                               remove=args.remove, report_file=args.report, test_mode=test_mode,
+                               trezor_mode=trezor_mode, just_sign=args.justsign, vzero=vzero, timeout=timeout,
+                               batch_size=args.batch_size, concurrency=args.concurrency, max_fee=args.max_fee,
+                               fee_percentile=args.fee_percentile)
+    elif command == COMMAND_SWEEP:
+        if args.accounts is None:
+            print("Missing accounts list.")
+            sys.exit(1)
+        destination = None
+        if args.destination is not None:
+            destination = operations.process_destination_address(address=args.destination)
+            if destination is None:
+                print("Missing/invalid destination address.")
+                sys.exit(1)
+        operations.sweep(wallet_file=wallet_file, accounts=args.accounts, destination=destination, assets=args.assets,
+                         merge=args.merge, report_file=args.report, test_mode=test_mode, trezor_mode=trezor_mode,
+                         just_sign=args.justsign, vzero=vzero, timeout=timeout, batch_size=args.batch_size,
+                         concurrency=args.concurrency, max_fee=args.max_fee, fee_percentile=args.fee_percentile,
+                         check_destination=not args.no_preflight)
+    elif command == COMMAND_CREATE_CHANNELS:
+        operations.create_channels(wallet_file=wallet_file, count=args.count, starting_balance=args.starting_balance,
+                                   test_mode=test_mode, trezor_mode=trezor_mode, vzero=vzero, timeout=timeout,
+                                   max_fee=args.max_fee, fee_percentile=args.fee_percentile)
+    elif command == COMMAND_SYNC:
+        operations.sync_history(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode,
+                                history_file=args.db)
+    elif command == COMMAND_QUERY:
+        operations.query_history(wallet_file=wallet_file, asset=args.asset, issuer=args.issuer,
+                                 counterparty=args.counterparty, memo=args.memo, since=args.since, until=args.until,
+                                 test_mode=test_mode, trezor_mode=trezor_mode, history_file=args.db,
+                                 output_file=args.output)
+    elif command == COMMAND_WATCH:
+        operations.watch_account(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode,
+                                 effects=args.effects, output_file=args.output, cursor=args.cursor,
+                                 cursor_file=args.cursor_file, hook=args.hook)
+    elif command == COMMAND_BALANCE_REPORT:
+        if args.accounts is None:
+            print("Missing accounts list.")
+            sys.exit(1)
+        operations.balance_report(accounts=args.accounts, test_mode=test_mode, concurrency=args.concurrency,
+                                  table=args.table)
+    elif command == COMMAND_SERVE:
+        if wallet_file is None and not trezor_mode:
+            parser.error("serve needs a wallet: use -w wallet_file or --trezor")
+        import stellarops.daemon as daemon
+        daemon.serve(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode,
+                     host=args.host, port=args.port, socket_file=args.socket,
+                     token_file=args.token_file)
+    elif command == COMMAND_SIGN_TX and args.file is not None:
+        operations.sign_transactions_from_file(wallet_file=wallet_file, xdr_file=args.file, output_file=args.output,
+                                               test_mode=test_mode, trezor_mode=trezor_mode,
+                                               just_sign=args.justsign, max_fee=args.max_fee)
     elif command == COMMAND_SIGN_TX:
         transaction_xdr = input("Paste your TX XDR DATA:").strip()
         just_sign = args.justsign
@@ -138,11 +428,20 @@ if __name__ == "__main__":
         operations.sign_transaction_from_xdr(wallet_file=wallet_file, transaction_xdr=transaction_xdr,
                                              test_mode=test_mode, trezor_mode=trezor_mode, just_sign=just_sign,
                                              vzero=vzero)
+    elif command == COMMAND_SUBMIT_TX and args.file is not None:
+        operations.submit_transactions_from_file(xdr_file=args.file, report_file=args.report, wallet_file=wallet_file,
+                                                 test_mode=test_mode, concurrency=args.concurrency,
+                                                 max_fee=args.max_fee)
     elif command == COMMAND_SUBMIT_TX:
         transaction_xdr = input("Paste your TX XDR DATA:").strip()
         if transaction_xdr is None or len(transaction_xdr) == 0:
             "Missing TX XDR data."
         operations.submit_transaction(transaction_xdr=transaction_xdr, test_mode=test_mode, vzero=vzero)
     elif command == COMMAND_LIST_TRANSACTIONS:
-        operations.list_transactions(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode)
+        if args.stream:
+            operations.stream_transactions(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode,
+                                           output_file=args.output, cursor=args.cursor, cursor_file=args.cursor_file,
+                                           since=args.since, until=args.until, limit=args.limit)
+        else:
+            operations.list_transactions(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode)
 
@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from . import cache
+
+
+DEFAULT_TIMEOUT = 900
+
+
+def get_socket_file():
+    if os.environ.get("STELLAR_CLI_AGENT_SOCKET"):
+        return os.environ.get("STELLAR_CLI_AGENT_SOCKET")
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or cache.get_cache_dir()
+    return os.path.join(runtime_dir, "stellar-cli-agent.sock")
+
+
+def request(message):
+    # returns None when no agent is listening, so callers fall back to asking for the password
+    socket_file = get_socket_file()
+    if not os.path.exists(socket_file):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(2)
+            s.connect(socket_file)
+            s.sendall("{}\n".format(json.dumps(message)).encode())
+            with s.makefile("r") as f:
+                line = f.readline()
+    except OSError:
+        return None
+    return json.loads(line) if line else None
+
+
+def get_key(key_id):
+    response = request({"action": "get", "id": key_id})
+    if response is None or response.get("key") is None:
+        return None
+    return response.get("key").encode()
+
+
+def put_key(key_id, key, timeout=None):
+    response = request({"action": "put", "id": key_id, "key": key.decode(), "timeout": timeout})
+    return response is not None and response.get("status") == "ok"
+
+
+def lock():
+    response = request({"action": "lock"})
+    return response is not None and response.get("status") == "ok"
+
+
+class KeyStore:
+    # derived wallet keys (never passwords) indexed by the wallet KDF salt, each with its own expiry
+
+    def __init__(self, default_timeout=DEFAULT_TIMEOUT):
+        self.default_timeout = default_timeout
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, key_id):
+        with self.lock:
+            entry = self.keys.get(key_id)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.keys[key_id]
+                return None
+            return entry[0]
+
+    def put(self, key_id, key, timeout=None):
+        with self.lock:
+            self.keys[key_id] = (key, time.time() + (timeout or self.default_timeout))
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+
+    def expire(self):
+        with self.lock:
+            for key_id in [k for k, entry in self.keys.items() if entry[1] < time.time()]:
+                del self.keys[key_id]
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    store = None
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                self.respond({"status": "error", "error": "invalid request"})
+                continue
+            action = message.get("action")
+            if action == "get":
+                self.respond({"status": "ok", "key": self.store.get(message.get("id"))})
+            elif action == "put":
+                self.store.put(message.get("id"), message.get("key"), timeout=message.get("timeout"))
+                self.respond({"status": "ok"})
+            elif action == "lock":
+                self.store.clear()
+                self.respond({"status": "ok"})
+            else:
+                self.respond({"status": "error", "error": "unknown action {}".format(action)})
+
+    def respond(self, data):
+        self.wfile.write("{}\n".format(json.dumps(data)).encode())
+
+
+class ThreadingUnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def run_agent(timeout=DEFAULT_TIMEOUT):
+    socket_file = get_socket_file()
+    os.makedirs(os.path.dirname(socket_file), exist_ok=True)
+    if os.path.exists(socket_file):
+        if request({"action": "ping"}) is not None:
+            print("An agent is already listening on {}".format(socket_file))
+            return
+        os.remove(socket_file)
+    store = KeyStore(default_timeout=timeout)
+    handler = type("BoundAgentRequestHandler", (AgentRequestHandler,), {"store": store})
+    # the socket is created owner-only so other users can't ask for the keys
+    umask = os.umask(0o177)
+    try:
+        server = ThreadingUnixStreamServer(socket_file, handler)
+    finally:
+        os.umask(umask)
+
+    def expire_keys():
+        while True:
+            time.sleep(10)
+            store.expire()
+    threading.Thread(target=expire_keys, daemon=True).start()
+    print("Agent listening on {} (keys expire after {}s)".format(socket_file, timeout), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
@@ -0,0 +1,229 @@
+import asyncio
+import atexit
+import json
+import sys
+import threading
+import toml
+from stellar_sdk import ServerAsync
+from . import cache
+from . import transport
+from . import trace
+
+
+DEFAULT_CONCURRENCY = 10
+
+
+class Clients:
+    # horizon is the SDK client used by ServerAsync (with endpoint failover), http serves stellar.toml and
+    # federation requests
+
+    def __init__(self):
+        self.horizon = transport.AsyncFailoverClient()
+        self.http = transport.create_http_session()
+
+    async def close(self):
+        await self.horizon.close()
+        await self.http.close()
+
+
+_shared_loop = None
+_shared_clients = None
+_shared_lock = threading.Lock()
+
+
+def start_shared_loop():
+    # one event loop thread and one set of clients per process so connections stay open between run() calls;
+    # they are closed when the process exits
+    global _shared_loop, _shared_clients
+    with _shared_lock:
+        if _shared_loop is not None:
+            return
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+
+        async def create_clients():
+            return Clients()
+        _shared_clients = asyncio.run_coroutine_threadsafe(create_clients(), loop).result()
+        _shared_loop = loop
+    atexit.register(stop_shared_loop)
+
+
+def stop_shared_loop():
+    global _shared_loop, _shared_clients
+    with _shared_lock:
+        loop, clients = _shared_loop, _shared_clients
+        _shared_loop, _shared_clients = None, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(clients.close(), loop).result(timeout=5)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def run(func, *args, **kwargs):
+    # runs func(clients, *args, **kwargs) on the shared loop and clients, started by the first call
+    start_shared_loop()
+    future = asyncio.run_coroutine_threadsafe(func(_shared_clients, *args, **kwargs), _shared_loop)
+    try:
+        return future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+        raise
+
+
+async def gather_limited(coroutines, concurrency=DEFAULT_CONCURRENCY):
+    # results keep the input order; failures are returned as exception objects instead of being raised
+    if concurrency is None or concurrency < 1:
+        concurrency = DEFAULT_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+    return await asyncio.gather(*[limited(c) for c in coroutines], return_exceptions=True)
+
+
+async def load_account_data(clients, horizon_url, account_id):
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    with trace.span("horizon.load_account"):
+        return await server.accounts().account_id(account_id=account_id).call()
+
+
+async def load_balances(clients, horizon_url, account_id):
+    response = await load_account_data(clients, horizon_url, account_id)
+    return response.get("balances")
+
+
+async def load_transactions(clients, horizon_url, account_id):
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    return await server.transactions().for_account(account_id=account_id).call()
+
+
+async def iter_account_records(clients, horizon_url, endpoint, account_id, cursor=None, page_size=200):
+    # yields (record, page_cursor) oldest first for endpoint "transactions", "operations", "payments" or "effects";
+    # page_cursor is the paging token of the last record of the page the record belongs to
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    while True:
+        builder = getattr(server, endpoint)().for_account(account_id=account_id).order(desc=False).limit(page_size)
+        if cursor is not None:
+            builder = builder.cursor(cursor)
+        response = await builder.call()
+        records = response.get("_embedded", {}).get("records", [])
+        if len(records) == 0:
+            return
+        cursor = records[-1].get("paging_token")
+        for record in records:
+            yield record, cursor
+        if len(records) < page_size:
+            return
+
+
+def iter_transactions(clients, horizon_url, account_id, cursor=None, page_size=200):
+    return iter_account_records(clients, horizon_url, "transactions", account_id, cursor=cursor, page_size=page_size)
+
+
+async def stream_account_records(clients, horizon_url, endpoint, account_id, cursor="now", retry_delay=5):
+    # follows the Horizon event stream forever, reconnecting from the last seen paging token after any failure
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    if cursor is None:
+        cursor = "now"
+    while True:
+        try:
+            builder = getattr(server, endpoint)().for_account(account_id=account_id).cursor(cursor)
+            async for record in builder.stream():
+                if record.get("paging_token") is not None:
+                    cursor = record.get("paging_token")
+                yield record
+        except Exception as e:
+            print("Stream interrupted ({}), reconnecting from cursor {} in {}s".format(str(e), cursor, retry_delay),
+                  file=sys.stderr)
+        await asyncio.sleep(retry_delay)
+
+
+async def run_hook(hook, record):
+    process = await asyncio.create_subprocess_shell(hook, stdin=asyncio.subprocess.PIPE)
+    await process.communicate(input=json.dumps(record).encode())
+    return process.returncode
+
+
+async def load_toml(clients, domain):
+    cached = cache.get_toml(domain)
+    if cached is not None and cached.get("fresh"):
+        return toml.loads(cached.get("content"))
+    toml_file = transport.get_toml_url(domain)
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached.get("etag")
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached.get("last_modified")
+    print("Loading TOML content from: {}".format(toml_file), file=sys.stderr)
+    with trace.span("toml.load", domain=domain):
+        async with clients.http.get(toml_file, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                cache.touch_toml(domain)
+                return toml.loads(cached.get("content"))
+            if response.status >= 400:
+                raise Exception("Could not load {} (HTTP {})".format(toml_file, response.status))
+            toml_string = await response.text()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    toml_data = toml.loads(toml_string)
+    cache.put_toml(domain, toml_string, etag=etag, last_modified=last_modified)
+    return toml_data
+
+
+async def get_asset_data_from_domain(clients, asset_code, asset_domain):
+    asset_issuer = cache.get_asset_issuer(asset_code, asset_domain)
+    if asset_issuer is not None:
+        return asset_code, asset_issuer, asset_domain
+    toml_data = await load_toml(clients, asset_domain)
+    currencies = toml_data.get("CURRENCIES") or []
+    cache.put_asset_issuers(asset_domain, [(c.get("code"), c.get("issuer")) for c in currencies
+                                           if c.get("code") and c.get("issuer")])
+    for c in currencies:
+        if c.get("code") == asset_code:
+            asset_issuer = c.get("issuer")
+            return asset_code, asset_issuer, asset_domain
+    return None, None, None
+
+
+async def translate_address(clients, account_name, account_domain):
+    address = "{}*{}".format(account_name, account_domain)
+    account_id = cache.get_federation_account(address)
+    if account_id is not None:
+        return account_id
+    toml_data = await load_toml(clients, account_domain)
+    federation_server_url = toml_data.get("FEDERATION_SERVER")
+    print("Using FEDERATION Server: {}".format(federation_server_url), file=sys.stderr)
+    with trace.span("federation.lookup", domain=account_domain):
+        async with clients.http.get(federation_server_url, params={"q": address, "type": "name"}) as response:
+            if response.status >= 400:
+                raise Exception("Federation server returned HTTP {}".format(response.status))
+            response_json = await response.json(content_type=None)
+    account_id = response_json.get("account_id")
+    if account_id is not None:
+        cache.put_federation_account(address, account_id)
+    return account_id
+
+
+async def resolve_assets(clients, assets_with_domain, concurrency=DEFAULT_CONCURRENCY):
+    # maps every ASSETCODE@domain to (code, issuer, domain) or to the exception raised while resolving it
+    assets_with_domain = list(assets_with_domain)
+    coroutines = []
+    for asset_with_domain in assets_with_domain:
+        asset_code, asset_domain = asset_with_domain.split('@', 1)
+        coroutines.append(get_asset_data_from_domain(clients, asset_code, asset_domain))
+    results = await gather_limited(coroutines, concurrency=concurrency)
+    return dict(zip(assets_with_domain, results))
+
+
+async def resolve_federation_addresses(clients, addresses, concurrency=DEFAULT_CONCURRENCY):
+    addresses = list(addresses)
+    coroutines = []
+    for address in addresses:
+        account_name, account_domain = address.split('*', 1)
+        coroutines.append(translate_address(clients, account_name, account_domain))
+    results = await gather_limited(coroutines, concurrency=concurrency)
+    return dict(zip(addresses, results))
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from . import trace
+
+
+TOML_TTL = 3600
+ASSET_TTL = 3600
+FEDERATION_TTL = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS toml (
+    domain TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    asset_code TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (asset_code, domain)
+);
+CREATE TABLE IF NOT EXISTS federation (
+    address TEXT PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+_enabled = True
+_local = threading.local()
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "stellar-cli")
+
+
+def get_cache_file():
+    return os.path.join(get_cache_dir(), "cache.db")
+
+
+def _connect():
+    # sqlite connections can't be shared between threads, so every thread opens one on first use and keeps it
+    cache_file = get_cache_file()
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.cache_file == cache_file:
+        return connection
+    _close()
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    connection = sqlite3.connect(cache_file)
+    connection.executescript(SCHEMA)
+    _local.connection = connection
+    _local.cache_file = cache_file
+    return connection
+
+
+def _close():
+    connection = getattr(_local, "connection", None)
+    if connection is not None:
+        connection.close()
+        _local.connection = None
+
+
+def _query_one(query, params):
+    if not _enabled:
+        return None
+    return _connect().execute(query, params).fetchone()
+
+
+def _execute_many(query, rows):
+    if not _enabled:
+        return
+    connection = _connect()
+    with connection:
+        connection.executemany(query, rows)
+
+
+def _execute(query, params):
+    _execute_many(query, [params])
+
+
+def count_lookup(kind, value):
+    trace.count("cache.lookups", kind=kind, result="miss" if value is None else "hit")
+    return value
+
+
+def get_toml(domain):
+    # stale entries are returned as well (fresh=False) so their validators can be used for a conditional request
+    row = _query_one("SELECT content, etag, last_modified, fetched_at FROM toml WHERE domain = ?", (domain,))
+    count_lookup("toml", row if row is not None and time.time() - row[3] < TOML_TTL else None)
+    if row is None:
+        return None
+    return {
+        "content": row[0],
+        "etag": row[1],
+        "last_modified": row[2],
+        "fresh": time.time() - row[3] < TOML_TTL
+    }
+
+
+def put_toml(domain, content, etag=None, last_modified=None):
+    _execute("INSERT OR REPLACE INTO toml (domain, content, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+             (domain, content, etag, last_modified, time.time()))
+
+
+def touch_toml(domain):
+    _execute("UPDATE toml SET fetched_at = ? WHERE domain = ?", (time.time(), domain))
+
+
+def get_asset_issuer(asset_code, domain):
+    row = _query_one("SELECT issuer FROM assets WHERE asset_code = ? AND domain = ? AND fetched_at > ?",
+                     (asset_code, domain, time.time() - ASSET_TTL))
+    return count_lookup("asset", None if row is None else row[0])
+
+
+def put_asset_issuers(domain, currencies):
+    # currencies is an iterable of (asset_code, issuer); all of them are written in one transaction
+    fetched_at = time.time()
+    _execute_many("INSERT OR REPLACE INTO assets (asset_code, domain, issuer, fetched_at) VALUES (?, ?, ?, ?)",
+                  [(asset_code, domain, issuer, fetched_at) for asset_code, issuer in currencies])
+
+
+def get_federation_account(address):
+    row = _query_one("SELECT account_id FROM federation WHERE address = ? AND fetched_at > ?",
+                     (address, time.time() - FEDERATION_TTL))
+    return count_lookup("federation", None if row is None else row[0])
+
+
+def put_federation_account(address, account_id):
+    _execute("INSERT OR REPLACE INTO federation (address, account_id, fetched_at) VALUES (?, ?, ?)",
+             (address, account_id, time.time()))
+
+
+def purge():
+    _close()
+    cache_file = get_cache_file()
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+    return cache_file
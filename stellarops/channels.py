@@ -0,0 +1,29 @@
+import queue
+from stellar_sdk import Keypair
+from .fileops import load_channels
+
+
+class ChannelPool:
+    # each channel account has at most one transaction in flight; acquire() blocks until one is free
+
+    def __init__(self, keypairs):
+        self.keypairs = keypairs
+        self.free = queue.Queue()
+        for k in keypairs:
+            self.free.put(k)
+
+    def __len__(self):
+        return len(self.keypairs)
+
+    def acquire(self):
+        return self.free.get()
+
+    def release(self, keypair):
+        self.free.put(keypair)
+
+
+def load_channel_pool(channel_file):
+    keypairs = [Keypair.from_secret(secret=private_key) for (private_key, public_key) in load_channels(channel_file)]
+    if len(keypairs) == 0:
+        raise ValueError("No channel accounts found in {}".format(channel_file))
+    return ChannelPool(keypairs=keypairs)
@@ -0,0 +1,285 @@
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import socketserver
+import sys
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+from stellar_sdk.helpers import parse_transaction_envelope_from_xdr
+from . import asyncops
+from . import cache
+from . import operations
+from . import trace
+from .fileops import keep_wallet_loaded
+
+
+def get_socket_file():
+    if os.environ.get("STELLAR_CLI_SERVE_SOCKET"):
+        return os.environ.get("STELLAR_CLI_SERVE_SOCKET")
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or cache.get_cache_dir()
+    return os.path.join(runtime_dir, "stellar-cli-serve.sock")
+
+
+def get_token_file():
+    return os.environ.get("STELLAR_CLI_SERVE_TOKEN_FILE") or os.path.join(cache.get_cache_dir(), "serve.token")
+
+
+def load_token(token_file):
+    # the token is created once, readable by its owner only; a file others can read is refused
+    if not os.path.exists(token_file):
+        os.makedirs(os.path.dirname(os.path.abspath(token_file)), exist_ok=True)
+        fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_urlsafe(32))
+    if os.stat(token_file).st_mode & 0o077:
+        raise ValueError("Token file {} must only be readable by its owner (chmod 600).".format(token_file))
+    with open(token_file, mode="r") as f:
+        token = f.read().strip()
+    if len(token) == 0:
+        raise ValueError("Token file {} is empty.".format(token_file))
+    return token
+
+
+def get_ip_address(host):
+    try:
+        return ipaddress.ip_address(host)
+    except ValueError:
+        return None
+
+
+def is_allowed_host(host_header, bind_host):
+    # Host must name the bind address, so a page on another domain (DNS rebinding) is refused; a wildcard bind
+    # address accepts IP literals, never domain names
+    hostname = urlsplit("//{}".format(host_header or "")).hostname
+    if hostname is None:
+        return False
+    if hostname == bind_host.lower():
+        return True
+    bind_address = get_ip_address(bind_host)
+    address = get_ip_address(hostname)
+    if bind_address is not None and bind_address.is_unspecified:
+        return address is not None
+    bind_loopback = bind_host == "localhost" or (bind_address is not None and bind_address.is_loopback)
+    return bind_loopback and (hostname == "localhost" or (address is not None and address.is_loopback))
+
+
+class Daemon:
+    # keeps the wallet, sessions and caches of one process alive; transactions from the wallet are queued and
+    # built one at a time so sequence numbers and Trezor prompts never interleave
+
+    def __init__(self, wallet_file=None, test_mode=True, trezor_mode=False):
+        self.wallet_file = wallet_file
+        self.test_mode = test_mode
+        self.trezor_mode = trezor_mode
+        self.jobs = queue.Queue()
+        self.public_key = None
+
+    def start(self):
+        if self.wallet_file is not None and not self.trezor_mode:
+            keep_wallet_loaded(wallet_file=self.wallet_file)
+        self.public_key = operations.get_public_key(wallet_file=self.wallet_file, trezor_mode=self.trezor_mode)
+        asyncops.start_shared_loop()
+        threading.Thread(target=self.process_jobs, daemon=True).start()
+
+    def process_jobs(self):
+        while True:
+            future, func, kwargs = self.jobs.get()
+            try:
+                future.set_result(func(**kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def enqueue(self, func, **kwargs):
+        future = Future()
+        self.jobs.put((future, func, kwargs))
+        return future.result()
+
+    def resolve_asset(self, data):
+        asset = data.get("asset")
+        issuer = data.get("issuer")
+        if asset is None:
+            return None, None
+        stellar_asset = operations.resolve_asset(asset=asset, issuer=issuer)
+        if stellar_asset.is_native():
+            return None, None
+        return stellar_asset.code, stellar_asset.issuer
+
+    def send_payment(self, data):
+        asset, issuer = self.resolve_asset(data)
+        destination = operations.process_destination_address(address=data.get("destination"))
+        if destination is None:
+            raise ValueError("Missing/invalid destination address.")
+        if data.get("amount") is None:
+            raise ValueError("Missing amount.")
+        return self.enqueue(operations.send_payment, wallet_file=self.wallet_file, asset=asset, issuer=issuer,
+                            amount=data.get("amount"), destination=destination, source=data.get("source"),
+                            memo_text=data.get("memo_text"), memo_id=data.get("memo_id"),
+                            memo_hash=data.get("memo_hash"), test_mode=self.test_mode,
+                            trezor_mode=self.trezor_mode, just_sign=data.get("just_sign", False),
+                            vzero=data.get("vzero", False), timeout=data.get("timeout"))
+
+    def add_trust(self, data):
+        asset, issuer = self.resolve_asset(data)
+        if asset is None:
+            raise ValueError("Missing asset.")
+        return self.enqueue(operations.add_trust, wallet_file=self.wallet_file, asset=asset, issuer=issuer,
+                            test_mode=self.test_mode, trezor_mode=self.trezor_mode, vzero=data.get("vzero", False),
+                            timeout=data.get("timeout"))
+
+    def list_balances(self, data):
+        network_settings = operations.get_network_settings(test_mode=self.test_mode)
+        account_id = data.get("account_id") or self.public_key
+        return asyncops.run(asyncops.load_balances, network_settings.get("horizon_url"), account_id)
+
+    def submit_tx(self, data):
+        if not data.get("xdr"):
+            raise ValueError("Missing TX XDR data.")
+        network_settings = operations.get_network_settings(test_mode=self.test_mode)
+        transaction = parse_transaction_envelope_from_xdr(data.get("xdr"), network_settings.get("network_passphrase"))
+        return operations.broadcast_tx(transaction=transaction, test_mode=self.test_mode)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    daemon = None
+    token = None
+    bind_host = None
+    routes = {
+        "/send_payment": "send_payment",
+        "/add_trust": "add_trust",
+        "/list_balances": "list_balances",
+        "/submit_tx": "submit_tx"
+    }
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_authorized(self):
+        # every request needs "Authorization: Bearer <token>"; TCP requests also need a Host naming the bind address
+        if self.bind_host is not None and not is_allowed_host(self.headers.get("Host"), self.bind_host):
+            self.send_json(403, {"error": "Host not allowed."})
+            return False
+        authorization = self.headers.get("Authorization") or ""
+        if not authorization.startswith("Bearer ") or \
+                not hmac.compare_digest(authorization[7:].strip().encode(), self.token.encode()):
+            self.send_json(401, {"error": "Missing or invalid bearer token."})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.is_authorized():
+            return
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "public_key": self.daemon.public_key})
+        elif self.path == "/metrics":
+            self.send_text(200, trace.format_prometheus())
+        elif self.path == "/list_balances":
+            self.handle_route({})
+        else:
+            self.send_json(404, {"error": "Unknown endpoint {}".format(self.path)})
+
+    def do_POST(self):
+        if not self.is_authorized():
+            return
+        # browsers send text/plain and form posts cross-site without a preflight, JSON bodies need one
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self.send_json(415, {"error": "Content-Type must be application/json."})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "Request body must be JSON."})
+            return
+        self.handle_route(data)
+
+    def handle_route(self, data):
+        route = self.routes.get(self.path)
+        if route is None:
+            self.send_json(404, {"error": "Unknown endpoint {}".format(self.path)})
+            return
+        try:
+            result = getattr(self.daemon, route)(data)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+        if isinstance(result, dict) and result.get("error") is not None:
+            self.send_json(502, result)
+        else:
+            self.send_json(200, {"result": result})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(wallet_file=None, test_mode=True, trezor_mode=False, host=None, port=None, socket_file=None,
+          token_file=None):
+    # listens on a user-only unix socket unless host or port is given
+    if token_file is None:
+        token_file = get_token_file()
+    try:
+        token = load_token(token_file)
+    except ValueError as e:
+        print("Error: {}".format(str(e)))
+        return
+    # /metrics needs the counters, so the daemon records them even without --trace/--metrics
+    if not trace.is_enabled():
+        trace.enable(command="serve")
+    daemon = Daemon(wallet_file=wallet_file, test_mode=test_mode, trezor_mode=trezor_mode)
+    daemon.start()
+    if host is None and port is None:
+        if socket_file is None:
+            socket_file = get_socket_file()
+        handler = type("BoundDaemonRequestHandler", (DaemonRequestHandler,), {"daemon": daemon, "token": token})
+        os.makedirs(os.path.dirname(os.path.abspath(socket_file)), exist_ok=True)
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixHTTPServer(socket_file, handler)
+        finally:
+            os.umask(umask)
+        print("Serving {} on unix socket {}".format(daemon.public_key, socket_file), file=sys.stderr)
+    else:
+        host = host or "127.0.0.1"
+        port = port or 8080
+        handler = type("BoundDaemonRequestHandler", (DaemonRequestHandler,),
+                       {"daemon": daemon, "token": token, "bind_host": host})
+        server = ThreadingHTTPServer((host, port), handler)
+        print("Serving {} on http://{}:{}".format(daemon.public_key, host, port), file=sys.stderr)
+    print("Requests need the header 'Authorization: Bearer <token>', token in {}".format(token_file),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_file is not None and os.path.exists(socket_file):
+            os.remove(socket_file)
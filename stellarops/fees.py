@@ -0,0 +1,63 @@
+import sys
+import threading
+import time
+from stellar_sdk.exceptions import BaseHorizonError, ConnectionError
+from . import trace
+
+
+FEE_STATS_TTL = 5
+DEFAULT_FEE_PERCENTILE = 70
+FALLBACK_FEE = 5000
+PERCENTILES = (10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99)
+
+_fee_stats = {}
+_lock = threading.Lock()
+_fixed_fee = None
+_announced_fee = None
+
+
+def set_fixed_fee(fee):
+    # --base-fee (and offline builds) skip fee_stats entirely
+    global _fixed_fee
+    _fixed_fee = fee
+
+
+def get_fee_stats(server):
+    # fee_stats only changes once per ledger, so a few seconds of caching covers a whole batch run
+    horizon_url = server.horizon_url
+    with _lock:
+        cached = _fee_stats.get(horizon_url)
+        if cached is not None and time.time() - cached[0] < FEE_STATS_TTL:
+            trace.count("cache.lookups", kind="fee_stats", result="hit")
+            return cached[1]
+    trace.count("cache.lookups", kind="fee_stats", result="miss")
+    with trace.span("horizon.fee_stats"):
+        stats = server.fee_stats().call()
+    with _lock:
+        _fee_stats[horizon_url] = (time.time(), stats)
+    return stats
+
+
+def choose_base_fee(server, percentile=None, max_fee=None):
+    # per-operation fee in stroops: the chosen percentile of recently charged fees, never below the ledger base
+    # fee and never above max_fee; FALLBACK_FEE is used when Horizon can't provide fee_stats. Called for every
+    # envelope, so the fee is only announced when it changes
+    global _announced_fee
+    if _fixed_fee is not None:
+        return _fixed_fee if max_fee is None else min(_fixed_fee, max_fee)
+    if percentile is None:
+        percentile = DEFAULT_FEE_PERCENTILE
+    percentile = min(PERCENTILES, key=lambda p: abs(p - percentile))
+    try:
+        stats = get_fee_stats(server)
+        fee = int(stats.get("fee_charged", {}).get("p{}".format(percentile)))
+        fee = max(fee, int(stats.get("last_ledger_base_fee") or 100))
+    except (BaseHorizonError, ConnectionError, TypeError, ValueError) as e:
+        print("Could not load fee stats ({}), using {} stroops".format(str(e), FALLBACK_FEE), file=sys.stderr)
+        fee = FALLBACK_FEE
+    if max_fee is not None:
+        fee = min(fee, max_fee)
+    if fee != _announced_fee:
+        _announced_fee = fee
+        print("Using base fee of {} stroops per operation (p{})".format(fee, percentile), file=sys.stderr)
+    return fee
@@ -1,11 +1,19 @@
 import json
+import csv
 import base64
 import os
 import getpass
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.fernet import Fernet, InvalidToken
+import sys
+import time
+from . import trace
+
+
+WALLET_VERSION = 2
+DEFAULT_KDF = "scrypt"
+KDF_DEFAULTS = {
+    "scrypt": {"n": 2 ** 15, "r": 8, "p": 1},
+    "pbkdf2-sha256": {"iterations": 100000}
+}
 
 
 def get_password_from_user():
@@ -14,75 +22,349 @@ def get_password_from_user():
     return p
 
 
-def generate_key_from_password(password, salt=None):
-    password_encoded = password.encode()  # Convert to type bytes
-    if salt is None:
-        salt = os.urandom(16)
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend()
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password_encoded))
-    return key, salt
+def new_kdf_params(kdf_name=DEFAULT_KDF):
+    if kdf_name not in KDF_DEFAULTS:
+        raise Exception("Unsupported KDF {}. Supported: {}".format(kdf_name, ", ".join(KDF_DEFAULTS.keys())))
+    kdf = {"name": kdf_name, "salt": base64.b64encode(os.urandom(16)).decode('ascii')}
+    kdf.update(KDF_DEFAULTS.get(kdf_name))
+    return kdf
 
 
-def key_encrypt_with_password(data_string, password):
-    if password is None:
-        return data_string
-    if '$' in data_string:
-        salt, data = data_string.split('$')
+def derive_key(password, kdf):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    salt = base64.b64decode(kdf.get("salt"))
+    if kdf.get("name") == "scrypt":
+        key_derivation = Scrypt(salt=salt, length=32, n=kdf.get("n"), r=kdf.get("r"), p=kdf.get("p"),
+                                backend=default_backend())
+    elif kdf.get("name") == "pbkdf2-sha256":
+        key_derivation = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt,
+                                    iterations=kdf.get("iterations"), backend=default_backend())
     else:
-        salt = None
-        data = data_string
-    key, salt = generate_key_from_password(password=password, salt=salt)
-    f = Fernet(key)
-    data_encoded = data.encode('ascii')
-    encrypted_data = f.encrypt(data=data_encoded)
-    encrypted_data_string = "{}${}".format(base64.b64encode(salt).decode('ascii'),
-                                           base64.b64encode(encrypted_data).decode('ascii'))
-    return encrypted_data_string
-
-
-def key_decrypt_with_password(data_string):
-    if '$' in data_string:
-        salt, data = data_string.split('$')
-        password = get_password_from_user()
+        raise Exception("Unsupported KDF {}".format(kdf.get("name")))
+    with trace.span("wallet.kdf", kdf=kdf.get("name")):
+        return base64.urlsafe_b64encode(key_derivation.derive(password.encode()))
+
+
+def get_wallet_encryption(json_data, field="private_key"):
+    # returns (kdf parameters, Fernet token) for both wallet formats, or (None, None) for unencrypted keys.
+    # version 1 wallets store "base64(salt)$base64(token)" and always used PBKDF2-SHA256 with 100,000 iterations
+    if json_data.get("version", 1) >= 2:
+        if json_data.get("kdf") is None:
+            return None, None
+        return json_data.get("kdf"), json_data.get(field)
+    data_string = json_data.get(field)
+    if '$' not in data_string:
+        return None, None
+    salt, data = data_string.split('$')
+    kdf = {"name": "pbkdf2-sha256", "salt": salt}
+    kdf.update(KDF_DEFAULTS.get("pbkdf2-sha256"))
+    return kdf, base64.b64decode(data).decode('ascii')
+
+
+def get_wallet_key(json_data, password=None):
+    # Fernet key of an encrypted wallet, None for unencrypted ones; the private key and the HD seed share it
+    from . import agent
+    kdf, token = get_wallet_encryption(json_data)
+    if kdf is None:
+        return None
+    # a wallet unlocked in a running agent skips both the password prompt and the KDF; only unlock_wallet stores keys
+    key = agent.get_key(kdf.get("salt")) if password is None else None
+    trace.count("agent.lookups", result="miss" if key is None else "hit")
+    if key is None:
+        if password is None:
+            password = get_password_from_user()
         if password is None:
             raise Exception("Password needed, but not provided")
-    else:
-        return data_string
-    key, salt = generate_key_from_password(password=password, salt=base64.b64decode(salt))
-    f = Fernet(key)
-    data_binary = base64.b64decode(data)
+    # the span starts after the prompt, so it times key derivation and decryption only
+    with trace.span("wallet.decrypt"):
+        if key is None:
+            key = derive_key(password, kdf)
+        decrypt_wallet_field(json_data, key)
+    return key
+
+
+def decrypt_wallet_field(json_data, key, field="private_key"):
+    kdf, token = get_wallet_encryption(json_data, field)
+    if kdf is None:
+        return json_data.get(field)
+    from cryptography.fernet import Fernet, InvalidToken
     try:
-        decrypted_data = f.decrypt(data_binary)
-        return decrypted_data.decode('ascii')
+        return Fernet(key).decrypt(token.encode('ascii')).decode('ascii')
     except InvalidToken:
         raise Exception("Cannot decrypt private key. Perhaps invalid password was provided.")
 
 
-def write_wallet(wallet_file, private_key, public_key, password=None):
+def write_wallet(wallet_file, private_key, public_key, password=None, kdf_name=DEFAULT_KDF, seed=None):
+    # seed is the hex BIP-39 seed of HD wallets; it is encrypted together with the private key
+    from cryptography.fernet import Fernet
     password = getpass.getpass(prompt="Password for private key encryption (press ENTER for no encryption):")
     if password is None or len(password.strip()) == 0:
         print("Skipping private key encryption.")
         password = None
-    f = open(wallet_file, "w")
+    json_data = {
+        "version": WALLET_VERSION,
+        "public_key": public_key
+    }
+    if password is None:
+        json_data["private_key"] = private_key
+        if seed is not None:
+            json_data["seed"] = seed
+    else:
+        kdf = new_kdf_params(kdf_name)
+        key = derive_key(password, kdf)
+        json_data["kdf"] = kdf
+        json_data["private_key"] = Fernet(key).encrypt(private_key.encode('ascii')).decode('ascii')
+        if seed is not None:
+            json_data["seed"] = Fernet(key).encrypt(seed.encode('ascii')).decode('ascii')
+    # written to a temporary file first so an existing wallet is only ever replaced by a complete one
+    tmp_file = "{}.tmp".format(wallet_file)
+    with open(tmp_file, "w") as f:
+        f.write(json.dumps(json_data, indent=4))
+    os.replace(tmp_file, wallet_file)
+
+
+def read_wallet_data(wallet_file):
+    with open(wallet_file, mode="r") as f:
+        return json.loads(f.read())
+
+
+def write_watch_only_wallet(wallet_file, public_key):
     json_data = {
         "public_key": public_key,
-        "private_key": key_encrypt_with_password(data_string=private_key, password=password)
+        "watch_only": True
     }
-    f.write(json.dumps(json_data, indent=4))
-    f.close()
+    with open(wallet_file, "w") as f:
+        f.write(json.dumps(json_data, indent=4))
+
+
+def set_account_index(account_index):
+    # --account-index: wallet commands use the SEP-0005 account m/44'/148'/index' of HD wallets
+    global _account_index
+    _account_index = account_index or 0
+
+
+def load_wallet_public_key(wallet_file):
+    # derived public keys come from the lookup table next to the wallet, so the seed is only decrypted once per index
+    json_data = read_wallet_data(wallet_file)
+    if _account_index == 0:
+        return json_data.get("public_key")
+    check_wallet_seed(json_data, wallet_file)
+    from . import hdwallet
+    connection = hdwallet.connect(hdwallet.get_index_file(wallet_file), json_data.get("public_key"))
+    try:
+        public_key = hdwallet.get_public_key(connection, _account_index)
+        if public_key is None:
+            public_key = load_wallet(wallet_file=wallet_file)[1]
+            hdwallet.put_accounts(connection, [(_account_index, public_key)])
+    finally:
+        connection.close()
+    return public_key
+
+
+def check_wallet_seed(json_data, wallet_file):
+    if json_data.get("seed") is None:
+        raise ValueError("Wallet {} has no HD seed, only account index 0 is available. "
+                         "Create HD wallets with --mnemonic.".format(wallet_file))
+
+
+def get_wallet_seed(json_data, key, wallet_file):
+    check_wallet_seed(json_data, wallet_file)
+    return bytes.fromhex(decrypt_wallet_field(json_data, key, "seed"))
+
+
+def load_wallet_seed(wallet_file):
+    json_data = read_wallet_data(wallet_file)
+    return get_wallet_seed(json_data, get_wallet_key(json_data), wallet_file)
+
+
+def is_wallet_file(path):
+    try:
+        json_data = read_wallet_data(path)
+    except (OSError, ValueError):
+        return False
+    return isinstance(json_data, dict) and "public_key" in json_data
+
+
+def read_account_list(accounts):
+    # accepts a comma separated list, a single wallet file or the path of a file with one entry per line
+    if os.path.isfile(accounts) and not is_wallet_file(accounts):
+        with open(accounts, mode="r") as f:
+            entries = [line.strip() for line in f]
+    else:
+        entries = [entry.strip() for entry in accounts.split(",")]
+    return [entry for entry in entries if len(entry) > 0 and not entry.startswith("#")]
+
+
+_loaded_wallets = {}
+_account_index = 0
+
+
+def keep_wallet_loaded(wallet_file):
+    # long running processes decrypt the wallet once and serve later load_wallet calls from memory
+    _loaded_wallets[(os.path.abspath(wallet_file), _account_index)] = load_wallet(wallet_file=wallet_file)
 
 
 def load_wallet(wallet_file):
-    f = open(wallet_file, mode="r")
-    content = f.read()
-    json_data = json.loads(content)
-    f.close()
-    private_key = key_decrypt_with_password(data_string=json_data.get("private_key"))
-    public_key = json_data.get("public_key")
-    return (private_key, public_key)
+    if (os.path.abspath(wallet_file), _account_index) in _loaded_wallets:
+        return _loaded_wallets[(os.path.abspath(wallet_file), _account_index)]
+    json_data = read_wallet_data(wallet_file)
+    if json_data.get("private_key") is None:
+        raise Exception("Wallet {} is watch-only and cannot sign transactions.".format(wallet_file))
+    key = get_wallet_key(json_data)
+    if _account_index == 0:
+        return (decrypt_wallet_field(json_data, key), json_data.get("public_key"))
+    seed = get_wallet_seed(json_data, key, wallet_file)
+    from . import hdwallet
+    keypair = hdwallet.derive_keypair(seed, _account_index)
+    return (keypair.secret, keypair.public_key)
+
+
+def unlock_wallet(wallet_file, timeout=None):
+    # derives the key once and hands it to the agent; returns False for unencrypted wallets or without an agent
+    from cryptography.fernet import Fernet, InvalidToken
+    from . import agent
+    json_data = read_wallet_data(wallet_file)
+    kdf, token = get_wallet_encryption(json_data)
+    if kdf is None:
+        return False
+    key = derive_key(get_password_from_user(), kdf)
+    try:
+        Fernet(key).decrypt(token.encode('ascii'))
+    except InvalidToken:
+        raise Exception("Cannot decrypt private key. Perhaps invalid password was provided.")
+    return agent.put_key(kdf.get("salt"), key, timeout=timeout)
+
+
+def migrate_wallet(wallet_file, kdf_name=DEFAULT_KDF):
+    json_data = read_wallet_data(wallet_file)
+    if json_data.get("private_key") is None:
+        raise Exception("Wallet {} is watch-only, there is nothing to migrate.".format(wallet_file))
+    key = get_wallet_key(json_data)
+    private_key = decrypt_wallet_field(json_data, key)
+    seed = None if json_data.get("seed") is None else decrypt_wallet_field(json_data, key, "seed")
+    # an earlier backup is never overwritten, a second migration gets a timestamped one
+    backup_file = "{}.bak".format(wallet_file)
+    if os.path.exists(backup_file):
+        backup_file = "{}.{}.bak".format(wallet_file, time.strftime("%Y%m%d%H%M%S"))
+    with open(backup_file, "x") as f:
+        f.write(json.dumps(json_data, indent=4))
+    write_wallet(wallet_file=wallet_file, private_key=private_key, public_key=json_data.get("public_key"),
+                 kdf_name=kdf_name, seed=seed)
+    return backup_file
+
+
+def get_channel_file(wallet_file):
+    if wallet_file is None:
+        return "trezor.channels.json"
+    return "{}.channels.json".format(wallet_file)
+
+
+def write_channels(channel_file, private_keys, public_keys, kdf_name=DEFAULT_KDF):
+    from cryptography.fernet import Fernet
+    password = getpass.getpass(prompt="Password for channel keys encryption (press ENTER for no encryption):")
+    if password is None or len(password.strip()) == 0:
+        print("Skipping channel keys encryption.")
+        password = None
+    # all channel secrets are encrypted together (same format as wallets) so loading the pool costs a single KDF
+    json_data = {
+        "version": WALLET_VERSION,
+        "public_keys": public_keys
+    }
+    if password is None:
+        json_data["private_keys"] = json.dumps(private_keys)
+    else:
+        kdf = new_kdf_params(kdf_name)
+        json_data["kdf"] = kdf
+        json_data["private_keys"] = Fernet(derive_key(password, kdf)).encrypt(
+            json.dumps(private_keys).encode('ascii')).decode('ascii')
+    tmp_file = "{}.tmp".format(channel_file)
+    with open(tmp_file, "w") as f:
+        f.write(json.dumps(json_data, indent=4))
+    os.replace(tmp_file, channel_file)
+
+
+def load_channels(channel_file):
+    # reads both the versioned format and the "salt$token" PBKDF2 format of older channel files
+    with open(channel_file, mode="r") as f:
+        json_data = json.loads(f.read())
+    kdf, token = get_wallet_encryption(json_data, "private_keys")
+    key = None if kdf is None else derive_key(get_password_from_user(), kdf)
+    private_keys = json.loads(decrypt_wallet_field(json_data, key, "private_keys"))
+    public_keys = json_data.get("public_keys")
+    return list(zip(private_keys, public_keys))
+
+
+def read_payment_file(payment_file):
+    # yields (row_number, row) tuples; CSV needs a header row, .jsonl/.ndjson holds one JSON object per line
+    with open(payment_file, mode="r", newline="") as f:
+        if payment_file.endswith(".jsonl") or payment_file.endswith(".ndjson"):
+            row_number = 0
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                row_number += 1
+                yield row_number, json.loads(line)
+        else:
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                yield row_number, row
+
+
+def write_report_line(report, data):
+    report.write("{}\n".format(json.dumps(data)))
+    report.flush()
+
+
+def read_cursor(cursor_file):
+    if cursor_file is None or not os.path.exists(cursor_file):
+        return None
+    with open(cursor_file, mode="r") as f:
+        cursor = f.read().strip()
+    return cursor if len(cursor) > 0 else None
+
+
+def write_cursor(cursor_file, cursor):
+    # replace atomically so an interrupted export never leaves a truncated cursor behind
+    tmp_file = "{}.tmp".format(cursor_file)
+    with open(tmp_file, mode="w") as f:
+        f.write(cursor)
+    os.replace(tmp_file, cursor_file)
+
+
+def read_sequence_file(sequence_file):
+    # {"GACCOUNT...": "current sequence number", ...} as Horizon reports it for each account
+    with open(sequence_file, mode="r") as f:
+        return {account_id: int(sequence) for account_id, sequence in json.loads(f.read()).items()}
+
+
+def write_sequence_file(sequence_file, sequences):
+    tmp_file = "{}.tmp".format(sequence_file)
+    with open(tmp_file, mode="w") as f:
+        f.write(json.dumps({account_id: str(sequence) for account_id, sequence in sequences.items()}, indent=4))
+    os.replace(tmp_file, sequence_file)
+
+
+def read_xdr_file(xdr_file):
+    # yields (line_number, xdr) tuples, one base64 XDR envelope per line; "-" reads stdin, empty lines and
+    # "#" comments are skipped
+    f = sys.stdin if xdr_file == "-" else open(xdr_file, mode="r")
+    try:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if len(line) > 0 and not line.startswith("#"):
+                yield line_number, line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_confirmation(prompt, from_terminal=False):
+    # when stdin carries the data being signed, the confirmation is read from the terminal instead
+    if not from_terminal:
+        return input(prompt)
+    with open("/dev/tty", mode="r") as tty:
+        print(prompt, end="", flush=True)
+        return tty.readline()
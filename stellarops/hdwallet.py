@@ -0,0 +1,114 @@
+import hashlib
+import hmac
+import os
+import sqlite3
+import struct
+import unicodedata
+
+# SEP-0005 accounts (m/44'/148'/index') derived from the BIP-39 seed stored in the wallet file, and the lookup table
+# of derived public keys kept next to it. stellar_sdk is only imported when a keypair is actually derived.
+
+HARDENED = 0x80000000
+STELLAR_PATH = (44, 148)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    account_index INTEGER PRIMARY KEY,
+    public_key TEXT NOT NULL UNIQUE
+);
+"""
+
+
+def mnemonic_to_seed(mnemonic, passphrase=""):
+    # the 2048 PBKDF2 rounds are the expensive part of SEP-0005; they run once, when the wallet is created
+    mnemonic = unicodedata.normalize("NFKD", mnemonic)
+    salt = unicodedata.normalize("NFKD", "mnemonic" + passphrase)
+    return hashlib.pbkdf2_hmac("sha512", mnemonic.encode(), salt.encode(), 2048)
+
+
+def derive_child(key, chain_code, index):
+    digest = hmac.new(chain_code, b"\x00" + key + struct.pack(">I", index | HARDENED), hashlib.sha512).digest()
+    return digest[:32], digest[32:]
+
+
+def get_account_root(seed):
+    # SLIP-0010 ed25519 node m/44'/148'; each account is one more hardened step from here
+    digest = hmac.new(b"ed25519 seed", seed, hashlib.sha512).digest()
+    key, chain_code = digest[:32], digest[32:]
+    for index in STELLAR_PATH:
+        key, chain_code = derive_child(key, chain_code, index)
+    return key, chain_code
+
+
+def derive_keypair(seed, account_index, root=None):
+    from stellar_sdk import Keypair
+    if root is None:
+        root = get_account_root(seed)
+    key, chain_code = derive_child(root[0], root[1], account_index)
+    return Keypair.from_raw_ed25519_seed(key)
+
+
+def derive_public_keys(seed, start, count):
+    root = get_account_root(seed)
+    for account_index in range(start, start + count):
+        yield account_index, derive_keypair(seed, account_index, root=root).public_key
+
+
+def get_index_file(wallet_file, owner=None):
+    # file wallets keep the table next to them, Trezor devices get one table per device (named after account 0)
+    if wallet_file is None:
+        from .cache import get_cache_dir
+        return os.path.join(get_cache_dir(), "trezor-{}.accounts.db".format(owner))
+    return "{}.accounts.db".format(wallet_file)
+
+
+def connect(index_file, owner):
+    # owner is the public key of account 0 of the seed or device; a table written for another one is refused
+    directory = os.path.dirname(index_file)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(index_file)
+    connection.executescript(SCHEMA)
+    row = connection.execute("SELECT value FROM meta WHERE key = 'owner'").fetchone()
+    known_owner = get_public_key(connection, 0) if row is None else row[0]
+    if known_owner is not None and known_owner != owner:
+        connection.close()
+        raise ValueError("Account table {} was derived for {}, not for {}.".format(index_file, known_owner, owner))
+    if row is None:
+        with connection:
+            connection.execute("INSERT INTO meta (key, value) VALUES ('owner', ?)", (owner,))
+    return connection
+
+
+def put_accounts(connection, accounts):
+    # accounts is an iterable of (account_index, public_key)
+    with connection:
+        connection.executemany("INSERT OR REPLACE INTO accounts (account_index, public_key) VALUES (?, ?)", accounts)
+
+
+def get_public_key(connection, account_index):
+    row = connection.execute("SELECT public_key FROM accounts WHERE account_index = ?", (account_index,)).fetchone()
+    return None if row is None else row[0]
+
+
+def find_account_index(connection, public_key):
+    row = connection.execute("SELECT account_index FROM accounts WHERE public_key = ?", (public_key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def get_next_index(connection):
+    row = connection.execute("SELECT MAX(account_index) FROM accounts").fetchone()
+    return 0 if row[0] is None else row[0] + 1
+
+
+def list_accounts(connection, start=0, count=None):
+    query = "SELECT account_index, public_key FROM accounts WHERE account_index >= ? ORDER BY account_index"
+    params = (start,)
+    if count is not None:
+        query += " LIMIT ?"
+        params = (start, count)
+    return connection.execute(query, params).fetchall()
@@ -0,0 +1,194 @@
+import json
+import os
+import sqlite3
+from decimal import Decimal
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    cursor TEXT NOT NULL,
+    PRIMARY KEY (account_id, kind)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    account_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    paging_token TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    ledger INTEGER,
+    created_at TEXT NOT NULL,
+    source_account TEXT,
+    memo_type TEXT,
+    memo TEXT,
+    fee_charged TEXT,
+    successful INTEGER,
+    PRIMARY KEY (account_id, id)
+);
+CREATE INDEX IF NOT EXISTS transactions_hash ON transactions (hash);
+CREATE INDEX IF NOT EXISTS transactions_memo ON transactions (account_id, memo);
+CREATE TABLE IF NOT EXISTS operations (
+    account_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    paging_token TEXT NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    type TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    from_account TEXT,
+    to_account TEXT,
+    asset TEXT,
+    amount TEXT,
+    source_asset TEXT,
+    source_amount TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (account_id, id)
+);
+CREATE INDEX IF NOT EXISTS operations_created_at ON operations (account_id, created_at);
+CREATE INDEX IF NOT EXISTS operations_asset ON operations (account_id, asset);
+CREATE INDEX IF NOT EXISTS operations_from ON operations (account_id, from_account);
+CREATE INDEX IF NOT EXISTS operations_to ON operations (account_id, to_account);
+CREATE INDEX IF NOT EXISTS operations_transaction ON operations (transaction_hash);
+CREATE TABLE IF NOT EXISTS effects (
+    account_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    paging_token TEXT NOT NULL,
+    type TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    asset TEXT,
+    amount TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (account_id, id)
+);
+CREATE INDEX IF NOT EXISTS effects_created_at ON effects (account_id, created_at);
+"""
+
+
+def connect(history_file, network_passphrase):
+    # cursors and rows are keyed by account only, so one database holds the history of one network
+    directory = os.path.dirname(history_file)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(history_file)
+    connection.executescript(SCHEMA)
+    row = connection.execute("SELECT value FROM meta WHERE key = 'network_passphrase'").fetchone()
+    if row is None:
+        connection.execute("INSERT INTO meta (key, value) VALUES ('network_passphrase', ?)", (network_passphrase,))
+        connection.commit()
+    elif row[0] != network_passphrase:
+        connection.close()
+        raise ValueError("{} holds the history of another network ({})".format(history_file, row[0]))
+    return connection
+
+
+def get_cursor(connection, account_id, kind):
+    row = connection.execute("SELECT cursor FROM sync_state WHERE account_id = ? AND kind = ?",
+                             (account_id, kind)).fetchone()
+    return None if row is None else row[0]
+
+
+def set_cursor(connection, account_id, kind, cursor):
+    connection.execute("INSERT OR REPLACE INTO sync_state (account_id, kind, cursor) VALUES (?, ?, ?)",
+                       (account_id, kind, cursor))
+
+
+def record_asset(record, prefix=""):
+    asset_type = record.get("{}asset_type".format(prefix))
+    if asset_type is None:
+        return None
+    if asset_type == "native":
+        return "XLM"
+    if asset_type == "liquidity_pool_shares":
+        return "pool:{}".format(record.get("liquidity_pool_id"))
+    return "{}:{}".format(record.get("{}asset_code".format(prefix)), record.get("{}asset_issuer".format(prefix)))
+
+
+def insert_transaction(connection, account_id, record):
+    connection.execute(
+        "INSERT OR REPLACE INTO transactions (account_id, id, paging_token, hash, ledger, created_at, source_account, "
+        "memo_type, memo, fee_charged, successful) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (account_id, record.get("id"), record.get("paging_token"), record.get("hash"), record.get("ledger"),
+         record.get("created_at"), record.get("source_account"), record.get("memo_type"), record.get("memo"),
+         record.get("fee_charged"), 1 if record.get("successful") else 0))
+
+
+def insert_operation(connection, account_id, record):
+    operation_type = record.get("type")
+    from_account = record.get("from")
+    to_account = record.get("to")
+    asset = record_asset(record)
+    amount = record.get("amount")
+    if operation_type == "create_account":
+        from_account = record.get("funder")
+        to_account = record.get("account")
+        asset = "XLM"
+        amount = record.get("starting_balance")
+    elif operation_type == "account_merge":
+        from_account = record.get("account")
+        to_account = record.get("into")
+    connection.execute(
+        "INSERT OR REPLACE INTO operations (account_id, id, paging_token, transaction_hash, type, created_at, "
+        "from_account, to_account, asset, amount, source_asset, source_amount, record) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (account_id, record.get("id"), record.get("paging_token"), record.get("transaction_hash"), operation_type,
+         record.get("created_at"), from_account, to_account, asset, amount, record_asset(record, prefix="source_"),
+         record.get("source_amount"), json.dumps(record)))
+
+
+def insert_effect(connection, account_id, record):
+    connection.execute(
+        "INSERT OR REPLACE INTO effects (account_id, id, paging_token, type, created_at, asset, amount, record) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (account_id, record.get("id"), record.get("paging_token"), record.get("type"), record.get("created_at"),
+         record_asset(record), record.get("amount"), json.dumps(record)))
+
+
+INSERTERS = {
+    "transactions": insert_transaction,
+    "operations": insert_operation,
+    "effects": insert_effect
+}
+
+
+def query_operations(connection, account_id, asset=None, counterparty=None, memo=None, since=None, until=None):
+    query = ("SELECT o.id, o.transaction_hash, o.type, o.created_at, o.from_account, o.to_account, o.asset, o.amount, "
+             "o.source_asset, o.source_amount, t.memo FROM operations o "
+             "LEFT JOIN transactions t ON t.account_id = o.account_id AND t.hash = o.transaction_hash "
+             "WHERE o.account_id = ?")
+    params = [account_id]
+    if asset is not None:
+        query += " AND (o.asset = ? OR o.source_asset = ?)"
+        params += [asset, asset]
+    if counterparty is not None:
+        query += " AND (o.from_account = ? OR o.to_account = ?)"
+        params += [counterparty, counterparty]
+    if memo is not None:
+        query += " AND t.memo = ?"
+        params.append(memo)
+    # created_at is stored as Horizon's UTC ISO 8601 string, so lexical order is chronological
+    if since is not None:
+        query += " AND o.created_at >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND o.created_at <= ?"
+        params.append(until)
+    query += " ORDER BY o.paging_token"
+    columns = ["id", "transaction_hash", "type", "created_at", "from", "to", "asset", "amount",
+               "source_asset", "source_amount", "memo"]
+    for row in connection.execute(query, params):
+        yield dict(zip(columns, row))
+
+
+def add_to_totals(totals, account_id, operation):
+    if operation.get("to") == account_id and operation.get("amount") is not None:
+        entry = totals.setdefault(operation.get("asset"), {"received": Decimal(0), "sent": Decimal(0)})
+        entry["received"] += Decimal(operation.get("amount"))
+    if operation.get("from") == account_id:
+        asset = operation.get("source_asset") or operation.get("asset")
+        amount = operation.get("source_amount") or operation.get("amount")
+        if asset is not None and amount is not None:
+            entry = totals.setdefault(asset, {"received": Decimal(0), "sent": Decimal(0)})
+            entry["sent"] += Decimal(amount)
@@ -1,50 +1,144 @@
-from stellar_sdk import Asset, Keypair, Network, Server, TransactionBuilder, Transaction, TransactionEnvelope
+from stellar_sdk import Asset, Keypair, Network, Server, TransactionBuilder, Transaction, \
+    PathPaymentStrictSend, PathPaymentStrictReceive, MuxedAccount
 from stellar_sdk.exceptions import BaseHorizonError
-from stellar_sdk.xdr.decorated_signature import DecoratedSignature
-from stellar_sdk.xdr.signature_hint import SignatureHint
-from stellar_sdk.xdr.signature import Signature
-from trezorlib import stellar as trezor_stellar
-from trezorlib import tools as trezor_tools
-from trezorlib import messages
-from trezorlib import client
-from .fileops import load_wallet, write_wallet
+from stellar_sdk.helpers import parse_transaction_envelope_from_xdr
+from stellar_sdk.strkey import StrKey
+from .wallet import generate_qr_code_url
+from .fileops import load_wallet, write_wallet, read_payment_file, write_report_line, get_channel_file, \
+    write_channels, read_cursor, write_cursor, load_wallet_public_key, read_account_list, write_watch_only_wallet, \
+    read_xdr_file, read_confirmation, DEFAULT_KDF, load_wallet_seed, read_wallet_data
+import time
+from datetime import datetime, timedelta, timezone
+from .sequence import SequenceManager, OfflineSequenceManager, is_bad_sequence_error
+from .channels import load_channel_pool
+from . import asyncops
+from . import cache
+from . import history
+from . import submit
+from . import fees
+from . import transport
+from . import paths
+from . import preflight
+from . import hdwallet
+from . import trace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from decimal import Decimal, InvalidOperation
+import asyncio
 import os
-import base64
+import sys
 import json
-import toml
-import requests
 
 
-BASE_FEE = 5000
+MAX_OPS_PER_TX = 100
+MAX_SIGNATURES = 20
+MAX_AMOUNT = Decimal("922337203685.4775807")
+
+_servers = {}
+_sequence_managers = {}
+_sequence_file = None
 
 
 def get_network_settings(test_mode):
+    # horizon_url is the preferred endpoint and identifies the network in caches; requests fail over to horizon_urls
+    horizon_urls = transport.get_horizon_urls(test_mode)
+    transport.get_pool(horizon_urls, network_passphrase=Network.TESTNET_NETWORK_PASSPHRASE if test_mode else
+                       Network.PUBLIC_NETWORK_PASSPHRASE)
     if test_mode:
         return {
             "network_passphrase": Network.TESTNET_NETWORK_PASSPHRASE,
-            "horizon_url": "https://horizon-testnet.stellar.org"
+            "horizon_url": horizon_urls[0],
+            "horizon_urls": horizon_urls
         }
     else:
         return {
             "network_passphrase": Network.PUBLIC_NETWORK_PASSPHRASE,
-            "horizon_url": "https://horizon.stellar.org"
+            "horizon_url": horizon_urls[0],
+            "horizon_urls": horizon_urls
         }
 
 
-def create_stellar_wallet(wallet_file, use_mnemonic=False, generate_qr_code_link=False):
+def get_server(network_settings):
+    # servers are kept per horizon so their HTTP session (and its keep-alive connections) is reused
+    horizon_url = network_settings.get("horizon_url")
+    if horizon_url not in _servers:
+        _servers[horizon_url] = Server(horizon_url, client=transport.FailoverClient())
+    return _servers[horizon_url]
+
+
+def set_sequence_file(sequence_file):
+    # offline builds take (and advance) sequence numbers from sequence_file instead of loading accounts
+    global _sequence_file
+    _sequence_file = sequence_file
+
+
+def get_sequence_manager(network_settings):
+    # one manager per horizon so every transaction built in this process shares the local sequence numbers
+    horizon_url = network_settings.get("horizon_url")
+    if horizon_url not in _sequence_managers:
+        if _sequence_file is not None:
+            _sequence_managers[horizon_url] = OfflineSequenceManager(sequence_file=_sequence_file)
+        else:
+            _sequence_managers[horizon_url] = SequenceManager(server=get_server(network_settings))
+    return _sequence_managers[horizon_url]
+
+
+def build_with_sequence(sequence_manager, account_id, build_transaction):
+    # the reserved number goes back to the manager when the envelope can't be built (or the Trezor refuses it)
+    account = sequence_manager.reserve(account_id)
+    sequence = account.sequence
+    try:
+        with trace.span("tx.build"):
+            transaction = build_transaction(account)
+    except BaseException:
+        sequence_manager.release(account_id, sequence)
+        raise
+    sequence_manager.save()
+    return transaction
+
+
+def submit_with_sequence(server, sequence_manager, account_id, build_transaction, network_passphrase=None,
+                         max_fee=None, fee_source=None):
+    # build_transaction(account) returns a signed envelope; it is rebuilt once with fresh sequence on tx_bad_seq.
+    # timeouts are retried by hash and, with max_fee and a fee_source, tx_insufficient_fee is fee-bumped
+    transaction = build_with_sequence(sequence_manager, account_id, build_transaction)
+    attempts = {}
+    try:
+        return transaction, submit.submit_envelope(server, transaction, network_passphrase, max_fee=max_fee,
+                                                   fee_source=fee_source, attempts=attempts)
+    except BaseHorizonError as e:
+        # after a retry the first envelope may still land (submit_envelope found none of its hashes), so a new
+        # envelope with a fresh sequence number could pay twice
+        if not is_bad_sequence_error(e) or attempts.get("count", 1) > 1:
+            raise
+    sequence_manager.resync(account_id)
+    transaction = build_with_sequence(sequence_manager, account_id, build_transaction)
+    return transaction, submit.submit_envelope(server, transaction, network_passphrase, max_fee=max_fee,
+                                               fee_source=fee_source)
+
+
+def get_fee_source(keypair):
+    # only a keypair holding its secret can sign fee-bump envelopes
+    return keypair if keypair.can_sign() else None
+
+
+def create_stellar_wallet(wallet_file, use_mnemonic=False, generate_qr_code_link=False, kdf_name=DEFAULT_KDF):
     if os.path.exists(wallet_file):
         print("Error: Wallet file already exists! Will not overwrite it for security reasons.")
         return
     else:
+        seed = None
         if use_mnemonic:
+            # the BIP-39 seed is kept (encrypted) in the wallet so any SEP-0005 account can be derived later
             mnemonic = Keypair.generate_mnemonic_phrase(strength=256)
-            keypair = Keypair.from_mnemonic_phrase(mnemonic)
+            seed = hdwallet.mnemonic_to_seed(mnemonic)
+            keypair = hdwallet.derive_keypair(seed, 0)
         else:
             keypair = Keypair.random()
             mnemonic = "NOT_USED"
         public_key = keypair.public_key
         private_key = keypair.secret
-        write_wallet(wallet_file=wallet_file, private_key=private_key, public_key=public_key)
+        write_wallet(wallet_file=wallet_file, private_key=private_key, public_key=public_key, kdf_name=kdf_name,
+                     seed=None if seed is None else seed.hex())
         response = {
             "public_key": public_key,
             "mnemonic": mnemonic,
@@ -55,14 +149,77 @@ def create_stellar_wallet(wallet_file, use_mnemonic=False, generate_qr_code_link
             print(generate_qr_code_url(public_key))
 
 
-def retrieve_stellar_wallet_public_key(wallet_file, generate_qr_code_link=False):
-    (private_key, public_key) = load_wallet(wallet_file=wallet_file)
-    print(public_key)
+def connect_account_table(wallet_file, trezor_mode=False):
+    # the SEP-0005 lookup table of the wallet or Trezor, bound to the public key of its account 0
+    if trezor_mode:
+        from . import trezor
+        owner = trezor.get_session().get_public_key(account_index=0)
+        index_file = hdwallet.get_index_file(None, owner=owner)
+    else:
+        owner = read_wallet_data(wallet_file).get("public_key")
+        index_file = hdwallet.get_index_file(wallet_file)
+    return index_file, hdwallet.connect(index_file, owner)
+
+
+def derive_accounts(wallet_file, count, start=None, trezor_mode=False, output_file=None):
+    # stores (account_index, public_key) of count SEP-0005 accounts in the lookup table next to the wallet;
+    # indexes already in the table are not derived again
+    try:
+        index_file, connection = connect_account_table(wallet_file, trezor_mode=trezor_mode)
+    except ValueError as e:
+        print("Error: {}".format(str(e)))
+        return None
+    try:
+        if start is None:
+            start = hdwallet.get_next_index(connection)
+        known = set([account_index for account_index, public_key in hdwallet.list_accounts(connection, start, count)])
+        missing = [account_index for account_index in range(start, start + count) if account_index not in known]
+        if len(missing) > 0:
+            with trace.span("wallet.derive", count=len(missing)):
+                if trezor_mode:
+                    from . import trezor
+                    session = trezor.get_session()
+                    accounts = [(i, session.get_public_key(account_index=i)) for i in missing]
+                else:
+                    try:
+                        seed = load_wallet_seed(wallet_file=wallet_file)
+                    except ValueError as e:
+                        print("Error: {}".format(str(e)))
+                        return None
+                    root = hdwallet.get_account_root(seed)
+                    accounts = [(i, hdwallet.derive_keypair(seed, i, root=root).public_key) for i in missing]
+            hdwallet.put_accounts(connection, accounts)
+        if output_file is not None:
+            with open(output_file, "w") as f:
+                for account_index, public_key in hdwallet.list_accounts(connection, start, count):
+                    write_report_line(f, {"account_index": account_index, "public_key": public_key})
+    finally:
+        connection.close()
+    summary = {"index_file": index_file, "first_index": start, "last_index": start + count - 1,
+               "derived": len(missing), "already_known": count - len(missing)}
+    print(json.dumps(summary, indent=4))
+    return summary
+
+
+def create_watch_only_wallet(wallet_file, public_key, generate_qr_code_link=False):
+    if os.path.exists(wallet_file):
+        print("Error: Wallet file already exists! Will not overwrite it for security reasons.")
+        return
+    if public_key is None or not StrKey.is_valid_ed25519_public_key(public_key):
+        print("Error: A valid public key is needed for a watch-only wallet.")
+        return
+    write_watch_only_wallet(wallet_file=wallet_file, public_key=public_key)
+    response = {
+        "public_key": public_key,
+        "message": "A watch-only wallet for {} was saved in {}. It can be used for read-only commands.".format(public_key, wallet_file)
+    }
+    print(json.dumps(response, indent=4))
     if generate_qr_code_link:
         print(generate_qr_code_url(public_key))
 
 
-def add_trust(wallet_file, asset, issuer, test_mode=True, trezor_mode=False, vzero=False, timeout=3600):
+def add_trust(wallet_file, asset, issuer, test_mode=True, trezor_mode=False, vzero=False, timeout=3600,
+              max_fee=None, fee_percentile=None):
     network_settings = get_network_settings(test_mode=test_mode)
     if timeout is None:
         timeout = 3600
@@ -74,59 +231,58 @@ def add_trust(wallet_file, asset, issuer, test_mode=True, trezor_mode=False, vze
         public_key = get_trezor_public_key()
         k = Keypair.from_public_key(public_key=public_key)
         v1_mode = False
-    server = Server(network_settings.get("horizon_url"))
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
     stellar_asset = Asset(asset, issuer)
-    account = server.load_account(account_id=k.public_key)
-    transaction = (
-        TransactionBuilder(
-            source_account=account,
-            network_passphrase=network_settings.get("network_passphrase"),
-            base_fee=BASE_FEE,
-            v1=v1_mode
-        )
-        .append_change_trust_op(
-            asset=Asset(code=stellar_asset.code, issuer=stellar_asset.issuer),
+
+    def build_transaction(account):
+        base_fee = fees.choose_base_fee(server, percentile=fee_percentile, max_fee=max_fee)
+        transaction = (
+            TransactionBuilder(
+                source_account=account,
+                network_passphrase=network_settings.get("network_passphrase"),
+                base_fee=base_fee,
+                v1=v1_mode
+            )
+            .append_change_trust_op(
+                asset=Asset(code=stellar_asset.code, issuer=stellar_asset.issuer),
+            )
+            .set_timeout(timeout)
+            .build()
         )
-        .set_timeout(timeout)
-        .build()
-    )
-    if not trezor_mode:
-        transaction.sign(k)
-    else:
-        transaction = sign_trezor_transaction(transaction, k,
-                                              network_passphrase=network_settings.get("network_passphrase"))
+        if not trezor_mode:
+            transaction.sign(k)
+        else:
+            transaction = sign_trezor_transaction(transaction, k,
+                                                  network_passphrase=network_settings.get("network_passphrase"))
+        return transaction
+
     try:
-        transaction_resp = server.submit_transaction(transaction)
+        transaction, transaction_resp = submit_with_sequence(server=server, sequence_manager=sequence_manager,
+                                                             account_id=k.public_key,
+                                                             build_transaction=build_transaction,
+                                                             network_passphrase=network_settings.get("network_passphrase"),
+                                                             max_fee=max_fee, fee_source=get_fee_source(k))
+        transaction_resp = dict(transaction_resp, base_fee=submit.get_fee_per_operation(transaction))
         print("{}".format(json.dumps(transaction_resp, indent=4)))
-    except BaseHorizonError as e:
+        return transaction_resp
+    except submit.SUBMIT_ERRORS as e:
         print("Error: {}".format(str(e)))
+        return {"error": str(e)}
 
 
 def list_balances(wallet_file, test_mode=True, trezor_mode=False):
     network_settings = get_network_settings(test_mode=test_mode)
-    if not trezor_mode:
-        (private_key, public_key) = load_wallet(wallet_file=wallet_file)
-        k = Keypair.from_secret(secret=private_key)
-    else:
-        public_key = get_trezor_public_key()
-        k = Keypair.from_public_key(public_key=public_key)
-    server = Server(network_settings.get("horizon_url"))
-    response = server.accounts().account_id(account_id=k.public_key).call()
-    balances = response.get("balances")
+    public_key = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    balances = asyncops.run(asyncops.load_balances, network_settings.get("horizon_url"), public_key)
     print(json.dumps(balances, indent=4))
+    return balances
 
 
 def list_asset_balance(wallet_file, asset, issuer, domain=None, test_mode=False, trezor_mode=False):
     network_settings = get_network_settings(test_mode=test_mode)
-    if not trezor_mode:
-        (private_key, public_key) = load_wallet(wallet_file=wallet_file)
-        k = Keypair.from_secret(secret=private_key)
-    else:
-        public_key = get_trezor_public_key()
-        k = Keypair.from_public_key(public_key=public_key)
-    server = Server(network_settings.get("horizon_url"))
-    response = server.accounts().account_id(account_id=k.public_key).call()
-    balances = response.get("balances")
+    public_key = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    balances = asyncops.run(asyncops.load_balances, network_settings.get("horizon_url"), public_key)
     for b in balances:
         balance = b.get("balance")
         asset_code = b.get("asset_code")
@@ -141,23 +297,258 @@ def list_asset_balance(wallet_file, asset, issuer, domain=None, test_mode=False,
                     print("{} {}@{} issued by {}".format(balance, asset_code, domain, asset_issuer))
 
 
-def list_transactions(wallet_file, test_mode=True, trezor_mode=False):
+def resolve_account_entry(entry):
+    # an entry is either a public key or a wallet file; wallet files are read without touching the private key.
+    # Returns the exception instead of raising it, so one bad entry doesn't stop a whole report
+    if StrKey.is_valid_ed25519_public_key(entry) and not os.path.exists(entry):
+        return entry
+    try:
+        public_key = load_wallet_public_key(wallet_file=entry)
+    except Exception as e:
+        return ValueError("{} is neither a public key nor a readable wallet file ({})".format(entry, str(e)))
+    if public_key is None or not StrKey.is_valid_ed25519_public_key(public_key):
+        return ValueError("Wallet file {} has no valid public key".format(entry))
+    return public_key
+
+
+def balance_report(accounts, test_mode=True, concurrency=asyncops.DEFAULT_CONCURRENCY, table=False):
     network_settings = get_network_settings(test_mode=test_mode)
-    if not trezor_mode:
-        (private_key, public_key) = load_wallet(wallet_file=wallet_file)
-        k = Keypair.from_secret(secret=private_key)
+    entries = read_account_list(accounts)
+    account_ids = [resolve_account_entry(entry) for entry in entries]
+    valid_ids = [account_id for account_id in account_ids if not isinstance(account_id, Exception)]
+
+    async def fetch_all(clients):
+        return await asyncops.gather_limited(
+            [asyncops.load_balances(clients, network_settings.get("horizon_url"), account_id)
+             for account_id in valid_ids],
+            concurrency=concurrency)
+
+    results = dict(zip(valid_ids, asyncops.run(fetch_all)))
+    report = []
+    totals = {}
+    for entry, account_id in zip(entries, account_ids):
+        if isinstance(account_id, Exception):
+            report.append({"account": entry, "account_id": None, "error": str(account_id)})
+            continue
+        balances = results[account_id]
+        if isinstance(balances, Exception):
+            report.append({"account": entry, "account_id": account_id, "error": str(balances)})
+            continue
+        report.append({"account": entry, "account_id": account_id, "balances": balances})
+        for b in balances:
+            asset = history.record_asset(b)
+            totals[asset] = totals.get(asset, Decimal(0)) + Decimal(b.get("balance"))
+    if table:
+        for r in report:
+            if r.get("error") is not None:
+                print("{:<56}  ERROR {}".format(r.get("account_id") or r.get("account"), r.get("error")))
+                continue
+            for b in r.get("balances"):
+                print("{:<56}  {:>20}  {}".format(r.get("account_id"), b.get("balance"), history.record_asset(b)))
+        for asset, total in totals.items():
+            print("{:<56}  {:>20}  {}".format("TOTAL", str(total), asset))
     else:
-        public_key = get_trezor_public_key()
-        k = Keypair.from_public_key(public_key=public_key)
-    server = Server(network_settings.get("horizon_url"))
-    response = server.transactions().for_account(account_id=k.public_key).call()
+        response = {
+            "accounts": report,
+            "totals": {asset: str(total) for asset, total in totals.items()}
+        }
+        print(json.dumps(response, indent=4))
+
+
+def list_transactions(wallet_file, test_mode=True, trezor_mode=False):
+    network_settings = get_network_settings(test_mode=test_mode)
+    public_key = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    response = asyncops.run(asyncops.load_transactions, network_settings.get("horizon_url"), public_key)
+    print(json.dumps(response, indent=4))
+
+
+def parse_timestamp(value):
+    if value is None:
+        return None
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def parse_until(value):
+    # a date without a time covers that whole day (Horizon's created_at has whole seconds)
+    timestamp = parse_timestamp(value)
+    if timestamp is not None and ":" not in value:
+        timestamp += timedelta(days=1) - timedelta(microseconds=1)
+    return timestamp
+
+
+def stream_transactions(wallet_file, test_mode=True, trezor_mode=False, output_file=None,
+                        cursor=None, cursor_file=None, since=None, until=None, limit=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    public_key = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    if cursor is None:
+        cursor = read_cursor(cursor_file)
+    since = parse_timestamp(since)
+    until = parse_until(until)
+
+    async def export(clients):
+        count = 0
+        last_cursor = cursor
+        output = sys.stdout if output_file is None else open(output_file, "a")
+        try:
+            async for record, page_cursor in asyncops.iter_transactions(clients, network_settings.get("horizon_url"),
+                                                                        public_key, cursor=cursor):
+                created_at = parse_timestamp(record.get("created_at"))
+                if until is not None and created_at > until:
+                    break
+                if since is None or created_at >= since:
+                    write_report_line(output, record)
+                    count += 1
+                last_cursor = record.get("paging_token")
+                if cursor_file is not None and last_cursor == page_cursor:
+                    write_cursor(cursor_file, last_cursor)
+                if limit is not None and count >= limit:
+                    break
+        finally:
+            if cursor_file is not None and last_cursor is not None:
+                write_cursor(cursor_file, last_cursor)
+            if output_file is not None:
+                output.close()
+        return count
+
+    count = asyncops.run(export)
+    print(json.dumps({"transactions": count}), file=sys.stderr)
+
+
+def watch_account(wallet_file, test_mode=True, trezor_mode=False, effects=False, output_file=None,
+                  cursor=None, cursor_file=None, hook=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    public_key = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    if cursor is None:
+        cursor = read_cursor(cursor_file)
+    endpoint = "effects" if effects else "payments"
+
+    async def watch(clients):
+        output = sys.stdout if output_file is None else open(output_file, "a")
+        try:
+            async for record in asyncops.stream_account_records(clients, network_settings.get("horizon_url"),
+                                                                endpoint, public_key, cursor=cursor):
+                write_report_line(output, record)
+                if hook is not None:
+                    returncode = await asyncops.run_hook(hook, record)
+                    if returncode != 0:
+                        print("Hook exited with code {} for {}".format(returncode, record.get("paging_token")),
+                              file=sys.stderr)
+                if cursor_file is not None and record.get("paging_token") is not None:
+                    write_cursor(cursor_file, record.get("paging_token"))
+        finally:
+            if output_file is not None:
+                output.close()
+
+    print("Watching {} of {} (press CTRL+C to stop)".format(endpoint, public_key), file=sys.stderr)
+    try:
+        asyncops.run(watch)
+    except KeyboardInterrupt:
+        pass
+
+
+def format_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def get_history_file(network_settings, history_file=None):
+    if history_file is not None:
+        return history_file
+    network = "testnet" if network_settings.get("network_passphrase") == Network.TESTNET_NETWORK_PASSPHRASE \
+        else "pubnet"
+    return os.path.join(cache.get_cache_dir(), "history-{}.db".format(network))
+
+
+def connect_history(network_settings, history_file=None):
+    history_file = get_history_file(network_settings, history_file)
+    try:
+        return history_file, history.connect(history_file, network_settings.get("network_passphrase"))
+    except ValueError as e:
+        print("Error: {}".format(str(e)))
+        return history_file, None
+
+
+def sync_history(wallet_file, test_mode=True, trezor_mode=False, history_file=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    account_id = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    history_file, connection = connect_history(network_settings, history_file)
+    if connection is None:
+        return
+    counts = {}
+
+    async def sync_kind(clients, kind):
+        counts[kind] = 0
+        insert = history.INSERTERS.get(kind)
+        cursor = history.get_cursor(connection, account_id, kind)
+        async for record, page_cursor in asyncops.iter_account_records(clients, network_settings.get("horizon_url"),
+                                                                       kind, account_id, cursor=cursor):
+            insert(connection, account_id, record)
+            counts[kind] += 1
+            if record.get("paging_token") == page_cursor:
+                # the cursor is stored in the same commit as the page, so a sync can always continue from it
+                history.set_cursor(connection, account_id, kind, page_cursor)
+                connection.commit()
+
+    async def sync_all(clients):
+        await asyncio.gather(*[sync_kind(clients, kind) for kind in history.INSERTERS.keys()])
+
+    try:
+        asyncops.run(sync_all)
+    finally:
+        connection.commit()
+        connection.close()
+    response = {
+        "account_id": account_id,
+        "history_file": history_file,
+        "synced": counts
+    }
+    print(json.dumps(response, indent=4))
+
+
+def query_history(wallet_file, asset=None, issuer=None, counterparty=None, memo=None, since=None, until=None,
+                  test_mode=True, trezor_mode=False, history_file=None, output_file=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    account_id = get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    if asset is not None:
+        asset = asset_to_string(resolve_asset(asset=asset, issuer=issuer))
+    history_file, connection = connect_history(network_settings, history_file)
+    if connection is None:
+        return
+    output = None if output_file is None else open(output_file, "w")
+    totals = {}
+    count = 0
+    try:
+        for operation in history.query_operations(connection, account_id, asset=asset, counterparty=counterparty,
+                                                  memo=memo, since=format_timestamp(parse_timestamp(since)),
+                                                  until=format_timestamp(parse_until(until))):
+            count += 1
+            history.add_to_totals(totals, account_id, operation)
+            if output is not None:
+                write_report_line(output, operation)
+    finally:
+        connection.close()
+        if output is not None:
+            output.close()
+    response = {
+        "account_id": account_id,
+        "operations": count,
+        "totals": {
+            a: {"received": str(t["received"]), "sent": str(t["sent"]), "net": str(t["received"] - t["sent"])}
+            for a, t in totals.items()
+        }
+    }
     print(json.dumps(response, indent=4))
 
 
 def send_payment(wallet_file, asset, issuer, amount, destination,
                  source=None,
                  memo_text=None, memo_id=None, memo_hash=None,
-                 test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600):
+                 test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600,
+                 use_channels=False, max_fee=None, fee_percentile=None, check_destination=True):
     network_settings = get_network_settings(test_mode=test_mode)
     if timeout is None:
         timeout = 3600
@@ -169,109 +560,1076 @@ def send_payment(wallet_file, asset, issuer, amount, destination,
         public_key = get_trezor_public_key()
         k = Keypair.from_public_key(public_key=public_key)
         v1_mode = False
-    server = Server(network_settings.get("horizon_url"))
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
     if source is None:
-        account = server.load_account(account_id=k.public_key)
-    else:
-        account = server.load_account(account_id=source)
+        source = k.public_key
+    channel = None
+    operation_source = None
+    if use_channels:
+        channel = load_channel_pool(channel_file=get_channel_file(wallet_file)).acquire()
+        operation_source = source
+        source = channel.public_key
     if asset is None or issuer is None:
-        tb = (
-            TransactionBuilder(
-                source_account=account,
-                network_passphrase=network_settings.get("network_passphrase"),
-                base_fee=BASE_FEE,
-                v1=v1_mode
-            )
-            .append_payment_op(
-                asset=Asset.native(),
-                destination=destination,
-                amount=str(amount),
-            )
-            .set_timeout(timeout)
-        )
+        payment_asset = Asset.native()
     else:
         stellar_asset = Asset(asset, issuer)
+        payment_asset = Asset(code=stellar_asset.code, issuer=stellar_asset.issuer)
+    if check_destination:
+        failed = preflight_entries([{"destination": destination, "asset": payment_asset, "amount": str(amount)}],
+                                   network_settings)
+        if len(failed) > 0:
+            print("Error: {}".format(failed[0][1]))
+            return {"error": failed[0][1]}
+
+    def build_transaction(account):
+        base_fee = fees.choose_base_fee(server, percentile=fee_percentile, max_fee=max_fee)
         tb = (
             TransactionBuilder(
                 source_account=account,
                 network_passphrase=network_settings.get("network_passphrase"),
-                base_fee=BASE_FEE,
+                base_fee=base_fee,
                 v1=v1_mode
             )
             .append_payment_op(
                 destination=destination,
                 amount=str(amount),
-                asset=Asset(code=stellar_asset.code, issuer=stellar_asset.issuer)
+                asset=payment_asset,
+                source=operation_source
             )
             .set_timeout(timeout)
         )
-    if memo_text is not None:
-        tb.add_text_memo(memo_text=memo_text)
-    elif memo_id is not None:
-        tb.add_id_memo(memo_id=memo_id)
-    elif memo_hash is not None:
-        tb.add_hash_memo(memo_hash=memo_hash)
-    transaction = tb.build()
+        if memo_text is not None:
+            tb.add_text_memo(memo_text=memo_text)
+        elif memo_id is not None:
+            tb.add_id_memo(memo_id=memo_id)
+        elif memo_hash is not None:
+            tb.add_hash_memo(memo_hash=memo_hash)
+        transaction = tb.build()
+        if channel is not None:
+            transaction.sign(channel)
+        if not trezor_mode:
+            transaction.sign(k)
+        else:
+            transaction = sign_trezor_transaction(transaction, k,
+                                                  network_passphrase=network_settings.get("network_passphrase"))
+        return transaction
+
+    if just_sign:
+        transaction = build_with_sequence(sequence_manager, source, build_transaction)
+        print("TX SIGNED DATA:\n{}".format(transaction.to_xdr()))
+        return {"xdr": transaction.to_xdr(), "base_fee": submit.get_fee_per_operation(transaction)}
+    try:
+        transaction, transaction_resp = submit_with_sequence(server=server, sequence_manager=sequence_manager,
+                                                             account_id=source,
+                                                             build_transaction=build_transaction,
+                                                             network_passphrase=network_settings.get("network_passphrase"),
+                                                             max_fee=max_fee, fee_source=get_fee_source(k))
+        transaction_resp = dict(transaction_resp, base_fee=submit.get_fee_per_operation(transaction))
+        print("{}".format(json.dumps(transaction_resp, indent=4)))
+        return transaction_resp
+    except submit.SUBMIT_ERRORS as e:
+        print("Error: {}".format(str(e)))
+        return {"error": str(e)}
+
+
+def get_keypair(wallet_file, trezor_mode=False):
     if not trezor_mode:
-        transaction.sign(k)
+        (private_key, public_key) = load_wallet(wallet_file=wallet_file)
+        return Keypair.from_secret(secret=private_key)
     else:
-        transaction = sign_trezor_transaction(transaction, k,
-                                              network_passphrase=network_settings.get("network_passphrase"))
+        public_key = get_trezor_public_key()
+        return Keypair.from_public_key(public_key=public_key)
+
+
+def get_public_key(wallet_file, trezor_mode=False):
+    # read-only path: the public key is stored in plain text, so the private key is never decrypted
+    if not trezor_mode:
+        return load_wallet_public_key(wallet_file=wallet_file)
+    else:
+        return get_trezor_public_key()
+
+
+def resolve_asset(asset, issuer=None):
+    if issuer is not None and len(issuer.strip()) > 0:
+        return Asset(asset.strip(), issuer.strip())
+    if asset is None or asset.strip().upper() in ("", "XLM", "NATIVE"):
+        return Asset.native()
+    if ':' in asset:
+        asset_code, asset_issuer = asset.strip().split(':', 1)
+        return Asset(asset_code, asset_issuer)
+    if '@' not in asset:
+        raise ValueError("Missing issuer for asset {}".format(asset))
+    asset_code, asset_issuer, asset_domain = get_asset_from_domain(asset_with_domain=asset.strip())
+    if asset_code is None:
+        raise ValueError("Could not identify asset {}".format(asset))
+    return Asset(asset_code, asset_issuer)
+
+
+def asset_to_string(asset):
+    if asset.is_native():
+        return "XLM"
+    return "{}:{}".format(asset.code, asset.issuer)
+
+
+def get_row_asset_key(row, default_asset=None, default_issuer=None):
+    if not row.get("asset"):
+        return default_asset, default_issuer
+    return row.get("asset"), row.get("issuer")
+
+
+def prefetch_row_resolutions(rows, default_asset=None, default_issuer=None, assets=None, destinations=None,
+                             concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # resolves all new ASSETCODE@domain assets and federation addresses of the given rows concurrently
+    domain_assets = {}
+    for row in rows:
+        asset_key = get_row_asset_key(row, default_asset=default_asset, default_issuer=default_issuer)
+        asset_code, asset_issuer = asset_key
+        if asset_key not in assets and not asset_issuer and asset_code and '@' in asset_code:
+            domain_assets[asset_code.strip()] = asset_key
+    federation_addresses = set()
+    for row in rows:
+        destination = (row.get("destination") or "").strip()
+        if '*' in destination and destination not in destinations:
+            federation_addresses.add(destination)
+    if len(domain_assets) == 0 and len(federation_addresses) == 0:
+        return
+
+    async def resolve_all(clients):
+        return await asyncio.gather(
+            asyncops.resolve_assets(clients, domain_assets.keys(), concurrency=concurrency),
+            asyncops.resolve_federation_addresses(clients, federation_addresses, concurrency=concurrency)
+        )
+    with trace.span("batch.resolve"):
+        resolved_assets, resolved_addresses = asyncops.run(resolve_all)
+    for asset_with_domain, result in resolved_assets.items():
+        if isinstance(result, Exception) or result[0] is None:
+            assets[domain_assets[asset_with_domain]] = ValueError("Could not identify asset {}".format(asset_with_domain))
+        else:
+            assets[domain_assets[asset_with_domain]] = Asset(result[0], result[1])
+    for address, result in resolved_addresses.items():
+        if isinstance(result, Exception):
+            print("Could not identify address using Federation server. Error: {}\n".format(str(result)),
+                  file=sys.stderr)
+            destinations[address] = None
+        else:
+            destinations[address] = result
+
+
+def is_valid_amount(amount):
+    # amounts are int64 stroops on the ledger, so at most 7 decimal places
+    try:
+        value = Decimal(amount)
+    except InvalidOperation:
+        return False
+    return value.is_finite() and value.as_tuple().exponent >= -7 and 0 < value <= MAX_AMOUNT
+
+
+def is_valid_destination(address):
+    if address is None:
+        return False
+    if address.startswith("M"):
+        # stellar-sdk raises FeatureNotEnabledError here unless ENABLE_SEP_0023=true is set
+        try:
+            return MuxedAccount.from_account(address) is not None
+        except (ValueError, TypeError):
+            return False
+    return StrKey.is_valid_ed25519_public_key(address)
+
+
+def resolve_payment_row(row, default_asset=None, default_issuer=None, assets=None, destinations=None):
+    if assets is None:
+        assets = {}
+    if destinations is None:
+        destinations = {}
+    destination = (row.get("destination") or "").strip()
+    if len(destination) == 0:
+        raise ValueError("Missing destination address.")
+    amount = str(row.get("amount") or "").strip()
+    if not is_valid_amount(amount):
+        raise ValueError("Invalid amount {}.".format(amount))
+    asset_key = get_row_asset_key(row, default_asset=default_asset, default_issuer=default_issuer)
+    if asset_key not in assets:
+        try:
+            assets[asset_key] = resolve_asset(asset=asset_key[0], issuer=asset_key[1])
+        except ValueError as e:
+            assets[asset_key] = e
+    if isinstance(assets[asset_key], Exception):
+        raise assets[asset_key]
+    if destination not in destinations:
+        destinations[destination] = process_destination_address(address=destination)
+    if not is_valid_destination(destinations[destination]):
+        raise ValueError("Missing/invalid destination address {}.".format(destination))
+    return {
+        "destination": destinations[destination],
+        "amount": amount,
+        "asset": assets[asset_key]
+    }
+
+
+def append_payment_entry(tb, entry, source=None):
+    # path entries carry the quoted path and the slippage limit next to the resolved payment row
+    if entry.get("path_kind") == paths.STRICT_SEND:
+        tb.append_operation(PathPaymentStrictSend(destination=entry.get("destination"),
+                                                  send_asset=entry.get("send_asset"), send_amount=entry.get("amount"),
+                                                  dest_asset=entry.get("asset"), dest_min=entry.get("limit"),
+                                                  path=entry.get("path"), source=source))
+    elif entry.get("path_kind") == paths.STRICT_RECEIVE:
+        tb.append_operation(PathPaymentStrictReceive(destination=entry.get("destination"),
+                                                     send_asset=entry.get("send_asset"), send_max=entry.get("limit"),
+                                                     dest_asset=entry.get("asset"), dest_amount=entry.get("amount"),
+                                                     path=entry.get("path"), source=source))
+    else:
+        tb.append_payment_op(destination=entry.get("destination"), amount=entry.get("amount"),
+                             asset=entry.get("asset"), source=source)
+
+
+def preflight_entries(entries, network_settings, pending=None, check_limit=True,
+                      concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # returns the (entry, error) pairs that would fail with op_no_destination/op_no_trust/op_line_full;
+    # offline builds (--sequence-file) can't ask Horizon and skip the check
+    if _sequence_file is not None or len(entries) == 0:
+        return []
+    if pending is None:
+        pending = {}
+    with trace.span("preflight"):
+        errors = asyncops.run(preflight.check_entries, network_settings.get("horizon_url"), entries, pending,
+                              check_limit=check_limit, concurrency=concurrency)
+    return [(entry, error) for entry, error in zip(entries, errors) if error is not None]
+
+
+def quote_path_entries(entries, path_kind, send_asset, network_settings, slippage=paths.DEFAULT_SLIPPAGE,
+                       concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # adds path, limit and quoted amounts to every entry; returns the (entry, error) pairs that have no usable path
+    with trace.span("paths.quote"):
+        quotes = asyncops.run(paths.quote_entries, network_settings.get("horizon_url"), path_kind, send_asset,
+                              entries, slippage=slippage, concurrency=concurrency)
+    failed = []
+    for entry, quote in zip(entries, quotes):
+        if isinstance(quote, Exception):
+            failed.append((entry, quote))
+            continue
+        entry.update(quote)
+        entry["path_kind"] = path_kind
+        entry["send_asset"] = send_asset
+    return failed
+
+
+def submit_payment_batch(batch, keypair, server, sequence_manager, network_settings,
+                         memo_text=None, memo_id=None, memo_hash=None,
+                         trezor_mode=False, just_sign=False, v1_mode=True, timeout=3600, channel=None,
+                         max_fee=None, fee_percentile=None):
+    # with a channel the channel account is the transaction source and pays the fee,
+    # while the payment operations keep the wallet account as their source
+    source = keypair.public_key if channel is None else channel.public_key
+    operation_source = None if channel is None else keypair.public_key
+
+    chosen = {}
+
+    def build_transaction(account):
+        # the fee is chosen per envelope (fee_stats is cached for a few seconds), so long runs follow the network
+        chosen["base_fee"] = fees.choose_base_fee(server, percentile=fee_percentile, max_fee=max_fee)
+        tb = TransactionBuilder(
+            source_account=account,
+            network_passphrase=network_settings.get("network_passphrase"),
+            base_fee=chosen.get("base_fee"),
+            v1=v1_mode
+        ).set_timeout(timeout)
+        for entry in batch:
+            append_payment_entry(tb, entry, source=operation_source)
+        if memo_text is not None:
+            tb.add_text_memo(memo_text=memo_text)
+        elif memo_id is not None:
+            tb.add_id_memo(memo_id=memo_id)
+        elif memo_hash is not None:
+            tb.add_hash_memo(memo_hash=memo_hash)
+        transaction = tb.build()
+        if channel is not None:
+            transaction.sign(channel)
+        if not trezor_mode:
+            transaction.sign(keypair)
+        else:
+            transaction = sign_trezor_transaction(transaction, keypair,
+                                                  network_passphrase=network_settings.get("network_passphrase"))
+        return transaction
+
     if just_sign:
-        print("TX SIGNED DATA:\n{}".format(transaction.to_xdr()))
+        transaction = build_with_sequence(sequence_manager, source, build_transaction)
+        return {"status": "signed", "hash": transaction.hash_hex(), "base_fee": chosen.get("base_fee"),
+                "xdr": transaction.to_xdr()}
+    try:
+        transaction, transaction_resp = submit_with_sequence(server=server, sequence_manager=sequence_manager,
+                                                             account_id=source,
+                                                             build_transaction=build_transaction,
+                                                             network_passphrase=network_settings.get("network_passphrase"),
+                                                             max_fee=max_fee, fee_source=get_fee_source(keypair))
+        return {"status": "success", "hash": transaction_resp.get("hash"), "ledger": transaction_resp.get("ledger"),
+                "base_fee": chosen.get("base_fee"), "fee_charged": transaction_resp.get("fee_charged")}
+    except submit.SUBMIT_ERRORS as e:
+        return {"status": "failed", "base_fee": chosen.get("base_fee"), "error": str(e)}
+
+
+def print_summary(summary, report_file):
+    # with the NDJSON report on stdout the summary goes to stderr, so stdout stays one JSON object per line
+    print(json.dumps(summary, indent=4), file=sys.stderr if report_file is None else sys.stdout)
+
+
+def send_batch(wallet_file, payment_file, report_file=None, asset=None, issuer=None,
+               memo_text=None, memo_id=None, memo_hash=None,
+               test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600,
+               batch_size=MAX_OPS_PER_TX, use_channels=False, concurrency=asyncops.DEFAULT_CONCURRENCY,
+               max_fee=None, fee_percentile=None, path_kind=None, send_asset=None, slippage=paths.DEFAULT_SLIPPAGE,
+               reject_file=None, check_destinations=True):
+    network_settings = get_network_settings(test_mode=test_mode)
+    if timeout is None:
+        timeout = 3600
+    if path_kind is not None:
+        send_asset = resolve_asset(asset=send_asset)
+    if batch_size is None or batch_size < 1 or batch_size > MAX_OPS_PER_TX:
+        batch_size = MAX_OPS_PER_TX
+    v1_mode = not vzero and not trezor_mode
+    k = get_keypair(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
+    channel_pool = None
+    if use_channels:
+        channel_pool = load_channel_pool(channel_file=get_channel_file(wallet_file))
+    report = sys.stdout if report_file is None else open(report_file, "w")
+    reject = None if reject_file is None else open(reject_file, "w")
+    summary = {"rows": 0, "success": 0, "failed": 0, "rejected": 0, "transactions": 0}
+    assets = {}
+    destinations = {}
+    pending_amounts = {}
+    batch = []
+    pending = set()
+
+    def run_batch(entries):
+        # anything that goes wrong while building or signing fails this batch only, the run goes on
+        channel = None if channel_pool is None else channel_pool.acquire()
+        try:
+            result = submit_payment_batch(batch=entries, keypair=k, server=server,
+                                          sequence_manager=sequence_manager, network_settings=network_settings,
+                                          memo_text=memo_text, memo_id=memo_id, memo_hash=memo_hash,
+                                          trezor_mode=trezor_mode, just_sign=just_sign, v1_mode=v1_mode,
+                                          timeout=timeout, channel=channel, max_fee=max_fee,
+                                          fee_percentile=fee_percentile)
+            if channel is not None:
+                result["channel"] = channel.public_key
+            return entries, result
+        except Exception as e:
+            return entries, {"status": "failed", "error": str(e)}
+        finally:
+            if channel is not None:
+                channel_pool.release(channel)
+
+    def report_batch(entries, result):
+        summary["transactions"] += 1
+        if result.get("status") == "failed":
+            summary["failed"] += len(entries)
+        else:
+            summary["success"] += len(entries)
+        for entry in entries:
+            line = {
+                "row": entry.get("row"),
+                "destination": entry.get("destination"),
+                "amount": entry.get("amount"),
+                "asset": asset_to_string(entry.get("asset"))
+            }
+            if path_kind is not None:
+                line.update({"send_asset": asset_to_string(send_asset), "path_kind": path_kind,
+                             "source_amount": entry.get("source_amount"),
+                             "destination_amount": entry.get("destination_amount"), "limit": entry.get("limit")})
+            line.update(result)
+            write_report_line(report, line)
+
+    def collect(done):
+        for future in done:
+            pending.discard(future)
+            report_batch(*future.result())
+
+    def flush_batch():
+        entries = list(batch)
+        batch.clear()
+        if executor is None:
+            report_batch(*run_batch(entries))
+            return
+        # keep at most two batches per channel queued so large payout files stream with bounded memory
+        if len(pending) >= 2 * len(channel_pool):
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending.add(executor.submit(run_batch, entries))
+
+    def reject_row(row_number, row, error):
+        summary["failed"] += 1
+        summary["rejected"] += 1
+        write_report_line(report, {"row": row_number, "destination": row.get("destination"),
+                                   "amount": row.get("amount"), "status": "rejected", "error": str(error)})
+        if reject is not None:
+            # the original row plus the reason, so the file can be fixed and sent again with -f
+            line = dict(row)
+            line.update({"row": row_number, "error": str(error)})
+            write_report_line(reject, line)
+
+    def drop_failed(entries, failed, raw_rows):
+        for entry, error in failed:
+            reject_row(entry.get("row"), raw_rows.get(entry.get("row")), error)
+        failed_rows = set([entry.get("row") for entry, error in failed])
+        return [entry for entry in entries if entry.get("row") not in failed_rows]
+
+    def resolve_rows(rows):
+        prefetch_row_resolutions([row for (row_number, row) in rows], default_asset=asset, default_issuer=issuer,
+                                 assets=assets, destinations=destinations, concurrency=concurrency)
+        raw_rows = dict(rows)
+        entries = []
+        for row_number, row in rows:
+            try:
+                entry = resolve_payment_row(row, default_asset=asset, default_issuer=issuer,
+                                            assets=assets, destinations=destinations)
+            except Exception as e:
+                reject_row(row_number, row, e)
+                continue
+            entry["row"] = row_number
+            entries.append(entry)
+        if check_destinations:
+            # strict_send amounts are in the send asset, so the trustline limit can't be checked before quoting
+            failed = preflight_entries(entries, network_settings, pending=pending_amounts,
+                                       check_limit=path_kind != paths.STRICT_SEND, concurrency=concurrency)
+            entries = drop_failed(entries, failed, raw_rows)
+        if path_kind is not None:
+            failed = quote_path_entries(entries, path_kind, send_asset, network_settings, slippage=slippage,
+                                        concurrency=concurrency)
+            entries = drop_failed(entries, failed, raw_rows)
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                flush_batch()
+        rows.clear()
+
+    executor = None if channel_pool is None else ThreadPoolExecutor(max_workers=len(channel_pool))
+    rows = []
+    try:
+        for row_number, row in read_payment_file(payment_file):
+            summary["rows"] += 1
+            rows.append((row_number, row))
+            if len(rows) >= batch_size:
+                resolve_rows(rows)
+        resolve_rows(rows)
+        if len(batch) > 0:
+            flush_batch()
+        if len(pending) > 0:
+            collect(wait(pending).done)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if report_file is not None:
+            report.close()
+        if reject is not None:
+            reject.close()
+    print_summary(summary, report_file)
+
+
+def path_payment(wallet_file, path_kind, send_asset, asset, issuer, amount, destination,
+                 slippage=paths.DEFAULT_SLIPPAGE,
+                 memo_text=None, memo_id=None, memo_hash=None,
+                 test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600,
+                 use_channels=False, max_fee=None, fee_percentile=None, check_destination=True):
+    # strict_send spends exactly amount of send_asset, strict_receive delivers exactly amount of asset
+    network_settings = get_network_settings(test_mode=test_mode)
+    if timeout is None:
+        timeout = 3600
+    v1_mode = not vzero and not trezor_mode
+    entry = {"destination": destination, "amount": str(amount), "asset": resolve_asset(asset=asset, issuer=issuer)}
+    send_asset = resolve_asset(asset=send_asset)
+    failed = []
+    if check_destination:
+        failed = preflight_entries([entry], network_settings, check_limit=path_kind != paths.STRICT_SEND)
+    if len(failed) == 0:
+        failed = quote_path_entries([entry], path_kind, send_asset, network_settings, slippage=slippage)
+    if len(failed) > 0:
+        print("Error: {}".format(str(failed[0][1])))
+        return {"error": str(failed[0][1])}
+    print("Path quote: {} {} -> {} {} via {} hop(s), limit {}".format(
+        entry.get("source_amount"), asset_to_string(send_asset), entry.get("destination_amount"),
+        asset_to_string(entry.get("asset")), len(entry.get("path")), entry.get("limit")), file=sys.stderr)
+    k = get_keypair(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
+    channel_pool = None
+    channel = None
+    if use_channels:
+        channel_pool = load_channel_pool(channel_file=get_channel_file(wallet_file))
+        channel = channel_pool.acquire()
+    try:
+        result = submit_payment_batch(batch=[entry], keypair=k, server=server, sequence_manager=sequence_manager,
+                                      network_settings=network_settings,
+                                      memo_text=memo_text, memo_id=memo_id, memo_hash=memo_hash,
+                                      trezor_mode=trezor_mode, just_sign=just_sign, v1_mode=v1_mode,
+                                      timeout=timeout, channel=channel, max_fee=max_fee, fee_percentile=fee_percentile)
+    finally:
+        if channel is not None:
+            channel_pool.release(channel)
+    print(json.dumps(result, indent=4))
+    return result
+
+
+def show_order_book(selling, buying, test_mode=True, limit=20):
+    network_settings = get_network_settings(test_mode=test_mode)
+    selling = resolve_asset(asset=selling)
+    buying = resolve_asset(asset=buying)
+    order_book = asyncops.run(paths.load_order_book, network_settings.get("horizon_url"), selling, buying,
+                              limit=limit)
+    summary = {
+        "selling": asset_to_string(selling),
+        "buying": asset_to_string(buying),
+        "bids": [{"price": b.get("price"), "amount": b.get("amount")} for b in order_book.get("bids", [])],
+        "asks": [{"price": a.get("price"), "amount": a.get("amount")} for a in order_book.get("asks", [])]
+    }
+    print(json.dumps(summary, indent=4))
+    return summary
+
+
+def create_channels(wallet_file, count, starting_balance="5", test_mode=True, trezor_mode=False, vzero=False,
+                    timeout=3600, max_fee=None, fee_percentile=None):
+    channel_file = get_channel_file(wallet_file)
+    if os.path.exists(channel_file):
+        print("Error: Channel file {} already exists! Will not overwrite it for security reasons.".format(channel_file))
+        return
+    if count is None or count < 1 or count > MAX_OPS_PER_TX:
+        print("Error: Number of channels must be between 1 and {}.".format(MAX_OPS_PER_TX))
+        return
+    network_settings = get_network_settings(test_mode=test_mode)
+    if timeout is None:
+        timeout = 3600
+    v1_mode = not vzero and not trezor_mode
+    k = get_keypair(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
+    channels = [Keypair.random() for i in range(count)]
+    # keys are saved before funding so a submission timeout never loses funded channel secrets
+    write_channels(channel_file=channel_file, private_keys=[c.secret for c in channels],
+                   public_keys=[c.public_key for c in channels])
+
+    def build_transaction(account):
+        base_fee = fees.choose_base_fee(server, percentile=fee_percentile, max_fee=max_fee)
+        tb = TransactionBuilder(
+            source_account=account,
+            network_passphrase=network_settings.get("network_passphrase"),
+            base_fee=base_fee,
+            v1=v1_mode
+        ).set_timeout(timeout)
+        for c in channels:
+            tb.append_create_account_op(destination=c.public_key, starting_balance=str(starting_balance))
+        transaction = tb.build()
+        if not trezor_mode:
+            transaction.sign(k)
+        else:
+            transaction = sign_trezor_transaction(transaction, k,
+                                                  network_passphrase=network_settings.get("network_passphrase"))
+        return transaction
+
+    try:
+        transaction, transaction_resp = submit_with_sequence(server=server, sequence_manager=sequence_manager,
+                                                             account_id=k.public_key,
+                                                             build_transaction=build_transaction,
+                                                             network_passphrase=network_settings.get("network_passphrase"),
+                                                             max_fee=max_fee, fee_source=get_fee_source(k))
+        response = {
+            "channel_file": channel_file,
+            "channels": [c.public_key for c in channels],
+            "hash": transaction_resp.get("hash"),
+            "base_fee": submit.get_fee_per_operation(transaction)
+        }
+        print(json.dumps(response, indent=4))
+    except submit.SUBMIT_ERRORS as e:
+        print("Error: {}".format(str(e)))
+
+
+def load_account_signers(wallet_file, accounts, trezor_mode=False):
+    # account id -> (keypair, Trezor account index); entries are wallet files or public keys of accounts derived
+    # from the wallet (found in its SEP-0005 lookup table, so the seed is decrypted at most once)
+    signers = {}
+    connection = None
+    seed = None
+    root = None
+    try:
+        for entry in read_account_list(accounts):
+            if not StrKey.is_valid_ed25519_public_key(entry) or os.path.exists(entry):
+                keypair = Keypair.from_secret(secret=load_wallet(wallet_file=entry)[0])
+                signers[keypair.public_key] = (keypair, None)
+                continue
+            if connection is None:
+                index_file, connection = connect_account_table(wallet_file, trezor_mode=trezor_mode)
+            account_index = hdwallet.find_account_index(connection, entry)
+            if account_index is None:
+                raise ValueError("{} is neither a wallet file nor a derived account of {} (see derive).".format(
+                    entry, "the Trezor" if trezor_mode else wallet_file))
+            if trezor_mode:
+                signers[entry] = (Keypair.from_public_key(public_key=entry), account_index)
+                continue
+            if seed is None:
+                seed = load_wallet_seed(wallet_file=wallet_file)
+                root = hdwallet.get_account_root(seed)
+            signers[entry] = (hdwallet.derive_keypair(seed, account_index, root=root), None)
+    finally:
+        if connection is not None:
+            connection.close()
+    return signers
+
+
+def sign_with(transaction, keypair, network_passphrase, account_index=None):
+    # keypairs without a secret are Trezor accounts; account_index None is the --account-index one
+    if keypair.can_sign():
+        transaction.sign(keypair)
+        return transaction
+    from . import trezor
+    with trace.span("trezor.sign"):
+        return trezor.get_session().sign_transaction(transaction, keypair, network_passphrase=network_passphrase,
+                                                     account_index=account_index)
+
+
+def resolve_asset_list(entries, concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # returns (entry, Asset or exception) pairs; all ASSETCODE@domain entries are resolved concurrently
+    domain_entries = set([entry for entry in entries if '@' in entry and ':' not in entry])
+    resolved = {}
+    if len(domain_entries) > 0:
+        with trace.span("batch.resolve"):
+            resolved = asyncops.run(asyncops.resolve_assets, domain_entries, concurrency=concurrency)
+    results = []
+    for entry in entries:
+        result = resolved.get(entry)
+        if isinstance(result, Exception):
+            results.append((entry, result))
+        elif result is not None and result[0] is None:
+            results.append((entry, ValueError("Could not identify asset {}".format(entry))))
+        elif result is not None:
+            results.append((entry, Asset(result[0], result[1])))
+        else:
+            try:
+                results.append((entry, resolve_asset(asset=entry)))
+            except Exception as e:
+                results.append((entry, e))
+    return results
+
+
+def load_accounts(account_ids, network_settings, concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # account id -> account record, or the exception raised while loading it; all accounts are loaded concurrently
+    async def load_all(clients):
+        return await asyncops.gather_limited(
+            [asyncops.load_account_data(clients, network_settings.get("horizon_url"), account_id)
+             for account_id in account_ids],
+            concurrency=concurrency)
+    return dict(zip(account_ids, asyncops.run(load_all)))
+
+
+def check_trustline(account, account_id, asset, limit=None):
+    # returns ("skipped" or "rejected", reason) when no change_trust operation is needed or it would fail
+    if asset.is_native():
+        return "rejected", "op_malformed: XLM has no trustline"
+    if asset.issuer == account_id:
+        return "rejected", "op_malformed: {} is the issuer of {}".format(account_id, asset.code)
+    if account is None:
+        return None
+    trustline = preflight.find_trustline(account, asset)
+    if limit is not None and Decimal(limit) == 0:
+        if trustline is None:
+            return "skipped", "no trustline"
+        if Decimal(trustline.get("balance")) != 0:
+            return "rejected", "op_invalid_limit: balance {} must be 0 to remove the trustline".format(
+                trustline.get("balance"))
+        return None
+    if trustline is None:
+        return None
+    if limit is None or Decimal(limit) == Decimal(trustline.get("limit")):
+        return "skipped", "trustline exists"
+    if Decimal(limit) < Decimal(trustline.get("balance")):
+        return "rejected", "op_invalid_limit: limit {} is below the balance {}".format(limit, trustline.get("balance"))
+    return None
+
+
+def append_account_operation(tb, item, source=None):
+    if item.get("operation") == "change_trust":
+        tb.append_change_trust_op(asset=item.get("asset"), limit=item.get("limit"), source=source)
+    elif item.get("operation") == "account_merge":
+        tb.append_account_merge_op(destination=item.get("destination"), source=source)
     else:
-        broadcast_tx(transaction=transaction, test_mode=test_mode)
+        append_payment_entry(tb, item, source=source)
+
+
+def pack_account_batches(groups, fee_account_id, batch_size=MAX_OPS_PER_TX):
+    # groups are lists of operation items of one account that must share an envelope; every batch has at most
+    # batch_size operations and needs at most MAX_SIGNATURES signatures, the fee account's included
+    batch = []
+    batch_accounts = set([fee_account_id])
+    for group in groups:
+        account_id = group[0].get("account")
+        if len(batch) + len(group) > batch_size or (account_id not in batch_accounts and
+                                                    len(batch_accounts) >= MAX_SIGNATURES):
+            if len(batch) > 0:
+                yield batch
+            batch = []
+            batch_accounts = set([fee_account_id])
+        batch.extend(group)
+        batch_accounts.add(account_id)
+    if len(batch) > 0:
+        yield batch
+
+
+def submit_account_batch(batch, keypair, signers, server, sequence_manager, network_settings,
+                         just_sign=False, v1_mode=True, timeout=3600, max_fee=None, fee_percentile=None):
+    # the wallet account is the transaction source and pays the fee; every operation has its account as source,
+    # so the envelope is signed by each account of the batch
+    network_passphrase = network_settings.get("network_passphrase")
+    account_ids = [keypair.public_key]
+    for item in batch:
+        if item.get("account") not in account_ids:
+            account_ids.append(item.get("account"))
+
+    chosen = {}
+
+    def build_transaction(account):
+        chosen["base_fee"] = fees.choose_base_fee(server, percentile=fee_percentile, max_fee=max_fee)
+        tb = TransactionBuilder(
+            source_account=account,
+            network_passphrase=network_passphrase,
+            base_fee=chosen.get("base_fee"),
+            v1=v1_mode
+        ).set_timeout(timeout)
+        for item in batch:
+            source = None if item.get("account") == keypair.public_key else item.get("account")
+            append_account_operation(tb, item, source=source)
+        transaction = tb.build()
+        for account_id in account_ids:
+            signer, account_index = signers.get(account_id)
+            transaction = sign_with(transaction, signer, network_passphrase, account_index=account_index)
+        return transaction
+
+    if just_sign:
+        transaction = build_with_sequence(sequence_manager, keypair.public_key, build_transaction)
+        return {"status": "signed", "hash": transaction.hash_hex(), "base_fee": chosen.get("base_fee"),
+                "xdr": transaction.to_xdr()}
+    try:
+        transaction, transaction_resp = submit_with_sequence(server=server, sequence_manager=sequence_manager,
+                                                             account_id=keypair.public_key,
+                                                             build_transaction=build_transaction,
+                                                             network_passphrase=network_passphrase,
+                                                             max_fee=max_fee, fee_source=get_fee_source(keypair))
+        return {"status": "success", "hash": transaction_resp.get("hash"), "ledger": transaction_resp.get("ledger"),
+                "base_fee": chosen.get("base_fee"), "fee_charged": transaction_resp.get("fee_charged")}
+    except submit.SUBMIT_ERRORS as e:
+        return {"status": "failed", "base_fee": chosen.get("base_fee"), "error": str(e)}
+
+
+def trust_batch(wallet_file, assets, accounts=None, limit=None, remove=False, report_file=None,
+                test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600,
+                batch_size=MAX_OPS_PER_TX, concurrency=asyncops.DEFAULT_CONCURRENCY, max_fee=None,
+                fee_percentile=None):
+    # sets (or with remove, deletes) the trustline of every asset on every account; each account is loaded once
+    # and trustlines that are already as requested are skipped
+    network_settings = get_network_settings(test_mode=test_mode)
+    if timeout is None:
+        timeout = 3600
+    if batch_size is None or batch_size < 1 or batch_size > MAX_OPS_PER_TX:
+        batch_size = MAX_OPS_PER_TX
+    if remove:
+        limit = "0"
+    try:
+        if limit is not None and Decimal(limit) < 0:
+            raise InvalidOperation()
+    except InvalidOperation:
+        print("Error: Invalid trustline limit {}.".format(limit))
+        return
+    v1_mode = not vzero and not trezor_mode
+    k = get_keypair(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    signers = {k.public_key: (k, None)}
+    if accounts is not None:
+        try:
+            account_signers = load_account_signers(wallet_file=wallet_file, accounts=accounts, trezor_mode=trezor_mode)
+        except ValueError as e:
+            print("Error: {}".format(str(e)))
+            return
+        account_ids = list(account_signers.keys())
+        signers.update(account_signers)
+    else:
+        account_ids = [k.public_key]
+    resolved_assets = resolve_asset_list(read_account_list(assets), concurrency=concurrency)
+    report = sys.stdout if report_file is None else open(report_file, "w")
+    summary = {"accounts": len(account_ids), "assets": len(resolved_assets), "trustlines": 0, "skipped": 0,
+               "success": 0, "failed": 0, "rejected": 0, "transactions": 0}
+    # offline builds can't see existing trustlines, every change_trust operation is built
+    loaded_accounts = {} if _sequence_file is not None else load_accounts(account_ids, network_settings,
+                                                                          concurrency=concurrency)
+    server = get_server(network_settings)
+    sequence_manager = get_sequence_manager(network_settings)
+
+    def report_item(account_id, entry, asset, result):
+        line = {
+            "account": account_id,
+            "asset": entry if isinstance(asset, Exception) else asset_to_string(asset),
+            "limit": limit
+        }
+        line.update(result)
+        write_report_line(report, line)
+
+    try:
+        groups = []
+        for account_id in account_ids:
+            account = loaded_accounts.get(account_id)
+            for entry, asset in resolved_assets:
+                summary["trustlines"] += 1
+                if isinstance(account, Exception):
+                    check = ("rejected", "Could not load account {}: {}".format(account_id, str(account)))
+                elif isinstance(asset, Exception):
+                    check = ("rejected", str(asset))
+                else:
+                    check = check_trustline(account, account_id, asset, limit=limit)
+                if check is None:
+                    groups.append([{"account": account_id, "operation": "change_trust", "asset": asset,
+                                    "limit": limit}])
+                    continue
+                status, reason = check
+                summary[status] += 1
+                if status == "rejected":
+                    summary["failed"] += 1
+                    report_item(account_id, entry, asset, {"status": status, "error": reason})
+                else:
+                    report_item(account_id, entry, asset, {"status": status, "reason": reason})
+        for batch in pack_account_batches(groups, k.public_key, batch_size=batch_size):
+            result = submit_account_batch(batch=batch, keypair=k, signers=signers, server=server,
+                                          sequence_manager=sequence_manager, network_settings=network_settings,
+                                          just_sign=just_sign, v1_mode=v1_mode, timeout=timeout, max_fee=max_fee,
+                                          fee_percentile=fee_percentile)
+            summary["transactions"] += 1
+            summary["failed" if result.get("status") == "failed" else "success"] += len(batch)
+            for item in batch:
+                report_item(item.get("account"), None, item.get("asset"), result)
+    finally:
+        if report_file is not None:
+            report.close()
+    print_summary(summary, report_file)
+    return summary
+
+
+def get_balance_asset(balance):
+    if balance.get("asset_type") == "native":
+        return Asset.native()
+    return Asset(balance.get("asset_code"), balance.get("asset_issuer"))
+
+
+def get_base_reserve(server):
+    # XLM reserved per account entry, a network setting that is read from the latest ledger
+    with trace.span("horizon.ledgers"):
+        records = server.ledgers().order(desc=True).limit(1).call().get("_embedded", {}).get("records", [])
+    if len(records) == 0:
+        raise ValueError("Horizon returned no ledger")
+    return Decimal(records[0].get("base_reserve_in_stroops")) / 10 ** 7
+
+
+def get_minimum_balance(account, base_reserve):
+    entries = 2 + account.get("subentry_count", 0) + account.get("num_sponsoring", 0) - account.get("num_sponsored", 0)
+    return base_reserve * entries
+
+
+def get_sweep_items(account, account_id, destination, base_reserve, assets=None, merge=False):
+    # payments of everything above the reserve and selling liabilities; with merge the credit balances are paid
+    # in full, their trustlines removed and the account merged into destination, which moves the remaining XLM
+    balances = [b for b in account.get("balances", [])
+                if b.get("asset_type") in ("native", "credit_alphanum4", "credit_alphanum12")]
+    trustlines = [b for b in balances if b.get("asset_type") != "native"]
+    if merge and account.get("subentry_count", 0) > len(trustlines):
+        raise ValueError("op_has_sub_entries: {} has offers, data entries or signers".format(account_id))
+    if merge and account.get("num_sponsoring", 0) > 0:
+        raise ValueError("op_is_sponsor: {} sponsors other reserves".format(account_id))
+    items = []
+    native_balance = None
+    for b in balances:
+        asset = get_balance_asset(b)
+        if asset.is_native() and merge:
+            native_balance = b.get("balance")
+            continue
+        if not merge and assets is not None and asset_to_string(asset) not in assets:
+            continue
+        amount = Decimal(b.get("balance")) - Decimal(b.get("selling_liabilities") or "0")
+        if asset.is_native():
+            amount -= get_minimum_balance(account, base_reserve)
+        if amount > 0:
+            items.append({"account": account_id, "operation": "payment", "destination": destination,
+                          "asset": asset, "amount": "{:f}".format(amount)})
+        if merge:
+            items.append({"account": account_id, "operation": "change_trust", "asset": asset, "limit": "0"})
+    if merge:
+        items.append({"account": account_id, "operation": "account_merge", "destination": destination,
+                      "asset": Asset.native(), "amount": native_balance})
+    return items
+
+
+def sweep(wallet_file, accounts, destination=None, assets=None, merge=False, report_file=None,
+          test_mode=True, trezor_mode=False, just_sign=False, vzero=False, timeout=3600,
+          batch_size=MAX_OPS_PER_TX, concurrency=asyncops.DEFAULT_CONCURRENCY, max_fee=None, fee_percentile=None,
+          check_destination=True):
+    # moves the balances of every account to destination (the wallet account by default); the wallet pays the
+    # fees, so only reserves stay behind, and with merge the accounts are closed
+    if _sequence_file is not None:
+        print("Error: sweep needs the current balances, it can't build offline with --sequence-file.")
+        return
+    network_settings = get_network_settings(test_mode=test_mode)
+    if timeout is None:
+        timeout = 3600
+    if batch_size is None or batch_size < 1 or batch_size > MAX_OPS_PER_TX:
+        batch_size = MAX_OPS_PER_TX
+    v1_mode = not vzero and not trezor_mode
+    k = get_keypair(wallet_file=wallet_file, trezor_mode=trezor_mode)
+    if destination is None:
+        destination = k.public_key
+    asset_filter = None
+    if assets is not None:
+        asset_filter = set()
+        for entry, asset in resolve_asset_list(read_account_list(assets), concurrency=concurrency):
+            if isinstance(asset, Exception):
+                print("Error: {}".format(str(asset)))
+                return
+            asset_filter.add(asset_to_string(asset))
+    try:
+        account_signers = load_account_signers(wallet_file=wallet_file, accounts=accounts, trezor_mode=trezor_mode)
+    except ValueError as e:
+        print("Error: {}".format(str(e)))
+        return
+    account_ids = list(account_signers.keys())
+    signers = {k.public_key: (k, None)}
+    signers.update(account_signers)
+    if merge and check_destination:
+        # every merge of the run fails with op_no_destination if the destination doesn't exist
+        failed = preflight_entries([{"destination": destination, "asset": Asset.native(), "amount": "0"}],
+                                   network_settings)
+        if len(failed) > 0:
+            print("Error: {}".format(failed[0][1]))
+            return
+    server = get_server(network_settings)
+    try:
+        base_reserve = get_base_reserve(server)
+    except (submit.SUBMIT_ERRORS + (ValueError, TypeError, InvalidOperation)) as e:
+        print("Error: Could not load the base reserve from the latest ledger: {}".format(str(e)))
+        return
+    loaded_accounts = load_accounts(account_ids, network_settings, concurrency=concurrency)
+    sequence_manager = get_sequence_manager(network_settings)
+    report = sys.stdout if report_file is None else open(report_file, "w")
+    summary = {"accounts": len(account_ids), "skipped": 0, "rejected": 0, "operations": 0, "success": 0,
+               "failed": 0, "transactions": 0}
+    moved = {}
+
+    def report_item(item, result):
+        line = {
+            "account": item.get("account"),
+            "operation": item.get("operation"),
+            "asset": asset_to_string(item.get("asset")),
+            "amount": item.get("amount") if item.get("operation") != "change_trust" else None,
+            "destination": item.get("destination")
+        }
+        line.update(result)
+        write_report_line(report, line)
+
+    def skip_account(account_id, status, reason):
+        summary[status] += 1
+        if status == "rejected":
+            write_report_line(report, {"account": account_id, "status": status, "error": str(reason)})
+        else:
+            write_report_line(report, {"account": account_id, "status": status, "reason": reason})
+
+    try:
+        groups = []
+        for account_id in account_ids:
+            account = loaded_accounts.get(account_id)
+            if isinstance(account, Exception):
+                skip_account(account_id, "rejected", "Could not load account {}: {}".format(account_id, str(account)))
+                continue
+            if account_id == destination:
+                skip_account(account_id, "skipped", "account is the destination")
+                continue
+            if merge and account_id == k.public_key:
+                skip_account(account_id, "rejected", "the fee account can't be merged")
+                continue
+            try:
+                items = get_sweep_items(account, account_id, destination, base_reserve, assets=asset_filter,
+                                        merge=merge)
+            except ValueError as e:
+                skip_account(account_id, "rejected", e)
+                continue
+            if account_id == k.public_key:
+                # the fee account pays every envelope of the run, so its XLM stays behind
+                items = [item for item in items if not item.get("asset").is_native()]
+            if len(items) == 0:
+                skip_account(account_id, "skipped", "nothing to sweep")
+            elif len(items) > batch_size:
+                skip_account(account_id, "rejected", "needs {} operations, more than --batch-size".format(len(items)))
+            else:
+                groups.append(items)
+        if check_destination:
+            # a payment the destination can't receive fails its whole envelope; a merging account is only merged
+            # when all of its balances can be paid out
+            payments = [item for group in groups for item in group if item.get("operation") == "payment"]
+            failed = preflight_entries(payments, network_settings, concurrency=concurrency)
+            failed_keys = set()
+            for item, error in failed:
+                summary["rejected"] += 1
+                report_item(item, {"status": "rejected", "error": str(error)})
+                failed_keys.add((item.get("account"), asset_to_string(item.get("asset"))))
+            if merge:
+                failed_accounts = set([account_id for account_id, asset in failed_keys])
+                groups = [group for group in groups if group[0].get("account") not in failed_accounts]
+            else:
+                groups = [[item for item in group if (item.get("account"), asset_to_string(item.get("asset")))
+                           not in failed_keys] for group in groups]
+                groups = [group for group in groups if len(group) > 0]
+        for batch in pack_account_batches(groups, k.public_key, batch_size=batch_size):
+            result = submit_account_batch(batch=batch, keypair=k, signers=signers, server=server,
+                                          sequence_manager=sequence_manager, network_settings=network_settings,
+                                          just_sign=just_sign, v1_mode=v1_mode, timeout=timeout, max_fee=max_fee,
+                                          fee_percentile=fee_percentile)
+            summary["transactions"] += 1
+            summary["operations"] += len(batch)
+            summary["failed" if result.get("status") == "failed" else "success"] += len(batch)
+            for item in batch:
+                report_item(item, result)
+                if result.get("status") == "success" and item.get("operation") != "change_trust":
+                    asset = asset_to_string(item.get("asset"))
+                    moved[asset] = moved.get(asset, Decimal(0)) + Decimal(item.get("amount"))
+    finally:
+        if report_file is not None:
+            report.close()
+    summary["destination"] = destination
+    summary["base_reserve"] = "{:f}".format(base_reserve)
+    summary["moved"] = {asset: "{:f}".format(total) for asset, total in moved.items()}
+    print_summary(summary, report_file)
+    return summary
 
 
 def get_asset_data_from_domain(asset_code, asset_domain):
-    toml_file = "https://{}/.well-known/stellar.toml".format(asset_domain)
-    print("Loading TOML content from: {}\n".format(toml_file))
-    toml_string = requests.get(url=toml_file).text
-    toml_data = toml.loads(toml_string)
-    currencies = toml_data.get("CURRENCIES")
-    for c in currencies:
-        if c.get("code") == asset_code:
-            asset_issuer = c.get("issuer")
-            return asset_code, asset_issuer, asset_domain
-    return None, None, None
+    return asyncops.run(asyncops.get_asset_data_from_domain, asset_code, asset_domain)
 
 
 def get_trezor_public_key():
-    address = trezor_stellar.DEFAULT_BIP32_PATH
-    address_n = trezor_tools.parse_path(address)
-    m = messages.StellarGetAddress(address_n=address_n)
-    c = client.get_default_client()
-    r = c.call(m)
-    return r.address
+    # trezorlib is only imported when the Trezor is actually used
+    from . import trezor
+    with trace.span("trezor.get_public_key"):
+        return trezor.get_trezor_public_key()
 
 
-def generate_qr_code_url(public_key):
-    url = "https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={}".format(public_key)
-    return url
+def sign_trezor_transaction(transaction, public_key, network_passphrase):
+    from . import trezor
+    with trace.span("trezor.sign"):
+        return trezor.sign_trezor_transaction(transaction, public_key, network_passphrase=network_passphrase)
 
 
 def retrieve_trezor_public_key(generate_qr_code_link=False):
     public_key = get_trezor_public_key()
-    print(get_trezor_public_key())
+    print(public_key)
     if generate_qr_code_link:
         print(generate_qr_code_url(public_key))
 
 
-def sign_trezor_transaction(transaction, public_key, network_passphrase):
-    xdr_data = transaction.to_xdr()
-    address_n = trezor_tools.parse_path(trezor_stellar.DEFAULT_BIP32_PATH)
-    tx, operations = trezor_stellar.parse_transaction_bytes(base64.b64decode(xdr_data))
-    resp = trezor_stellar.sign_tx(client.get_default_client(), tx, operations, address_n, network_passphrase)
-    signature = resp.signature
-    s_element = DecoratedSignature(SignatureHint(public_key.signature_hint()), Signature(signature))
-    transaction.signatures.append(s_element)
-    return transaction
-
-
 def show_transaction_data(transaction):
     print("\nYou are about to sign a new transaction with the following details:\n\n{}\n".format(str(transaction.transaction)))
     print("The following operations are included in this transaction:\n")
-    for o in transaction.transaction.operations:
+    for o in submit.get_inner_envelope(transaction).transaction.operations:
         print("{}\n".format(str(o)))
     confirmation = input("Would you like to sign this? (Enter SIGN to sign or anything else to cancel):")
     if confirmation.strip() == "SIGN":
@@ -285,7 +1643,7 @@ def show_transaction_data(transaction):
 def show_transaction_data_before_submit(transaction):
     print("\nYou are about to submit a new transaction with the following details:\n\n{}\n".format(str(transaction.transaction)))
     print("The following operations are included in this transaction:\n")
-    for o in transaction.transaction.operations:
+    for o in submit.get_inner_envelope(transaction).transaction.operations:
         print("{}\n".format(str(o)))
     confirmation = input("Would you like to submit this? (Enter SUBMIT to submit or anything else to cancel):")
     if confirmation.strip() == "SUBMIT":
@@ -300,8 +1658,8 @@ def sign_transaction_from_xdr(wallet_file, transaction_xdr, test_mode=True, trez
                               vzero=False):
     network_settings = get_network_settings(test_mode=test_mode)
     if not trezor_mode:
-        transaction = TransactionEnvelope.from_xdr(transaction_xdr,
-                                                   network_passphrase=network_settings.get("network_passphrase"))
+        transaction = parse_transaction_envelope_from_xdr(transaction_xdr,
+                                                          network_settings.get("network_passphrase"))
         confirmation = show_transaction_data(transaction)
         if not confirmation:
             return
@@ -309,8 +1667,8 @@ def sign_transaction_from_xdr(wallet_file, transaction_xdr, test_mode=True, trez
         k = Keypair.from_secret(secret=private_key)
         transaction.sign(k)
     else:
-        transaction = TransactionEnvelope.from_xdr(transaction_xdr,
-                                                   network_passphrase=network_settings.get("network_passphrase"))
+        transaction = parse_transaction_envelope_from_xdr(transaction_xdr,
+                                                          network_settings.get("network_passphrase"))
         confirmation = show_transaction_data(transaction)
         if not confirmation:
             return
@@ -324,10 +1682,158 @@ def sign_transaction_from_xdr(wallet_file, transaction_xdr, test_mode=True, trez
         broadcast_tx(transaction=transaction, test_mode=test_mode)
 
 
+def get_account_id(account):
+    # transaction and operation sources are MuxedAccount objects (or None for operations)
+    if account is None:
+        return None
+    if isinstance(account, str):
+        return account
+    if hasattr(account, "account_id"):
+        return account.account_id
+    return account.public_key
+
+
+def check_signing_policy(transaction, keypair, max_fee=None):
+    # returns the reasons why this envelope must not be signed with keypair (empty list when it may be)
+    problems = []
+    tx = submit.get_inner_envelope(transaction).transaction
+    sources = set([get_account_id(tx.source)] + [get_account_id(o.source) for o in tx.operations if o.source])
+    fee_per_operation = None if len(tx.operations) == 0 else tx.fee / len(tx.operations)
+    if transaction is not submit.get_inner_envelope(transaction):
+        # the outer envelope of a fee bump is only signed by its fee source
+        sources = set([get_account_id(transaction.transaction.fee_source)])
+        fee_per_operation = transaction.transaction.base_fee
+    if keypair.public_key not in sources:
+        problems.append("{} is not the source of the transaction or of any operation".format(keypair.public_key))
+    if len(tx.operations) == 0:
+        problems.append("transaction has no operations")
+    elif max_fee is not None and fee_per_operation > max_fee:
+        problems.append("fee of {} stroops per operation is above {}".format(int(fee_per_operation), max_fee))
+    time_bounds = getattr(tx, "time_bounds", None)
+    if time_bounds is not None and time_bounds.max_time != 0 and time_bounds.max_time < time.time():
+        problems.append("transaction expired at {}".format(time_bounds.max_time))
+    if any(s.signature_hint == keypair.signature_hint() for s in transaction.signatures):
+        problems.append("already signed by {}".format(keypair.public_key))
+    return problems
+
+
+def show_batch_transaction_data(envelopes, from_terminal=False):
+    print("\nYou are about to sign {} transactions:\n".format(len(envelopes)), file=sys.stderr)
+    for i, transaction in enumerate(envelopes):
+        tx = submit.get_inner_envelope(transaction).transaction
+        print("#{} {} source {} seq {} fee {}".format(i + 1, transaction.hash_hex()[:16],
+                                                       get_account_id(tx.source), tx.sequence,
+                                                       transaction.transaction.fee),
+              file=sys.stderr)
+        for o in tx.operations:
+            print("    {}".format(str(o)), file=sys.stderr)
+    confirmation = read_confirmation("Would you like to sign all of them? (Enter SIGN to sign or anything else to cancel):",
+                                     from_terminal=from_terminal)
+    if confirmation.strip() == "SIGN":
+        print("Signing\n", file=sys.stderr)
+        return True
+    else:
+        print("Signing cancelled\n", file=sys.stderr)
+        return False
+
+
+def read_envelopes(xdr_file, network_passphrase, reject_line):
+    # plain and fee-bump envelopes; a line that doesn't parse is passed to reject_line and the rest is still read
+    envelopes = []
+    for line_number, transaction_xdr in read_xdr_file(xdr_file):
+        try:
+            envelopes.append((line_number, parse_transaction_envelope_from_xdr(transaction_xdr, network_passphrase)))
+        except Exception as e:
+            reject_line(line_number, "invalid transaction XDR: {}".format(str(e)))
+    return envelopes
+
+
+def sign_transactions_from_file(wallet_file, xdr_file, output_file=None, test_mode=True, trezor_mode=False,
+                                just_sign=False, max_fee=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    network_passphrase = network_settings.get("network_passphrase")
+
+    def reject_line(line_number, error):
+        # the output only carries signed XDR, so rejected lines are reported on stderr
+        write_report_line(sys.stderr, {"line": line_number, "status": "rejected", "error": error})
+
+    envelopes = read_envelopes(xdr_file, network_passphrase, reject_line)
+    if len(envelopes) == 0:
+        print("Missing TX XDR data.")
+        return
+    k = Keypair.from_public_key(public_key=get_public_key(wallet_file=wallet_file, trezor_mode=trezor_mode))
+    accepted = []
+    for line_number, transaction in envelopes:
+        problems = check_signing_policy(transaction, k, max_fee=max_fee)
+        if len(problems) > 0:
+            reject_line(line_number, "{}: {}".format(transaction.hash_hex(), "; ".join(problems)))
+        else:
+            accepted.append(transaction)
+    if len(accepted) == 0 or not show_batch_transaction_data(accepted, from_terminal=xdr_file == "-"):
+        return
+    # the key is decrypted once for the whole batch; the Trezor session is shared by the whole process anyway
+    if not trezor_mode:
+        k = get_keypair(wallet_file=wallet_file)
+    output = sys.stdout if output_file is None else open(output_file, "w")
+    try:
+        for transaction in accepted:
+            if not trezor_mode:
+                transaction.sign(k)
+            else:
+                transaction = sign_trezor_transaction(transaction, k, network_passphrase=network_passphrase)
+            if just_sign:
+                output.write("{}\n".format(transaction.to_xdr()))
+                output.flush()
+            else:
+                broadcast_tx(transaction=transaction, test_mode=test_mode)
+    finally:
+        if output_file is not None:
+            output.close()
+
+
+def submit_transactions_from_file(xdr_file, report_file=None, wallet_file=None, test_mode=True,
+                                  concurrency=asyncops.DEFAULT_CONCURRENCY, max_fee=None):
+    network_settings = get_network_settings(test_mode=test_mode)
+    network_passphrase = network_settings.get("network_passphrase")
+    rejected = []
+    envelopes = [transaction for line_number, transaction in
+                 read_envelopes(xdr_file, network_passphrase,
+                                lambda line_number, error: rejected.append({"line": line_number, "status": "rejected",
+                                                                            "error": error}))]
+    if len(envelopes) == 0:
+        print("Missing TX XDR data.")
+        for result in rejected:
+            write_report_line(sys.stderr, result)
+        return
+    sources = set(submit.get_source_account(t) for t in envelopes)
+    confirmation = read_confirmation("You are about to submit {} transactions from {} source accounts. "
+                                     "(Enter SUBMIT to submit or anything else to cancel):".format(len(envelopes),
+                                                                                                  len(sources)),
+                                     from_terminal=xdr_file == "-")
+    if confirmation.strip() != "SUBMIT":
+        print("Broadcasting cancelled\n")
+        return
+    # the wallet, when given, pays for fee-bump envelopes if the network asks for a higher fee
+    fee_source = None
+    if wallet_file is not None and max_fee is not None:
+        fee_source = get_keypair(wallet_file=wallet_file)
+    report = sys.stdout if report_file is None else open(report_file, "w")
+    try:
+        for result in rejected:
+            write_report_line(report, result)
+        summary = submit.submit_envelopes(get_server(network_settings), envelopes, network_passphrase,
+                                          write_result=lambda result: write_report_line(report, result),
+                                          concurrency=concurrency, max_fee=max_fee, fee_source=fee_source)
+    finally:
+        if report_file is not None:
+            report.close()
+    summary["rejected"] = len(rejected)
+    print_summary(summary, report_file)
+
+
 def submit_transaction(transaction_xdr, test_mode=True, vzero=False):
     network_settings = get_network_settings(test_mode=test_mode)
-    transaction = TransactionEnvelope.from_xdr(transaction_xdr,
-                                               network_passphrase=network_settings.get("network_passphrase"))
+    transaction = parse_transaction_envelope_from_xdr(transaction_xdr, network_settings.get("network_passphrase"))
     confirmation = show_transaction_data_before_submit(transaction)
     if not confirmation:
         return
@@ -337,12 +1843,14 @@ def submit_transaction(transaction_xdr, test_mode=True, vzero=False):
 
 def broadcast_tx(transaction, test_mode=True):
     network_settings = get_network_settings(test_mode=test_mode)
-    server = Server(network_settings.get("horizon_url"))
     try:
-        transaction_resp = server.submit_transaction(transaction)
+        transaction_resp = submit.submit_envelope(get_server(network_settings), transaction,
+                                                  network_settings.get("network_passphrase"))
         print("{}".format(json.dumps(transaction_resp, indent=4)))
-    except BaseHorizonError as e:
+        return transaction_resp
+    except submit.SUBMIT_ERRORS as e:
         print("Error: {}".format(str(e)))
+        return {"error": str(e)}
 
 
 def get_asset_from_domain(asset_with_domain):
@@ -351,45 +1859,38 @@ def get_asset_from_domain(asset_with_domain):
         asset_code, asset_issuer, asset_domain = get_asset_data_from_domain(asset_code=asset_code,
                                                                             asset_domain=asset_domain)
         if asset_code is None:
-            print("Could not identify token on this domain.")
+            print("Could not identify token on this domain.", file=sys.stderr)
             return None, None, None
         else:
-            print("We discovered the following token: {} @ {} issued by {}".format(asset_code,
-                                                                                   asset_domain,
-                                                                                   asset_issuer))
+            print("We discovered the following token: {} @ {} issued by {}".format(asset_code, asset_domain,
+                                                                                   asset_issuer), file=sys.stderr)
             asset = asset_code
             issuer = asset_issuer
             return asset, issuer, asset_domain
 
 
 def translate_address(account_name, account_domain):
-    toml_file = "https://{}/.well-known/stellar.toml".format(account_domain)
-    print("Loading TOML content from: {}\n".format(toml_file))
-    toml_string = requests.get(url=toml_file).text
-    toml_data = toml.loads(toml_string)
-    federation_server_url = toml_data.get("FEDERATION_SERVER")
-    print("Using FEDERATION Server: {}\n".format(federation_server_url))
-    query_url = "{}?q={}*{}&type=name".format(federation_server_url, account_name, account_domain)
-    r = requests.get(url=query_url)
-    r.raise_for_status()
-    response_json = json.loads(r.text)
-    address = response_json.get("account_id")
-    return address
+    return asyncops.run(asyncops.translate_address, account_name, account_domain)
+
+
+def purge_cache():
+    cache_file = cache.purge()
+    print("Removed cache file {}".format(cache_file))
 
 
 def process_destination_address(address):
     if address is None:
-        print("Missing address.\n")
+        print("Missing address.\n", file=sys.stderr)
         return None
     full_address = address.strip()
     if '*' in address:
         account_name, account_domain = full_address.split('*', 1)
         try:
             translated_address = translate_address(account_name=account_name, account_domain=account_domain)
-            print("{} --- translated to ---> {}\n".format(full_address, translated_address))
+            print("{} --- translated to ---> {}\n".format(full_address, translated_address), file=sys.stderr)
             return translated_address
         except Exception as e:
-            print("Could not identify address using Federation server. Error: {}\n".format(str(e)))
+            print("Could not identify address using Federation server. Error: {}\n".format(str(e)), file=sys.stderr)
             return None
     else:
         return full_address
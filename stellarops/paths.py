@@ -0,0 +1,101 @@
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+from stellar_sdk import Asset, ServerAsync
+from . import asyncops
+
+
+STRICT_SEND = "strict_send"
+STRICT_RECEIVE = "strict_receive"
+PATHS_TTL = 10
+ORDER_BOOK_TTL = 5
+DEFAULT_SLIPPAGE = 1.0
+STROOP = Decimal("0.0000001")
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def get_snapshot(key, ttl):
+    with _lock:
+        cached = _snapshots.get(key)
+        if cached is not None and time.time() - cached[0] < ttl:
+            return cached[1]
+    return None
+
+
+def put_snapshot(key, value):
+    with _lock:
+        _snapshots[key] = (time.time(), value)
+
+
+def asset_key(asset):
+    return "native" if asset.is_native() else "{}:{}".format(asset.code, asset.issuer)
+
+
+def record_to_asset(record, prefix=""):
+    if record.get(prefix + "asset_type") == "native":
+        return Asset.native()
+    return Asset(record.get(prefix + "asset_code"), record.get(prefix + "asset_issuer"))
+
+
+def apply_slippage(kind, record, slippage):
+    # strict send: the least the destination may receive; strict receive: the most the sender may spend
+    factor = Decimal(str(slippage)) / Decimal(100)
+    if kind == STRICT_SEND:
+        return str((Decimal(record.get("destination_amount")) * (1 - factor)).quantize(STROOP, rounding=ROUND_DOWN))
+    return str((Decimal(record.get("source_amount")) * (1 + factor)).quantize(STROOP, rounding=ROUND_UP))
+
+
+async def find_paths(clients, horizon_url, kind, send_asset, dest_asset, amount):
+    # path records for one asset pair and amount, shared for PATHS_TTL seconds by every payment that needs them
+    key = (horizon_url, kind, asset_key(send_asset), asset_key(dest_asset), str(amount))
+    records = get_snapshot(key, PATHS_TTL)
+    if records is not None:
+        return records
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    if kind == STRICT_SEND:
+        builder = server.strict_send_paths(source_asset=send_asset, source_amount=amount, destination=[dest_asset])
+    else:
+        builder = server.strict_receive_paths(source=[send_asset], destination_asset=dest_asset,
+                                              destination_amount=amount)
+    response = await builder.call()
+    records = response.get("_embedded", {}).get("records", [])
+    put_snapshot(key, records)
+    return records
+
+
+async def quote(clients, horizon_url, kind, send_asset, dest_asset, amount, slippage=DEFAULT_SLIPPAGE):
+    records = await find_paths(clients, horizon_url, kind, send_asset, dest_asset, amount)
+    if len(records) == 0:
+        raise ValueError("No path from {} to {} for amount {}".format(asset_key(send_asset), asset_key(dest_asset),
+                                                                     amount))
+    if kind == STRICT_SEND:
+        best = max(records, key=lambda r: Decimal(r.get("destination_amount")))
+    else:
+        best = min(records, key=lambda r: Decimal(r.get("source_amount")))
+    return {
+        "source_amount": best.get("source_amount"),
+        "destination_amount": best.get("destination_amount"),
+        "limit": apply_slippage(kind, best, slippage),
+        "path": [record_to_asset(p) for p in best.get("path", [])]
+    }
+
+
+async def quote_entries(clients, horizon_url, kind, send_asset, entries, slippage=DEFAULT_SLIPPAGE,
+                        concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # one quote (or the exception raised while finding it) per entry, in entry order
+    return await asyncops.gather_limited(
+        [quote(clients, horizon_url, kind, send_asset, entry.get("asset"), entry.get("amount"), slippage=slippage)
+         for entry in entries], concurrency=concurrency)
+
+
+async def load_order_book(clients, horizon_url, selling, buying, limit=20):
+    key = (horizon_url, "order_book", asset_key(selling), asset_key(buying), limit)
+    order_book = get_snapshot(key, ORDER_BOOK_TTL)
+    if order_book is not None:
+        return order_book
+    server = ServerAsync(horizon_url=horizon_url, client=clients.horizon)
+    order_book = await server.orderbook(selling=selling, buying=buying).limit(limit).call()
+    put_snapshot(key, order_book)
+    return order_book
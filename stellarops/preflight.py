@@ -0,0 +1,83 @@
+import threading
+import time
+from decimal import Decimal
+from stellar_sdk.exceptions import NotFoundError
+from . import asyncops
+from . import trace
+
+
+ACCOUNT_TTL = 30
+
+_accounts = {}
+_lock = threading.Lock()
+
+
+async def load_destination(clients, horizon_url, account_id):
+    # account records (None for accounts that don't exist) are shared for ACCOUNT_TTL seconds, so a destination
+    # that appears in many rows or batches is loaded once
+    key = (horizon_url, account_id)
+    with _lock:
+        cached = _accounts.get(key)
+        if cached is not None and time.time() - cached[0] < ACCOUNT_TTL:
+            trace.count("cache.lookups", kind="destination", result="hit")
+            return cached[1]
+    trace.count("cache.lookups", kind="destination", result="miss")
+    try:
+        account = await asyncops.load_account_data(clients, horizon_url, account_id)
+    except NotFoundError:
+        account = None
+    with _lock:
+        _accounts[key] = (time.time(), account)
+    return account
+
+
+def find_trustline(account, asset):
+    for balance in account.get("balances", []):
+        if balance.get("asset_code") == asset.code and balance.get("asset_issuer") == asset.issuer:
+            return balance
+    return None
+
+
+def check_entry(account, entry, pending, check_limit=True):
+    # returns the error the payment would fail with, or None; pending holds, per (destination, asset), the room
+    # left on the trustline when it was first checked and the amounts accepted since, so several rows to one
+    # trustline are checked against its limit together; a record reloaded later in the run (after ACCOUNT_TTL)
+    # may already include those payments, so the first snapshot is kept
+    destination = entry.get("destination")
+    asset = entry.get("asset")
+    if account is None:
+        return "op_no_destination: account {} does not exist".format(destination)
+    if asset.is_native() or asset.issuer == destination:
+        return None
+    trustline = find_trustline(account, asset)
+    if trustline is None:
+        return "op_no_trust: {} has no trustline for {}:{}".format(destination, asset.code, asset.issuer)
+    if trustline.get("is_authorized") is False:
+        return "op_not_authorized: {} is not authorized to hold {}:{}".format(destination, asset.code, asset.issuer)
+    if not check_limit:
+        return None
+    key = (destination, asset.code, asset.issuer)
+    available, accepted = pending.get(key, (Decimal(trustline.get("limit")) - Decimal(trustline.get("balance")),
+                                            Decimal(0)))
+    amount = accepted + Decimal(entry.get("amount"))
+    if amount > available:
+        return "op_line_full: {} can receive at most {} {} more".format(destination, available, asset.code)
+    pending[key] = (available, amount)
+    return None
+
+
+async def check_entries(clients, horizon_url, entries, pending, check_limit=True,
+                        concurrency=asyncops.DEFAULT_CONCURRENCY):
+    # one error (or None) per entry, in entry order; every destination is loaded concurrently, once
+    account_ids = list(set([entry.get("destination") for entry in entries]))
+    accounts = await asyncops.gather_limited([load_destination(clients, horizon_url, account_id)
+                                              for account_id in account_ids], concurrency=concurrency)
+    accounts = dict(zip(account_ids, accounts))
+    errors = []
+    for entry in entries:
+        account = accounts.get(entry.get("destination"))
+        if isinstance(account, Exception):
+            errors.append("Could not load destination {}: {}".format(entry.get("destination"), str(account)))
+        else:
+            errors.append(check_entry(account, entry, pending, check_limit=check_limit))
+    return errors
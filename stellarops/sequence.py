@@ -0,0 +1,78 @@
+import threading
+from stellar_sdk import Account
+from .fileops import read_sequence_file, write_sequence_file
+from . import trace
+
+
+class SequenceManager:
+    # hands out sequence numbers locally after loading each account once; resync() reloads after tx_bad_seq
+
+    def __init__(self, server):
+        self.server = server
+        self.sequences = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, account_id):
+        with self.lock:
+            if account_id not in self.sequences:
+                with trace.span("horizon.load_account"):
+                    self.sequences[account_id] = self.server.load_account(account_id=account_id).sequence
+            sequence = self.sequences[account_id]
+            self.sequences[account_id] = sequence + 1
+        # TransactionBuilder uses sequence + 1 for the transaction it builds from this account
+        return Account(account=account_id, sequence=sequence)
+
+    def resync(self, account_id):
+        trace.count("sequence.resyncs")
+        with trace.span("horizon.load_account"):
+            account = self.server.load_account(account_id=account_id)
+        with self.lock:
+            self.sequences[account_id] = account.sequence
+        return account.sequence
+
+    def release(self, account_id, sequence):
+        # hands back a number whose envelope was never built, unless a later one was reserved in the meantime
+        with self.lock:
+            if self.sequences.get(account_id) == sequence + 1:
+                self.sequences[account_id] = sequence
+
+    def save(self):
+        pass
+
+    def forget(self, account_id):
+        with self.lock:
+            self.sequences.pop(account_id, None)
+
+
+class OfflineSequenceManager(SequenceManager):
+    # offline builds: sequence numbers come from a file, which is saved after every successfully built envelope
+    # so a number is never handed out twice, even across runs
+
+    def __init__(self, sequence_file):
+        super().__init__(server=None)
+        self.sequence_file = sequence_file
+        self.sequences = read_sequence_file(sequence_file)
+
+    def reserve(self, account_id):
+        with self.lock:
+            if account_id not in self.sequences:
+                raise ValueError("No sequence number for {} in {}".format(account_id, self.sequence_file))
+            sequence = self.sequences[account_id]
+            self.sequences[account_id] = sequence + 1
+        return Account(account=account_id, sequence=sequence)
+
+    def save(self):
+        with self.lock:
+            write_sequence_file(self.sequence_file, self.sequences)
+
+    def resync(self, account_id):
+        raise ValueError("Cannot reload the sequence number of {} in offline mode".format(account_id))
+
+
+def get_result_codes(error):
+    extras = getattr(error, "extras", None) or {}
+    return extras.get("result_codes") or {}
+
+
+def is_bad_sequence_error(error):
+    return get_result_codes(error).get("transaction") == "tx_bad_seq"
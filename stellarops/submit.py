@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from stellar_sdk import FeeBumpTransactionEnvelope, TransactionBuilder
+from stellar_sdk.exceptions import BaseHorizonError, ConnectionError, NotFoundError
+from .sequence import get_result_codes, is_bad_sequence_error
+from . import trace
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+# what a submission can fail with; callers report these as failed submissions
+SUBMIT_ERRORS = (BaseHorizonError, ConnectionError)
+
+
+def is_retryable_error(error):
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error, BaseHorizonError) and error.status in RETRY_STATUSES
+
+
+def is_insufficient_fee_error(error):
+    return isinstance(error, BaseHorizonError) and get_result_codes(error).get("transaction") == "tx_insufficient_fee"
+
+
+def find_transaction(server, transaction_hash):
+    # None while the hash is unknown, also when Horizon can't be asked right now (the caller retries)
+    try:
+        with trace.span("horizon.find_transaction"):
+            return server.transactions().transaction(transaction_hash=transaction_hash).call()
+    except NotFoundError:
+        return None
+    except SUBMIT_ERRORS as e:
+        if is_retryable_error(e):
+            return None
+        raise
+
+
+def find_submitted_transaction(server, attempts):
+    # looks up every envelope submitted so far, the original and its fee bumps
+    for transaction_hash in attempts.get("hashes", []):
+        transaction_resp = find_transaction(server, transaction_hash)
+        if transaction_resp is not None:
+            return transaction_resp
+    return None
+
+
+def get_inner_envelope(transaction):
+    if isinstance(transaction, FeeBumpTransactionEnvelope):
+        return transaction.transaction.inner_transaction_envelope
+    return transaction
+
+
+def get_fee_per_operation(transaction):
+    inner = get_inner_envelope(transaction)
+    if isinstance(transaction, FeeBumpTransactionEnvelope):
+        # a fee bump pays for the inner operations plus itself
+        return transaction.transaction.base_fee
+    return inner.transaction.fee // max(1, len(inner.transaction.operations))
+
+
+def bump_fee(transaction, fee_source, network_passphrase, max_fee):
+    # returns a fee-bump envelope paying twice the current fee per operation (at most max_fee), or None
+    current_fee = get_fee_per_operation(transaction)
+    if max_fee is None or fee_source is None or current_fee >= max_fee:
+        return None
+    fee_bump = TransactionBuilder.build_fee_bump_transaction(
+        fee_source=fee_source.public_key,
+        base_fee=min(max_fee, current_fee * 2),
+        inner_transaction_envelope=get_inner_envelope(transaction),
+        network_passphrase=network_passphrase
+    )
+    fee_bump.sign(fee_source)
+    return fee_bump
+
+
+def submit_envelope(server, transaction, network_passphrase, max_fee=None, fee_source=None,
+                    retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, attempts=None):
+    # resubmitting the same envelope is idempotent: before every retry the submitted hashes are looked up on
+    # Horizon, so a submission that timed out but made it into a ledger is reported as a success. tx_bad_seq
+    # after a retry usually means an earlier attempt was applied, it is only raised when none of them is found
+    if attempts is None:
+        attempts = {}
+    attempt = 0
+    while True:
+        attempt += 1
+        attempts["count"] = attempt
+        attempts["hash"] = transaction.hash_hex()
+        if attempts["hash"] not in attempts.setdefault("hashes", []):
+            attempts["hashes"].append(attempts["hash"])
+        try:
+            with trace.span("horizon.submit"):
+                return server.submit_transaction(transaction)
+        except SUBMIT_ERRORS as e:
+            if is_bad_sequence_error(e) and attempt > 1:
+                for i in range(max(1, retries)):
+                    transaction_resp = find_submitted_transaction(server, attempts)
+                    if transaction_resp is not None:
+                        return transaction_resp
+                    time.sleep(backoff)
+                raise
+            if is_insufficient_fee_error(e):
+                fee_bump = bump_fee(transaction, fee_source, network_passphrase, max_fee)
+                if fee_bump is None or attempt > retries:
+                    raise
+                transaction = fee_bump
+                attempts["fee_bump"] = True
+                trace.count("submit.fee_bumps")
+                continue
+            if not is_retryable_error(e) or attempt > retries:
+                raise
+            trace.count("submit.retries")
+        time.sleep(backoff * 2 ** (attempt - 1))
+        transaction_resp = find_submitted_transaction(server, attempts)
+        if transaction_resp is not None:
+            return transaction_resp
+
+
+def get_source_account(transaction):
+    source = get_inner_envelope(transaction).transaction.source
+    return source.account_id if hasattr(source, "account_id") else str(source)
+
+
+def submit_envelopes(server, envelopes, network_passphrase, write_result, concurrency=10, max_fee=None,
+                     fee_source=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    # envelopes of one source account are submitted in sequence order, different sources run concurrently
+    by_source = {}
+    for transaction in envelopes:
+        by_source.setdefault(get_source_account(transaction), []).append(transaction)
+    write_lock = threading.Lock()
+    summary = {"success": 0, "failed": 0}
+
+    def submit_source(source, transactions):
+        transactions.sort(key=lambda t: get_inner_envelope(t).transaction.sequence)
+        for transaction in transactions:
+            attempts = {}
+            result = {"source": source, "sequence": get_inner_envelope(transaction).transaction.sequence}
+            try:
+                transaction_resp = submit_envelope(server, transaction, network_passphrase, max_fee=max_fee,
+                                                   fee_source=fee_source, retries=retries, backoff=backoff,
+                                                   attempts=attempts)
+                status = "success" if transaction_resp.get("successful", True) else "failed"
+                result.update({"status": status, "hash": transaction_resp.get("hash"),
+                               "ledger": transaction_resp.get("ledger"),
+                               "fee_charged": transaction_resp.get("fee_charged")})
+            except SUBMIT_ERRORS as e:
+                result.update({"status": "failed", "hash": attempts.get("hash"), "error": str(e),
+                               "result_codes": get_result_codes(e)})
+            result["attempts"] = attempts.get("count")
+            result["fee_bump"] = attempts.get("fee_bump", False)
+            with write_lock:
+                summary[result.get("status")] += 1
+                write_result(result)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for future in [executor.submit(submit_source, source, transactions)
+                       for source, transactions in by_source.items()]:
+            future.result()
+    return summary
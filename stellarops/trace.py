@@ -0,0 +1,154 @@
+import atexit
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Timed spans and counters for every phase of a command. Nothing is recorded until enable() is called, so the
+# instrumentation costs one flag check per span when --trace/--metrics are not used.
+
+METRIC_PREFIX = "stellar_cli"
+
+_enabled = False
+_trace_output = None
+_spans = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def write_event(event):
+    if _trace_output is None:
+        return
+    line = json.dumps(event)
+    with _lock:
+        _trace_output.write(line + "\n")
+        _trace_output.flush()
+
+
+def record_span(name, seconds, labels=None, error=None):
+    labels = labels or {}
+    key = (name, get_labels_key(labels))
+    with _lock:
+        count, total, slowest = _spans.get(key, (0, 0.0, 0.0))
+        _spans[key] = (count + 1, total + seconds, max(slowest, seconds))
+    event = {"ts": round(time.time(), 6), "span": name, "ms": round(seconds * 1000, 3)}
+    event.update({k: v for k, v in labels.items() if v is not None})
+    if error is not None:
+        event["error"] = error
+    write_event(event)
+
+
+@contextmanager
+def span(name, **labels):
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record_span(name, time.perf_counter() - start, labels, error=type(e).__name__)
+        raise
+    record_span(name, time.perf_counter() - start, labels)
+
+
+def count(name, value=1, **labels):
+    if not _enabled:
+        return
+    key = (name, get_labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def escape_label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, escape_label_value(v)) for k, v in labels) + "}"
+
+
+def get_metric_name(name):
+    return "{}_{}".format(METRIC_PREFIX, name.replace(".", "_").replace("-", "_"))
+
+
+def format_prometheus():
+    with _lock:
+        counters = dict(_counters)
+        spans = dict(_spans)
+    # every family gets a TYPE line and its samples stay together, as the text format requires
+    lines = []
+    previous = None
+    for (name, labels), value in sorted(counters.items()):
+        metric_name = "{}_total".format(get_metric_name(name))
+        if metric_name != previous:
+            lines.append("# TYPE {} counter".format(metric_name))
+            previous = metric_name
+        lines.append("{}{} {}".format(metric_name, format_labels(labels), value))
+    span_labels = [(format_labels((("span", name),) + labels), value)
+                   for (name, labels), value in sorted(spans.items())]
+    if len(span_labels) > 0:
+        lines.append("# TYPE {}_span_seconds summary".format(METRIC_PREFIX))
+        for labels, (span_count, total, slowest) in span_labels:
+            lines.append("{}_span_seconds_count{} {}".format(METRIC_PREFIX, labels, span_count))
+            lines.append("{}_span_seconds_sum{} {:.6f}".format(METRIC_PREFIX, labels, total))
+        lines.append("# TYPE {}_span_seconds_max gauge".format(METRIC_PREFIX))
+        for labels, (span_count, total, slowest) in span_labels:
+            lines.append("{}_span_seconds_max{} {:.6f}".format(METRIC_PREFIX, labels, slowest))
+    return "\n".join(lines) + "\n"
+
+
+def format_statsd():
+    # StatsD has no labels, they become part of the metric name: stellar_cli.http.requests.method_get:3|c
+    # spans are sent as counters (calls and total ms) plus the slowest call as a gauge, so servers can sum them
+    with _lock:
+        counters = dict(_counters)
+        spans = dict(_spans)
+
+    def metric(name, labels):
+        return ".".join([METRIC_PREFIX, name] + ["{}_{}".format(k, v.replace(".", "_")) for k, v in labels])
+    lines = ["{}:{}|c".format(metric(name, labels), value) for (name, labels), value in sorted(counters.items())]
+    for (name, labels), (span_count, total, slowest) in sorted(spans.items()):
+        lines.append("{}.count:{}|c".format(metric(name, labels), span_count))
+        lines.append("{}.sum_ms:{:.3f}|c".format(metric(name, labels), total * 1000))
+        lines.append("{}.max_ms:{:.3f}|g".format(metric(name, labels), slowest * 1000))
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(metrics_file, metrics_format="prometheus"):
+    content = format_statsd() if metrics_format == "statsd" else format_prometheus()
+    if metrics_file == "-":
+        sys.stderr.write(content)
+        return
+    with open(metrics_file, "w") as f:
+        f.write(content)
+
+
+def enable(trace_file=None, metrics_file=None, metrics_format="prometheus", command=None):
+    # trace_file "-" writes the JSON span lines to stderr; the whole command is recorded as one "command" span
+    global _enabled, _trace_output
+    _enabled = True
+    if trace_file == "-":
+        _trace_output = sys.stderr
+    elif trace_file is not None:
+        _trace_output = open(trace_file, "a")
+    start = time.perf_counter()
+
+    def finish():
+        record_span("command", time.perf_counter() - start, {"command": command})
+        if metrics_file is not None:
+            write_metrics(metrics_file, metrics_format=metrics_format)
+        if _trace_output is not None and _trace_output is not sys.stderr:
+            _trace_output.close()
+    atexit.register(finish)
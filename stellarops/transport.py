@@ -0,0 +1,285 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import requests
+from stellar_sdk.client.aiohttp_client import AiohttpClient
+from stellar_sdk.client.base_async_client import BaseAsyncClient
+from stellar_sdk.client.base_sync_client import BaseSyncClient
+from stellar_sdk.client.requests_client import RequestsClient
+from stellar_sdk.exceptions import ConnectionError as HorizonConnectionError
+from . import trace
+
+
+PUBLIC_HORIZON_URLS = ["https://horizon.stellar.org"]
+TESTNET_HORIZON_URLS = ["https://horizon-testnet.stellar.org"]
+HORIZON_URLS_ENV = "STELLAR_CLI_HORIZON_URLS"
+TOML_URL_ENV = "STELLAR_CLI_TOML_URL"
+TOML_URL = "https://{}/.well-known/stellar.toml"
+POOL_SIZE = 20
+REQUEST_TIMEOUT = 20
+POST_TIMEOUT = 60
+CONNECT_TIMEOUT = 5
+HEALTH_CHECK_TIMEOUT = 3
+HEALTH_CHECK_INTERVAL = 60
+FAILURE_COOLDOWN = 30
+MAX_LEDGER_LAG = 10
+FAILOVER_STATUSES = (429, 500, 502, 503, 504)
+
+_horizon_urls = None
+_request_timeout = REQUEST_TIMEOUT
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def set_horizon_urls(urls):
+    # --horizon on the command line overrides STELLAR_CLI_HORIZON_URLS and the built-in endpoints
+    global _horizon_urls
+    _horizon_urls = [url.rstrip("/") for url in urls] if urls else None
+
+
+def set_request_timeout(timeout):
+    global _request_timeout
+    if timeout is not None:
+        _request_timeout = timeout
+
+
+def get_horizon_urls(test_mode):
+    if _horizon_urls:
+        return list(_horizon_urls)
+    urls = os.environ.get(HORIZON_URLS_ENV)
+    if urls:
+        return [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+    return list(TESTNET_HORIZON_URLS if test_mode else PUBLIC_HORIZON_URLS)
+
+
+def get_toml_url(domain):
+    # STELLAR_CLI_TOML_URL (e.g. "http://{}/.well-known/stellar.toml") lets benchmarks point at a local server
+    return os.environ.get(TOML_URL_ENV, TOML_URL).format(domain)
+
+
+class HorizonPool:
+    # endpoints are ordered by health and measured latency; a failed endpoint is skipped for FAILURE_COOLDOWN seconds.
+    # With a network_passphrase every endpoint is first checked to serve that network, others are dropped
+
+    def __init__(self, urls, network_passphrase=None):
+        self.urls = list(urls)
+        self.network_passphrase = network_passphrase
+        self.latency = {}
+        self.failed_until = {}
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def get_network_passphrase(self, url):
+        try:
+            response = requests.get(url, timeout=HEALTH_CHECK_TIMEOUT)
+            return response.json().get("network_passphrase")
+        except (requests.RequestException, ValueError, AttributeError):
+            return None
+
+    def verify(self):
+        # one root request per endpoint, so envelopes signed for one network never reach the other one's Horizon
+        with self.lock:
+            if self.network_passphrase is None:
+                return
+            with ThreadPoolExecutor(max_workers=len(self.urls)) as executor:
+                passphrases = list(executor.map(self.get_network_passphrase, self.urls))
+            urls = []
+            for url, passphrase in zip(self.urls, passphrases):
+                if passphrase == self.network_passphrase:
+                    urls.append(url)
+                else:
+                    print("Horizon {} does not serve the network '{}' ({}), skipping it".format(
+                        url, self.network_passphrase, passphrase or "no answer"), file=sys.stderr)
+            if len(urls) == 0:
+                raise HorizonConnectionError("No Horizon endpoint serves the network '{}'".format(
+                    self.network_passphrase))
+            self.urls = urls
+            self.network_passphrase = None
+
+    def check_endpoint(self, url):
+        start = time.time()
+        try:
+            response = requests.get(url, timeout=HEALTH_CHECK_TIMEOUT)
+            if response.status_code != 200:
+                return url, None, None
+            return url, time.time() - start, response.json().get("history_latest_ledger")
+        except (requests.RequestException, ValueError):
+            return url, None, None
+
+    def check(self):
+        with ThreadPoolExecutor(max_workers=len(self.urls)) as executor:
+            results = list(executor.map(self.check_endpoint, self.urls))
+        latest_ledger = max([ledger for _, _, ledger in results if ledger is not None] or [0])
+        now = time.time()
+        with self.lock:
+            for url, latency, ledger in results:
+                if latency is None or ledger is None or latest_ledger - ledger > MAX_LEDGER_LAG:
+                    self.failed_until[url] = now + FAILURE_COOLDOWN
+                    self.latency.pop(url, None)
+                else:
+                    self.failed_until.pop(url, None)
+                    self.latency[url] = latency
+            self.checked_at = now
+
+    def get_endpoints(self):
+        # a single endpoint is never health checked, so the default setup costs no extra request
+        self.verify()
+        if len(self.urls) == 1:
+            return list(self.urls)
+        if self.checked_at is None or time.time() - self.checked_at > HEALTH_CHECK_INTERVAL:
+            self.check()
+        now = time.time()
+        with self.lock:
+            healthy = [url for url in self.urls if self.failed_until.get(url, 0) <= now]
+            failed = [url for url in self.urls if url not in healthy]
+            healthy.sort(key=lambda url: self.latency.get(url, HEALTH_CHECK_TIMEOUT))
+            failed.sort(key=lambda url: self.failed_until.get(url))
+        return healthy + failed
+
+    def mark_failed(self, url, reason):
+        if len(self.urls) == 1:
+            return
+        with self.lock:
+            self.failed_until[url] = time.time() + FAILURE_COOLDOWN
+        trace.count("http.failovers", endpoint=url)
+        print("Horizon {} failed ({}), failing over".format(url, reason), file=sys.stderr)
+
+    def split_url(self, url):
+        for endpoint in self.urls:
+            if url.startswith(endpoint):
+                return endpoint, url[len(endpoint):]
+        return None, url
+
+
+def get_pool(horizon_urls, network_passphrase=None):
+    # endpoints other than the built-in ones are checked against network_passphrase before their first use
+    key = tuple(horizon_urls)
+    if key in (tuple(PUBLIC_HORIZON_URLS), tuple(TESTNET_HORIZON_URLS)):
+        network_passphrase = None
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = HorizonPool(horizon_urls, network_passphrase=network_passphrase)
+        return _pools[key]
+
+
+def find_pool(url):
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        if pool.split_url(url)[0] is not None:
+            return pool
+    return None
+
+
+def get_request_urls(url):
+    # the same path on every endpoint of the pool that owns url, best endpoint first
+    pool = find_pool(url)
+    if pool is None:
+        return None, [url]
+    _, path = pool.split_url(url)
+    return pool, [endpoint + path for endpoint in pool.get_endpoints()]
+
+
+class FailoverClient(BaseSyncClient):
+    # wraps the SDK requests client; connection errors and 5xx/429 answers move GET requests to the next endpoint.
+    # POSTs (transaction submissions) go to one endpoint and are never retried here: a timed out submission may
+    # still apply, so only submit.py, which looks up the hash first, may send it again
+
+    def __init__(self):
+        self.client = RequestsClient(pool_size=POOL_SIZE, num_retries=1, request_timeout=_request_timeout,
+                                     post_timeout=POST_TIMEOUT)
+        self.post_client = RequestsClient(pool_size=POOL_SIZE, num_retries=0, request_timeout=_request_timeout,
+                                          post_timeout=POST_TIMEOUT)
+
+    def request(self, method, url, *args, **kwargs):
+        pool, urls = get_request_urls(url)
+        if method == self.post_client.post:
+            urls = urls[:1]
+        for index, request_url in enumerate(urls):
+            last = index == len(urls) - 1
+            try:
+                response = method(request_url, *args, **kwargs)
+                trace.count("http.requests", method=method.__name__, status=response.status_code)
+            except HorizonConnectionError as e:
+                trace.count("http.requests", method=method.__name__, status="error")
+                if pool is None or last:
+                    raise
+                pool.mark_failed(pool.split_url(request_url)[0], str(e))
+                continue
+            if response.status_code in FAILOVER_STATUSES and pool is not None and not last:
+                pool.mark_failed(pool.split_url(request_url)[0], "HTTP {}".format(response.status_code))
+                continue
+            return response
+
+    def get(self, url, params=None):
+        return self.request(self.client.get, url, params)
+
+    def post(self, url, data=None):
+        return self.request(self.post_client.post, url, data)
+
+    def stream(self, url, params=None):
+        _, urls = get_request_urls(url)
+        return self.client.stream(urls[0], params)
+
+    def close(self):
+        self.client.close()
+        self.post_client.close()
+
+
+class AsyncFailoverClient(BaseAsyncClient):
+
+    def __init__(self):
+        self.client = AiohttpClient(pool_size=POOL_SIZE, request_timeout=_request_timeout, post_timeout=POST_TIMEOUT)
+
+    async def get_request_urls(self, url):
+        # the health check uses blocking requests, so it runs off the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, get_request_urls, url)
+
+    async def request(self, method, url, *args, **kwargs):
+        pool, urls = await self.get_request_urls(url)
+        if method == self.client.post:
+            urls = urls[:1]
+        for index, request_url in enumerate(urls):
+            last = index == len(urls) - 1
+            try:
+                response = await method(request_url, *args, **kwargs)
+                trace.count("http.requests", method=method.__name__, status=response.status_code)
+            except HorizonConnectionError as e:
+                trace.count("http.requests", method=method.__name__, status="error")
+                if pool is None or last:
+                    raise
+                pool.mark_failed(pool.split_url(request_url)[0], str(e))
+                continue
+            if response.status_code in FAILOVER_STATUSES and pool is not None and not last:
+                pool.mark_failed(pool.split_url(request_url)[0], "HTTP {}".format(response.status_code))
+                continue
+            return response
+
+    async def get(self, url, params=None):
+        return await self.request(self.client.get, url, params)
+
+    async def post(self, url, data=None):
+        return await self.request(self.client.post, url, data)
+
+    async def stream(self, url, params=None):
+        pool, urls = await self.get_request_urls(url)
+        try:
+            async for message in self.client.stream(urls[0], params):
+                yield message
+        except Exception as e:
+            if pool is not None:
+                pool.mark_failed(pool.split_url(urls[0])[0], str(e))
+            raise
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_http_session():
+    # keep-alive session with timeouts for stellar.toml and federation requests
+    timeout = aiohttp.ClientTimeout(total=_request_timeout, connect=CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=POOL_SIZE))
@@ -0,0 +1,81 @@
+import atexit
+import base64
+import threading
+from stellar_sdk.decorated_signature import DecoratedSignature
+from trezorlib import stellar as trezor_stellar
+from trezorlib import tools as trezor_tools
+from trezorlib import client
+
+
+BIP32_PATH_TEMPLATE = "m/44h/148h/{}h"
+
+_session = None
+_default_account_index = 0
+
+
+class TrezorSession:
+    # opens the device once, keeps the transport session open and caches the address of every account index
+
+    def __init__(self, account_index=0):
+        self.account_index = account_index
+        self.client = None
+        self.addresses = {}
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        if self.client is None:
+            self.client = client.get_default_client()
+            # trezorlib counts open() calls, so calls made while this one is held reuse the same transport session
+            self.client.open()
+        return self.client
+
+    def get_address_n(self, account_index=None):
+        if account_index is None:
+            account_index = self.account_index
+        return trezor_tools.parse_path(BIP32_PATH_TEMPLATE.format(account_index))
+
+    def get_public_key(self, account_index=None):
+        if account_index is None:
+            account_index = self.account_index
+        with self.lock:
+            if account_index not in self.addresses:
+                self.addresses[account_index] = trezor_stellar.get_address(self.get_client(),
+                                                                           self.get_address_n(account_index))
+            return self.addresses[account_index]
+
+    def sign_transaction(self, transaction, public_key, network_passphrase, account_index=None):
+        xdr_data = transaction.to_xdr()
+        tx, operations = trezor_stellar.parse_transaction_bytes(base64.b64decode(xdr_data))
+        with self.lock:
+            resp = trezor_stellar.sign_tx(self.get_client(), tx, operations, self.get_address_n(account_index),
+                                          network_passphrase)
+        transaction.signatures.append(DecoratedSignature(public_key.signature_hint(), resp.signature))
+        return transaction
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+
+def set_default_account_index(account_index):
+    global _default_account_index
+    _default_account_index = account_index
+
+
+def get_session():
+    # one session per process, shared by every Trezor operation and closed when the process exits
+    global _session
+    if _session is None:
+        _session = TrezorSession(account_index=_default_account_index)
+        atexit.register(_session.close)
+    return _session
+
+
+def get_trezor_public_key():
+    return get_session().get_public_key()
+
+
+def sign_trezor_transaction(transaction, public_key, network_passphrase):
+    return get_session().sign_transaction(transaction, public_key, network_passphrase=network_passphrase)
@@ -0,0 +1,13 @@
+from .fileops import load_wallet_public_key
+
+
+def generate_qr_code_url(public_key):
+    url = "https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={}".format(public_key)
+    return url
+
+
+def retrieve_stellar_wallet_public_key(wallet_file, generate_qr_code_link=False):
+    public_key = load_wallet_public_key(wallet_file=wallet_file)
+    print(public_key)
+    if generate_qr_code_link:
+        print(generate_qr_code_url(public_key))
@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+WALLET = os.path.join(ROOT, "test_wallet.json")
+WALLET_ACCOUNT = "GCREGQJ46EELU5LAR2SSSR7CWIVJFB56YM73HXQUNR455KFPI6QAGSRY"
+DESTINATION = "GATU7FV3IOUI4M6QWQXWSDUVTJJKD7ONJSBOJ4IJEETE5SPBW6JHAI22"
+
+
+@pytest.fixture
+def horizon(monkeypatch, tmp_path):
+    # a fresh mock Horizon per test; the CLI talks to it only and keeps its cache in tmp_path
+    from mock_horizon import start_mock_horizon
+    from stellarops import cache, submit, transport
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(submit.time, "sleep", lambda seconds: None)
+    cache.set_enabled(False)
+    server, horizon_url = start_mock_horizon()
+    transport.set_horizon_urls([horizon_url])
+    yield server
+    transport.set_horizon_urls(None)
+    server.shutdown()
+
+
+@pytest.fixture
+def ledger(horizon):
+    return horizon.RequestHandlerClass.ledger
@@ -0,0 +1,27 @@
+import json
+import shutil
+from conftest import DESTINATION, WALLET, WALLET_ACCOUNT
+from stellarops import operations
+from stellarops.fileops import read_account_list
+
+
+def test_wallet_file_without_json_extension_is_one_entry(tmp_path):
+    wallet_file = str(tmp_path / "wallet")
+    shutil.copy(WALLET, wallet_file)
+    assert read_account_list(wallet_file) == [wallet_file]
+    list_file = tmp_path / "accounts.txt"
+    list_file.write_text("{}\n# comment\n{}\n".format(wallet_file, DESTINATION))
+    assert read_account_list(str(list_file)) == [wallet_file, DESTINATION]
+
+
+def test_bad_entries_are_reported_per_account(horizon, tmp_path, capsys):
+    broken_file = tmp_path / "broken.json"
+    broken_file.write_text("{")
+    no_key_file = tmp_path / "no_key.json"
+    no_key_file.write_text(json.dumps({"public_key": "GNOTAKEY"}))
+    entries = [WALLET, str(tmp_path / "missing.json"), str(broken_file), str(no_key_file), DESTINATION]
+    operations.balance_report(accounts=",".join(entries), test_mode=True)
+    report = json.loads(capsys.readouterr().out)
+    errors = [account.get("error") is not None for account in report.get("accounts")]
+    assert errors == [False, True, True, True, False]
+    assert report.get("accounts")[0].get("account_id") == WALLET_ACCOUNT
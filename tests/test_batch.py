@@ -0,0 +1,74 @@
+import json
+from conftest import DESTINATION, WALLET, WALLET_ACCOUNT
+from stellarops import fees, operations
+
+MUXED_DESTINATION = "MA7QYNF7SOWQ3GLR2BGMZEHXAVIRZA4KVWLTJJFC7MGXUA74P7UJUAAAAAAAAAAAACJUQ"
+
+
+def run_batch(tmp_path, rows):
+    payment_file = tmp_path / "payments.csv"
+    report_file = tmp_path / "report.jsonl"
+    lines = ["destination,amount"] + ["{},{}".format(destination, amount) for destination, amount in rows]
+    payment_file.write_text("\n".join(lines) + "\n")
+    operations.send_batch(wallet_file=WALLET, payment_file=str(payment_file), report_file=str(report_file),
+                          test_mode=True, check_destinations=False)
+    return [json.loads(line) for line in report_file.read_text().splitlines()]
+
+
+def test_invalid_rows_are_rejected_and_the_rest_is_sent(ledger, tmp_path):
+    report = run_batch(tmp_path, [
+        (DESTINATION, "1"),
+        ("GNOTANACCOUNT", "1"),
+        (DESTINATION[:-1] + "A", "1"),
+        (DESTINATION, "0.00000001"),
+        (DESTINATION, "NaN"),
+        (DESTINATION, "Infinity"),
+        (DESTINATION, "-1"),
+        (DESTINATION, "1000000000000"),
+        (DESTINATION, "2.5"),
+    ])
+    statuses = dict((line.get("row"), line.get("status")) for line in report)
+    assert [row for row, status in sorted(statuses.items()) if status == "rejected"] == [2, 3, 4, 5, 6, 7, 8]
+    assert statuses[1] == statuses[9] == "success"
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 1
+
+
+def test_muxed_destination_needs_sep_0023(monkeypatch, ledger, tmp_path):
+    report = run_batch(tmp_path, [(MUXED_DESTINATION, "1")])
+    assert report[0].get("status") == "rejected"
+    assert "SEP-0023" in report[0].get("error")
+    monkeypatch.setenv("ENABLE_SEP_0023", "true")
+    report = run_batch(tmp_path, [(MUXED_DESTINATION, "1"), (MUXED_DESTINATION[:-1] + "A", "1")])
+    assert [line.get("status") for line in report] == ["rejected", "success"]
+
+
+def test_domain_messages_do_not_go_to_the_report(monkeypatch, capsys):
+    monkeypatch.setattr(operations, "get_asset_data_from_domain", lambda asset_code, asset_domain: (None, None, None))
+    assert operations.get_asset_from_domain("USD@example.com") == (None, None, None)
+    assert operations.process_destination_address(None) is None
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "Could not identify token" in captured.err
+
+
+def test_fee_is_chosen_for_every_envelope(monkeypatch, ledger, tmp_path):
+    charged = iter([100, 300])
+    monkeypatch.setattr(fees, "get_fee_stats", lambda server: {"fee_charged": {"p70": str(next(charged))},
+                                                               "last_ledger_base_fee": "100"})
+    payment_file = tmp_path / "payments.csv"
+    report_file = tmp_path / "report.jsonl"
+    payment_file.write_text("destination,amount\n{0},1\n{0},2\n".format(DESTINATION))
+    operations.send_batch(wallet_file=WALLET, payment_file=str(payment_file), report_file=str(report_file),
+                          test_mode=True, check_destinations=False, batch_size=1)
+    report = [json.loads(line) for line in report_file.read_text().splitlines()]
+    assert [line.get("base_fee") for line in report] == [100, 300]
+
+
+def test_stdout_report_stays_ndjson(ledger, tmp_path, capsys):
+    payment_file = tmp_path / "payments.csv"
+    payment_file.write_text("destination,amount\n{0},1\n{0},2\n".format(DESTINATION))
+    operations.send_batch(wallet_file=WALLET, payment_file=str(payment_file), test_mode=True,
+                          check_destinations=False)
+    captured = capsys.readouterr()
+    assert [json.loads(line).get("status") for line in captured.out.splitlines()] == ["success", "success"]
+    assert json.loads(captured.err[captured.err.index("{"):]).get("success") == 2
@@ -0,0 +1,23 @@
+import threading
+from stellarops import cache
+
+
+def test_connection_is_kept_per_thread_and_currencies_share_a_transaction(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(cache, "_enabled", True)
+    connection = cache._connect()
+    assert cache._connect() is connection
+    other = []
+    thread = threading.Thread(target=lambda: other.append(cache._connect()))
+    thread.start()
+    thread.join()
+    assert other[0] is not connection
+
+    statements = []
+    connection.set_trace_callback(statements.append)
+    cache.put_asset_issuers("example.com", [("USD", "GUSD"), ("EUR", "GEUR")])
+    assert statements.count("BEGIN ") == 1
+    assert cache.get_asset_issuer("EUR", "example.com") == "GEUR"
+
+    cache.purge()
+    assert cache._connect() is not connection
@@ -0,0 +1,62 @@
+import base64
+import json
+import os
+from cryptography.fernet import Fernet
+from stellar_sdk import Keypair
+from conftest import DESTINATION, WALLET
+from stellarops import fileops, operations
+
+
+def use_password(monkeypatch, password):
+    monkeypatch.setattr("getpass.getpass", lambda prompt="", stream=None: password)
+
+
+def test_channel_secrets_use_the_wallet_key_format(monkeypatch, tmp_path):
+    use_password(monkeypatch, "secret")
+    channel_file = str(tmp_path / "channels.json")
+    channels = [Keypair.random() for i in range(2)]
+    fileops.write_channels(channel_file, [c.secret for c in channels], [c.public_key for c in channels])
+    json_data = json.loads(open(channel_file).read())
+    assert json_data.get("version") == fileops.WALLET_VERSION
+    assert json_data.get("kdf").get("name") == fileops.DEFAULT_KDF
+    assert channels[0].secret not in json_data.get("private_keys")
+    assert fileops.load_channels(channel_file) == [(c.secret, c.public_key) for c in channels]
+
+
+def test_legacy_channel_files_still_load(monkeypatch, tmp_path):
+    use_password(monkeypatch, "secret")
+    channel = Keypair.random()
+    kdf = {"name": "pbkdf2-sha256", "salt": base64.b64encode(os.urandom(16)).decode("ascii"), "iterations": 100000}
+    token = Fernet(fileops.derive_key("secret", kdf)).encrypt(json.dumps([channel.secret]).encode("ascii"))
+    channel_file = tmp_path / "channels.json"
+    channel_file.write_text(json.dumps({"public_keys": [channel.public_key], "private_keys": "{}${}".format(
+        kdf.get("salt"), base64.b64encode(token).decode("ascii"))}))
+    assert fileops.load_channels(str(channel_file)) == [(channel.secret, channel.public_key)]
+
+
+def test_failing_batch_does_not_stop_the_run(monkeypatch, ledger, tmp_path, capsys):
+    wallet_file = tmp_path / "wallet.json"
+    wallet_file.write_text(open(WALLET).read())
+    use_password(monkeypatch, "")
+    channels = [Keypair.random() for i in range(2)]
+    fileops.write_channels(fileops.get_channel_file(str(wallet_file)), [c.secret for c in channels],
+                           [c.public_key for c in channels])
+    submit_payment_batch = operations.submit_payment_batch
+
+    def fail_first_batch(batch, **kwargs):
+        if batch[0].get("row") == 1:
+            raise RuntimeError("device disconnected")
+        return submit_payment_batch(batch, **kwargs)
+
+    monkeypatch.setattr(operations, "submit_payment_batch", fail_first_batch)
+    payment_file = tmp_path / "payments.csv"
+    report_file = tmp_path / "report.jsonl"
+    payment_file.write_text("destination,amount\n{0},1\n{0},2\n{0},3\n".format(DESTINATION))
+    capsys.readouterr()
+    operations.send_batch(wallet_file=str(wallet_file), payment_file=str(payment_file),
+                          report_file=str(report_file), test_mode=True, check_destinations=False, batch_size=1,
+                          use_channels=True)
+    report = sorted([json.loads(line) for line in report_file.read_text().splitlines()], key=lambda l: l.get("row"))
+    assert [line.get("status") for line in report] == ["failed", "success", "success"]
+    assert report[0].get("error") == "device disconnected"
+    assert json.loads(capsys.readouterr().out).get("failed") == 1
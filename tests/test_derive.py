@@ -0,0 +1,49 @@
+import shutil
+import subprocess
+import sys
+from conftest import ROOT, WALLET
+from stellarops import hdwallet, operations
+
+
+def create_hd_wallet(monkeypatch, wallet_file):
+    monkeypatch.setattr("getpass.getpass", lambda prompt="", stream=None: "")
+    operations.create_stellar_wallet(wallet_file=str(wallet_file), use_mnemonic=True)
+
+
+def test_derived_accounts_match_the_wallet_seed(monkeypatch, tmp_path, capsys):
+    wallet_file = tmp_path / "hd.json"
+    create_hd_wallet(monkeypatch, wallet_file)
+    summary = operations.derive_accounts(wallet_file=str(wallet_file), count=3)
+    assert summary.get("derived") == 3
+    assert operations.derive_accounts(wallet_file=str(wallet_file), count=3, start=0).get("already_known") == 3
+    seed = operations.load_wallet_seed(wallet_file=str(wallet_file))
+    connection = hdwallet.connect(summary.get("index_file"), operations.get_public_key(str(wallet_file)))
+    try:
+        assert hdwallet.list_accounts(connection) == list(hdwallet.derive_public_keys(seed, 0, 3))
+    finally:
+        connection.close()
+
+
+def test_table_of_another_seed_is_refused(monkeypatch, tmp_path, capsys):
+    first_wallet, second_wallet = tmp_path / "first.json", tmp_path / "second.json"
+    create_hd_wallet(monkeypatch, first_wallet)
+    create_hd_wallet(monkeypatch, second_wallet)
+    operations.derive_accounts(wallet_file=str(first_wallet), count=2)
+    shutil.copy(hdwallet.get_index_file(str(first_wallet)), hdwallet.get_index_file(str(second_wallet)))
+    capsys.readouterr()
+    assert operations.derive_accounts(wallet_file=str(second_wallet), count=2) is None
+    assert "was derived for" in capsys.readouterr().out
+
+
+def test_trezor_tables_are_kept_per_device():
+    first = hdwallet.get_index_file(None, owner="GFIRST")
+    assert first != hdwallet.get_index_file(None, owner="GSECOND")
+    assert "GFIRST" in first
+
+
+def test_account_index_needs_an_hd_wallet(tmp_path):
+    result = subprocess.run([sys.executable, "stellar-cli.py", "-t", "-w", WALLET, "--account-index", "1",
+                             "list_balances"], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "no HD seed" in result.stdout
+    assert "Traceback" not in result.stderr
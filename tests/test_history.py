@@ -0,0 +1,22 @@
+import pytest
+from stellar_sdk import Network
+from stellarops import history, operations
+
+
+def test_date_only_until_covers_the_whole_day():
+    assert operations.format_timestamp(operations.parse_until("2021-01-31")) == "2021-01-31T23:59:59Z"
+    assert operations.format_timestamp(operations.parse_until("2021-01-31T12:00:00Z")) == "2021-01-31T12:00:00Z"
+
+
+def test_history_database_belongs_to_one_network(tmp_path):
+    history_file = str(tmp_path / "history.db")
+    history.connect(history_file, Network.TESTNET_NETWORK_PASSPHRASE).close()
+    history.connect(history_file, Network.TESTNET_NETWORK_PASSPHRASE).close()
+    with pytest.raises(ValueError):
+        history.connect(history_file, Network.PUBLIC_NETWORK_PASSPHRASE)
+
+
+def test_default_history_file_is_per_network():
+    testnet = operations.get_history_file({"network_passphrase": Network.TESTNET_NETWORK_PASSPHRASE})
+    pubnet = operations.get_history_file({"network_passphrase": Network.PUBLIC_NETWORK_PASSPHRASE})
+    assert testnet != pubnet
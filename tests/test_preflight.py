@@ -0,0 +1,21 @@
+from stellar_sdk import Asset
+from conftest import DESTINATION, WALLET_ACCOUNT
+from stellarops import preflight
+
+ASSET = Asset("USD", WALLET_ACCOUNT)
+
+
+def get_account(balance):
+    return {"balances": [{"asset_code": "USD", "asset_issuer": WALLET_ACCOUNT, "balance": balance, "limit": "100"}]}
+
+
+def test_reloaded_records_do_not_count_landed_payments_twice():
+    pending = {}
+    assert preflight.check_entry(get_account("0"), {"destination": DESTINATION, "asset": ASSET, "amount": "60"},
+                                 pending) is None
+    # the record is reloaded after the first payment landed
+    assert preflight.check_entry(get_account("60"), {"destination": DESTINATION, "asset": ASSET, "amount": "30"},
+                                 pending) is None
+    error = preflight.check_entry(get_account("90"), {"destination": DESTINATION, "asset": ASSET, "amount": "20"},
+                                  pending)
+    assert error.startswith("op_line_full")
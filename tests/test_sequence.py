@@ -0,0 +1,37 @@
+import json
+import subprocess
+import sys
+import pytest
+from conftest import ROOT, WALLET, WALLET_ACCOUNT
+from stellarops import operations
+from stellarops.sequence import OfflineSequenceManager
+
+
+def read_sequence(sequence_file):
+    return int(json.loads(sequence_file.read_text())[WALLET_ACCOUNT])
+
+
+def test_sequence_file_only_advances_after_a_build(tmp_path):
+    sequence_file = tmp_path / "sequences.json"
+    sequence_file.write_text(json.dumps({WALLET_ACCOUNT: "100"}))
+    sequence_manager = OfflineSequenceManager(str(sequence_file))
+
+    def fail(account):
+        raise ValueError("refused")
+
+    with pytest.raises(ValueError):
+        operations.build_with_sequence(sequence_manager, WALLET_ACCOUNT, fail)
+    assert read_sequence(sequence_file) == 100
+    account = operations.build_with_sequence(sequence_manager, WALLET_ACCOUNT, lambda account: account)
+    assert account.sequence == 100
+    assert read_sequence(sequence_file) == 101
+
+
+def test_sequence_file_is_refused_for_other_commands(tmp_path):
+    sequence_file = tmp_path / "sequences.json"
+    sequence_file.write_text(json.dumps({WALLET_ACCOUNT: "100"}))
+    result = subprocess.run([sys.executable, "stellar-cli.py", "-t", "-w", WALLET, "--sequence-file",
+                             str(sequence_file), "submit_tx", "-f", "-"], cwd=ROOT, capture_output=True, text=True,
+                            input="")
+    assert result.returncode == 1
+    assert "--sequence-file only works with" in result.stdout
@@ -0,0 +1,43 @@
+from conftest import DESTINATION, WALLET, WALLET_ACCOUNT
+from stellarops import operations
+
+
+def send(**kwargs):
+    return operations.send_payment(wallet_file=WALLET, asset=None, issuer=None, amount=1, destination=DESTINATION,
+                                   test_mode=True, check_destination=False, **kwargs)
+
+
+def test_payment_is_submitted_once(ledger):
+    result = send()
+    assert result.get("successful")
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 1
+
+
+def test_timed_out_payment_that_landed_is_not_sent_again(horizon, ledger):
+    # the first POST is applied but times out, the lookup doesn't see it yet and the re-POST gets tx_bad_seq
+    horizon.RequestHandlerClass.dropped_submissions = 1
+    horizon.RequestHandlerClass.hidden_lookups = 1
+    result = send()
+    transactions = ledger.account_transactions[WALLET_ACCOUNT]
+    assert len(transactions) == 1
+    assert result.get("hash") == transactions[0].get("hash")
+
+
+def test_stale_sequence_is_rebuilt_once(ledger):
+    send()
+    operations.get_sequence_manager(operations.get_network_settings(test_mode=True)).forget(WALLET_ACCOUNT)
+    ledger.sequences[WALLET_ACCOUNT] += 1
+    result = send()
+    assert result.get("successful")
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 2
+
+
+def test_unreachable_horizon_is_reported_as_failure(horizon):
+    horizon.shutdown()
+    horizon.server_close()
+    result = send()
+    assert result.get("error") is not None
+
+
+def test_payment_result_has_the_base_fee(ledger):
+    assert send().get("base_fee") == 100
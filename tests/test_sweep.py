@@ -0,0 +1,50 @@
+import json
+from decimal import Decimal
+from stellar_sdk import Keypair
+from conftest import DESTINATION, WALLET, WALLET_ACCOUNT
+from stellarops import operations
+
+
+def create_accounts(tmp_path, count):
+    wallet_files = []
+    for i in range(count):
+        keypair = Keypair.random()
+        wallet_file = tmp_path / "account{}.json".format(i)
+        wallet_file.write_text(json.dumps({"version": 2, "public_key": keypair.public_key,
+                                           "private_key": keypair.secret}))
+        wallet_files.append(str(wallet_file))
+    return ",".join(wallet_files)
+
+
+def run_sweep(tmp_path, accounts, **kwargs):
+    report_file = tmp_path / "sweep.jsonl"
+    summary = operations.sweep(wallet_file=WALLET, accounts=accounts, destination=DESTINATION,
+                               report_file=str(report_file), test_mode=True, **kwargs)
+    report = [json.loads(line) for line in report_file.read_text().splitlines()] if report_file.exists() else []
+    return summary, report
+
+
+def test_sweep_keeps_the_reserve_of_the_latest_ledger(ledger, tmp_path):
+    ledger.base_reserve = 10000000
+    summary, report = run_sweep(tmp_path, create_accounts(tmp_path, 2))
+    assert summary.get("base_reserve") == "1"
+    native = [line for line in report if line.get("asset") == "XLM"]
+    assert [Decimal(line.get("amount")) for line in native] == [Decimal("9998")] * 2
+    assert all(line.get("status") == "success" for line in report)
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 1
+
+
+def test_merge_into_a_missing_destination_is_refused(ledger, tmp_path, capsys):
+    ledger.missing_accounts.add(DESTINATION)
+    summary, report = run_sweep(tmp_path, create_accounts(tmp_path, 1), merge=True)
+    assert summary is None
+    assert "op_no_destination" in capsys.readouterr().out
+    assert WALLET_ACCOUNT not in ledger.account_transactions
+
+
+def test_fee_account_keeps_its_xlm(ledger, tmp_path):
+    summary, report = run_sweep(tmp_path, create_accounts(tmp_path, 1) + "," + WALLET)
+    swept = [line.get("asset") for line in report if line.get("account") == WALLET_ACCOUNT]
+    assert len(swept) > 0 and "XLM" not in swept
+    assert len([line for line in report if line.get("asset") == "XLM"]) == 1
+    assert all(line.get("status") == "success" for line in report)
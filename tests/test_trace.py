@@ -0,0 +1,31 @@
+from stellarops import trace
+
+
+def record(monkeypatch):
+    monkeypatch.setattr(trace, "_enabled", True)
+    monkeypatch.setattr(trace, "_spans", {})
+    monkeypatch.setattr(trace, "_counters", {})
+    trace.count("http.requests", method="GET")
+    trace.count("http.requests", method="POST")
+    trace.record_span("horizon.accounts", 0.1)
+    trace.record_span("horizon.accounts", 0.3)
+    trace.record_span("command", 0.5, {"command": 'a\\b"c\nd'})
+
+
+def test_prometheus_has_types_and_escaped_labels(monkeypatch):
+    record(monkeypatch)
+    lines = trace.format_prometheus().splitlines()
+    assert lines[0] == "# TYPE stellar_cli_http_requests_total counter"
+    assert lines.count("# TYPE stellar_cli_http_requests_total counter") == 1
+    assert "# TYPE stellar_cli_span_seconds summary" in lines
+    assert "# TYPE stellar_cli_span_seconds_max gauge" in lines
+    assert 'stellar_cli_span_seconds_count{span="command",command="a\\\\b\\"c\\nd"} 1' in lines
+
+
+def test_statsd_sends_counts_and_sums(monkeypatch):
+    record(monkeypatch)
+    lines = trace.format_statsd().splitlines()
+    assert "stellar_cli.horizon.accounts.count:2|c" in lines
+    assert "stellar_cli.horizon.accounts.sum_ms:400.000|c" in lines
+    assert "stellar_cli.horizon.accounts.max_ms:300.000|g" in lines
+    assert not any(line.endswith("|ms") for line in lines)
@@ -0,0 +1,34 @@
+import sys
+import types
+from stellar_sdk import Account, Asset, Keypair, Network, TransactionBuilder
+from stellar_sdk.helpers import parse_transaction_envelope_from_xdr
+from conftest import DESTINATION
+
+
+def test_trezor_signature_survives_to_xdr(monkeypatch):
+    # trezorlib is replaced by a device that signs with a local key
+    keypair = Keypair.random()
+    trezor_stellar = types.SimpleNamespace(
+        parse_transaction_bytes=lambda data: (None, []),
+        sign_tx=lambda client, tx, operations, address_n, network_passphrase: types.SimpleNamespace(
+            signature=keypair.sign(transaction.hash())))
+    trezorlib = types.ModuleType("trezorlib")
+    trezorlib.stellar = trezor_stellar
+    trezorlib.tools = types.SimpleNamespace(parse_path=lambda path: path)
+    trezorlib.client = types.SimpleNamespace(get_default_client=lambda: types.SimpleNamespace(open=lambda: None))
+    monkeypatch.setitem(sys.modules, "trezorlib", trezorlib)
+    # the module is imported against the fake trezorlib and dropped again when the test ends
+    monkeypatch.setitem(sys.modules, "stellarops.trezor", None)
+    monkeypatch.delitem(sys.modules, "stellarops.trezor")
+    import stellarops
+    monkeypatch.delattr(stellarops, "trezor", raising=False)
+    from stellarops import trezor
+
+    transaction = TransactionBuilder(Account(keypair.public_key, 1), Network.TESTNET_NETWORK_PASSPHRASE, 100) \
+        .append_payment_op(DESTINATION, Asset.native(), "1").set_timeout(30).build()
+    public_key = Keypair.from_public_key(keypair.public_key)
+    trezor.TrezorSession().sign_transaction(transaction, public_key, Network.TESTNET_NETWORK_PASSPHRASE)
+    envelope = parse_transaction_envelope_from_xdr(transaction.to_xdr(), Network.TESTNET_NETWORK_PASSPHRASE)
+    signature = envelope.signatures[0]
+    assert signature.signature_hint == keypair.signature_hint()
+    public_key.verify(envelope.hash(), signature.signature)
@@ -0,0 +1,51 @@
+import json
+from stellar_sdk import Keypair
+from stellarops import agent, fileops, trace
+
+
+def write_encrypted_wallet(monkeypatch, tmp_path):
+    monkeypatch.setattr("getpass.getpass", lambda prompt="", stream=None: "secret")
+    wallet_file = str(tmp_path / "wallet.json")
+    keypair = Keypair.random()
+    fileops.write_wallet(wallet_file, keypair.secret, keypair.public_key, kdf_name="pbkdf2-sha256")
+    return wallet_file
+
+
+def test_keys_reach_the_agent_only_on_unlock(monkeypatch, tmp_path):
+    wallet_file = write_encrypted_wallet(monkeypatch, tmp_path)
+    stored = []
+    monkeypatch.setattr(agent, "get_key", lambda key_id: None)
+    monkeypatch.setattr(agent, "put_key", lambda key_id, key, timeout=None: stored.append(key_id) or True)
+    assert fileops.get_wallet_key(fileops.read_wallet_data(wallet_file)) is not None
+    assert stored == []
+    assert fileops.unlock_wallet(wallet_file)
+    assert len(stored) == 1
+
+
+def test_migration_keeps_earlier_backups(monkeypatch, tmp_path):
+    wallet_file = write_encrypted_wallet(monkeypatch, tmp_path)
+    monkeypatch.setattr(agent, "get_key", lambda key_id: None)
+    original = fileops.read_wallet_data(wallet_file)
+    first = fileops.migrate_wallet(wallet_file, kdf_name="pbkdf2-sha256")
+    migrated = fileops.read_wallet_data(wallet_file)
+    second = fileops.migrate_wallet(wallet_file, kdf_name="pbkdf2-sha256")
+    assert first == wallet_file + ".bak" and second != first
+    assert json.loads(open(first).read()) == original
+    assert json.loads(open(second).read()) == migrated
+
+
+def test_decrypt_span_does_not_time_the_prompt(monkeypatch, tmp_path):
+    wallet_file = write_encrypted_wallet(monkeypatch, tmp_path)
+    monkeypatch.setattr(agent, "get_key", lambda key_id: None)
+    clock = [0.0]
+    monkeypatch.setattr(trace.time, "perf_counter", lambda: clock[0])
+    monkeypatch.setattr(trace, "_enabled", True)
+    monkeypatch.setattr(trace, "_spans", {})
+
+    def type_password(prompt="", stream=None):
+        clock[0] += 60
+        return "secret"
+    monkeypatch.setattr("getpass.getpass", type_password)
+    fileops.load_wallet(wallet_file)
+    count, total, slowest = trace._spans[("wallet.decrypt", ())]
+    assert count == 1 and total == 0
@@ -0,0 +1,58 @@
+import json
+from stellar_sdk import Account, Asset, Network, TransactionBuilder
+from conftest import DESTINATION, WALLET, WALLET_ACCOUNT
+from mock_horizon import START_SEQUENCE
+from stellarops import operations
+
+
+def build_envelope(keypair, sequence, fee_bump=False, sign=True):
+    transaction = TransactionBuilder(source_account=Account(account=WALLET_ACCOUNT, sequence=sequence),
+                                     network_passphrase=Network.TESTNET_NETWORK_PASSPHRASE, base_fee=100) \
+        .append_payment_op(destination=DESTINATION, asset=Asset.native(), amount="1") \
+        .set_timeout(3600).build()
+    if sign:
+        transaction.sign(keypair)
+    if fee_bump:
+        transaction = TransactionBuilder.build_fee_bump_transaction(
+            fee_source=keypair.public_key, base_fee=200, inner_transaction_envelope=transaction,
+            network_passphrase=Network.TESTNET_NETWORK_PASSPHRASE)
+        transaction.sign(keypair)
+    return transaction.to_xdr()
+
+
+def test_submit_file_rejects_bad_lines_and_submits_the_rest(monkeypatch, ledger, tmp_path, capsys):
+    keypair = operations.get_keypair(wallet_file=WALLET)
+    xdr_file = tmp_path / "envelopes.txt"
+    xdr_file.write_text("\n".join([build_envelope(keypair, START_SEQUENCE), "not an envelope",
+                                   build_envelope(keypair, START_SEQUENCE + 1, fee_bump=True)]) + "\n")
+    report_file = tmp_path / "report.jsonl"
+    monkeypatch.setattr("builtins.input", lambda prompt: "SUBMIT")
+    operations.submit_transactions_from_file(str(xdr_file), report_file=str(report_file), test_mode=True)
+    report = [json.loads(line) for line in report_file.read_text().splitlines()]
+    assert [line.get("status") for line in report] == ["rejected", "success", "success"]
+    assert report[0].get("line") == 2
+    assert json.loads(capsys.readouterr().out) == {"success": 2, "failed": 0, "rejected": 1}
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 2
+
+
+def test_sign_file_reports_bad_lines_and_signs_the_rest(monkeypatch, horizon, tmp_path, capsys):
+    keypair = operations.get_keypair(wallet_file=WALLET)
+    xdr_file = tmp_path / "envelopes.txt"
+    xdr_file.write_text("\n".join(["# envelopes", "AAAA", build_envelope(keypair, START_SEQUENCE, sign=False),
+                                   build_envelope(keypair, START_SEQUENCE + 1, fee_bump=True)]))
+    output_file = tmp_path / "signed.txt"
+    monkeypatch.setattr("builtins.input", lambda prompt: "SIGN")
+    operations.sign_transactions_from_file(WALLET, str(xdr_file), output_file=str(output_file), test_mode=True,
+                                           just_sign=True)
+    rejected = [json.loads(line) for line in capsys.readouterr().err.splitlines() if line.startswith("{")]
+    assert [(line.get("line"), line.get("status")) for line in rejected] == [(2, "rejected"), (4, "rejected")]
+    assert "already signed" in rejected[1].get("error")
+    assert len(output_file.read_text().splitlines()) == 1
+
+
+def test_daemon_submits_fee_bump_envelopes(ledger):
+    from stellarops import daemon
+    keypair = operations.get_keypair(wallet_file=WALLET)
+    response = daemon.Daemon(test_mode=True).submit_tx({"xdr": build_envelope(keypair, START_SEQUENCE, fee_bump=True)})
+    assert response.get("successful") is True
+    assert len(ledger.account_transactions[WALLET_ACCOUNT]) == 1